@@ -0,0 +1,231 @@
+'''
+Match analytics for the Ravens Nest.
+Designed by Ahasuerus for Armored Scrims Server
+
+Keeps running totals over every reported match: per-map win rates by rank
+band, head-to-head records, win/loss streaks, and a calibration curve of
+the win probability predicted before each match against how it actually
+went. The calibration curve is how to tell whether the K factor of
+ELO_formula is right: predictions that come true less often than they
+claim mean ratings overshoot. Everything is updated in O(participants) when
+a result is reported, so no query ever scans match history. The totals are
+kept per guild in analytics.json.
+
+usage: python -m ravens_nest.analytics <guild data directory> [--match-type 1v1]
+'''
+import os
+import sys
+import json
+import argparse
+from typing import Optional
+from rich.table import Table
+from rich.console import Console
+from ravens_nest.elo_core import *
+
+# constants
+CALIBRATION_BINS = 10 # predicted win probability buckets, 0-10%, 10-20%, ...
+MATCH_TYPES = ('1v1', '3v3 flex', '3v3 reg')
+
+
+class MatchAnalytics:
+    '''
+    Class holding running match statistics for one guild
+    '''
+    map_results: dict # match type -> map -> rank band -> [wins, games]
+    head_to_head: dict # match type -> name -> opponent name -> [wins, losses], stored under the lower name only
+    streaks: dict # match type -> name -> [current streak (+wins or -losses), best win streak]
+    calibration: dict # match type -> CALIBRATION_BINS x [matches, summed predicted probability, wins]
+
+    def __init__(self):
+        self.map_results = {match_type: {} for match_type in MATCH_TYPES}
+        self.head_to_head = {match_type: {} for match_type in MATCH_TYPES}
+        self.streaks = {match_type: {} for match_type in MATCH_TYPES}
+        self.calibration = {match_type: [[0, 0.0, 0] for _ in range(CALIBRATION_BINS)] for match_type in MATCH_TYPES}
+
+    def record(self, match_obj: match, result: MatchResult, count: int = 1):
+        '''
+        Fold a reported match into the running totals
+
+        :param match_obj: The match, after report_match_results
+        :param result: What report_match_results returned, whose ranks and prediction predate the result
+        :param count: -1 takes a reverted result back out, see retract
+        '''
+        match_type = match_obj.match_type
+        band = lambda change: RANKS[rank_ordinal(change.rank_before)]
+        winners = [change.name for change in result.winners]
+        losers = [change.name for change in result.losers]
+
+        maps = self.map_results[match_type].setdefault(match_obj.match_map, {})
+        for changes, won in ((result.winners, True), (result.losers, False)):
+            for change in changes:
+                totals = maps.setdefault(band(change), [0, 0])
+                totals[0] += won * count
+                totals[1] += count
+
+        records = self.head_to_head[match_type]
+        for name in winners:
+            for opponent in losers:
+                first, second = (name, opponent) if name < opponent else (opponent, name)
+                totals = records.setdefault(first, {}).setdefault(second, [0, 0])
+                totals[0 if first == name else 1] += count
+
+        streaks = self.streaks[match_type]
+        if count > 0:
+            for names, won in ((winners, True), (losers, False)):
+                for name in names:
+                    streak = streaks.setdefault(name, [0, 0])
+                    if won:
+                        streak[0] = streak[0] + 1 if streak[0] > 0 else 1
+                        streak[1] = max(streak[1], streak[0])
+                    else:
+                        streak[0] = streak[0] - 1 if streak[0] < 0 else -1
+
+        self._record_calibration(match_type, result, count)
+
+    def _record_calibration(self, match_type: str, result: MatchResult, count: int):
+        # both sides' predictions are recorded, so the curve is symmetric around 50%
+        for predicted, won in ((result.win_probability, True), (1 - result.win_probability, False)):
+            bucket = self.calibration[match_type][min(int(predicted * CALIBRATION_BINS), CALIBRATION_BINS - 1)]
+            bucket[0] += count
+            bucket[1] += predicted * count
+            bucket[2] += won * count
+
+    def retract(self, match_obj: match, result: MatchResult):
+        '''
+        Take a reverted result back out of the totals. Streaks keep it, a streak cannot be unwound.
+        '''
+        self.record(match_obj, result, -1)
+
+    # queries
+    def map_win_rates(self, match_type: str):
+        '''
+        returns: list of (map, {rank band: (win rate, games)}), maps in name order
+        '''
+        return [(map_name, {band: (wins / games, games) for band, (wins, games) in bands.items() if games})
+                for map_name, bands in sorted(self.map_results[match_type].items()) if any(games for _, games in bands.values())]
+
+    def record_between(self, match_type: str, name: str, opponent: str):
+        '''
+        returns: (wins, losses) of name against opponent
+        '''
+        first, second = (name, opponent) if name < opponent else (opponent, name)
+        wins, losses = self.head_to_head[match_type].get(first, {}).get(second, (0, 0))
+        return (wins, losses) if first == name else (losses, wins)
+
+    def streak(self, match_type: str, name: str):
+        '''
+        returns: (current streak, positive for wins and negative for losses, best win streak)
+        '''
+        return tuple(self.streaks[match_type].get(name, (0, 0)))
+
+    def calibration_curve(self, match_type: Optional[str] = None):
+        '''
+        Predicted against actual win rate per probability bucket, over one match type or all of them
+
+        returns: list of (bucket low, bucket high, predictions, mean predicted probability, actual win rate)
+        '''
+        totals = [[0, 0.0, 0] for _ in range(CALIBRATION_BINS)]
+        for kind in ([match_type] if match_type else MATCH_TYPES):
+            for total, bucket in zip(totals, self.calibration[kind]):
+                for i in range(3):
+                    total[i] += bucket[i]
+        return [(i / CALIBRATION_BINS, (i + 1) / CALIBRATION_BINS, count, predicted / count, wins / count)
+                for i, (count, predicted, wins) in enumerate(totals) if count]
+
+    def calibration_slope(self, match_type: Optional[str] = None):
+        '''
+        Weighted least-squares slope of actual against predicted win rate, through (50%, 50%).
+        Near 1 the ratings are calibrated; below 1 favourites win less often than predicted,
+        a sign K is too high; above 1 they win more often, a sign K is too low.
+
+        returns: The slope, or None before any lopsided match was reported
+        '''
+        numerator = denominator = 0.0
+        for _, _, count, predicted, actual in self.calibration_curve(match_type):
+            numerator += count * (predicted - 0.5) * (actual - 0.5)
+            denominator += count * (predicted - 0.5) ** 2
+        return numerator / denominator if denominator else None
+
+    # persistence
+    def to_dict(self):
+        return {'map_results': self.map_results, 'head_to_head': self.head_to_head,
+                'streaks': self.streaks, 'calibration': self.calibration}
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        analytics = cls()
+        for field in ('map_results', 'head_to_head', 'streaks', 'calibration'):
+            getattr(analytics, field).update(data.get(field, {}))
+        return analytics
+
+    def dump(self, file_path: str):
+        with open(file_path, 'w') as file:
+            json.dump(self.to_dict(), file)
+
+    @classmethod
+    def load(cls, file_path: str):
+        with open(file_path, 'r') as file:
+            return cls.from_dict(json.load(file))
+
+
+# rendering
+def _render(table: Table):
+    console = Console(force_terminal=False)
+    with console.capture() as capture:
+        console.print(table)
+    return capture.get()
+
+def render_map_win_rates(analytics: MatchAnalytics, match_type: str):
+    table = Table(title=f"{match_type} Map Win Rates by Rank (win rate/games)")
+    table.add_column("Map", justify="left")
+    for rank in RANKS:
+        table.add_column(rank, justify="center")
+    for map_name, bands in analytics.map_win_rates(match_type):
+        table.add_row(map_name, *[f"{bands[rank][0]:.0%}/{bands[rank][1]}" if rank in bands else "-" for rank in RANKS])
+    return _render(table)
+
+def render_calibration(analytics: MatchAnalytics, match_type: Optional[str] = None):
+    table = Table(title=f"{match_type or 'All'} Rating Calibration")
+    table.add_column("Predicted", justify="center")
+    table.add_column("Matches", justify="right")
+    table.add_column("Mean Predicted", justify="right")
+    table.add_column("Actual", justify="right")
+    for low, high, count, predicted, actual in analytics.calibration_curve(match_type):
+        table.add_row(f"{low:.0%}-{high:.0%}", str(count), f"{predicted:.1%}", f"{actual:.1%}")
+    slope = analytics.calibration_slope(match_type)
+    verdict = 'not enough matches yet' if slope is None else \
+        f'slope {slope:.2f} (1.00 is calibrated, below means K is too high, above means K is too low)'
+    return _render(table) + f"Calibration {verdict}\n"
+
+def report(analytics: MatchAnalytics, match_types: tuple[str, ...] = MATCH_TYPES):
+    '''
+    The full offline report: map win rates and calibration for every match type, and the longest win streaks
+    '''
+    sections = []
+    for match_type in match_types:
+        sections.append(render_map_win_rates(analytics, match_type))
+        sections.append(render_calibration(analytics, match_type))
+        best = sorted(analytics.streaks[match_type].items(), key=lambda item: item[1][1], reverse=True)[:10]
+        table = Table(title=f"{match_type} Longest Win Streaks")
+        table.add_column("Name", justify="left")
+        table.add_column("Best", justify="right")
+        table.add_column("Current", justify="right")
+        for name, (current, longest) in best:
+            table.add_row(name, str(longest), f"{current:+d}")
+        sections.append(_render(table))
+    return '\n'.join(sections)
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(description='Print the match analytics report of a guild.')
+    parser.add_argument('data_path', help='the guild data directory, e.g. guilds/<guild id>')
+    parser.add_argument('--match-type', choices=MATCH_TYPES, help='only report one match type')
+    args = parser.parse_args(argv)
+    file_path = os.path.join(args.data_path, 'analytics.json')
+    if not os.path.exists(file_path):
+        print(f'No analytics found at {file_path}')
+        return 1
+    print(report(MatchAnalytics.load(file_path), (args.match_type,) if args.match_type else MATCH_TYPES))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,276 @@
+'''
+Benchmark harness for the Ravens Nest.
+Designed by Ahasuerus for Armored Scrims Server
+
+Builds synthetic ladders and queues and times the hot paths: matchmaking
+per queue type, match reporting, leaderboard generation and database
+dump/load. Results are reported as p50/p99 latency plus peak memory, can be
+saved as a JSON baseline and compared against one to flag regressions.
+
+usage: python -m ravens_nest.benchmarks [--quick] [--save results.json] [--compare baseline.json]
+'''
+import io
+import os
+import gc
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+import contextlib
+from ravens_nest.elo_core import *
+from ravens_nest.player_queue import *
+
+# constants
+LADDER_SIZES = [100, 1000, 10000, 100000]
+QUEUE_SIZES = [10, 100, 1000]
+QUICK_LADDER_SIZES = [100, 1000]
+QUICK_QUEUE_SIZES = [10, 100]
+ELO_MEAN = 1000 # synthetic ratings are normally distributed around this
+ELO_STDDEV = 250
+PARTY_MIX = {1: 0.6, 2: 0.15, 3: 0.25} # share of flex queue entries by party size
+CALL_BUDGET = 5.0 # seconds; a case whose single call exceeds this is not repeated or scaled up
+DEFAULT_TOLERANCE = 0.25 # a p50 more than 25% above baseline is a regression
+
+
+# synthetic data
+def synthetic_ELO(rng: random.Random):
+    return min(max(round(rng.gauss(ELO_MEAN, ELO_STDDEV)), ELO_MINIMUM), ELO_MAXIMUM)
+
+def generate_ladder(num_players: int, seed: int = 0):
+    '''
+    Build a player and team registry with realistic rating spread.
+    Every third block of three players is registered as a team.
+
+    :param num_players: The number of players on the ladder
+    :param seed: Seed for the random generator, so runs are comparable
+
+    returns: (players_db, teams_db)
+    '''
+    rng = random.Random(seed)
+    player_registry = players_db()
+    teams_registry = teams_db(player_registry)
+    players = []
+    for i in range(num_players):
+        player = Player(f'pilot_{i}', player_id=i)
+        player.player_singles_ELO = synthetic_ELO(rng)
+        player.player_teams_ELO = synthetic_ELO(rng)
+        player.player_singles_rank = get_rank_from_ELO(player.player_singles_ELO)
+        player.player_teams_rank = get_rank_from_ELO(player.player_teams_ELO)
+        players.append(player)
+    player_registry.players.extend(players) # add_players is O(n^2), not what we are measuring here
+    player_registry.name_index.extend(player.player_name for player in players)
+    for i in range(0, num_players - 2, 9):
+        roster = players[i:i+3]
+        new_team = team(f'team_{i // 9}', roster)
+        new_team.team_ELO = synthetic_ELO(rng)
+        new_team.team_rank = get_rank_from_ELO(new_team.team_ELO)
+        for player in roster:
+            player.player_team = new_team.team_name
+        teams_registry.add_team(new_team)
+    return player_registry, teams_registry
+
+def fill_queue(queue: MatchQueue, size: int, seed: int = 0):
+    '''
+    Fill a queue with random ladder members. Flex queues get a mix of
+    solo players and parties following PARTY_MIX.
+
+    returns: None
+    '''
+    rng = random.Random(seed)
+    if queue.queue_type == '3v3 reg':
+        candidates = [t for t in queue.teams_pool.teams if t.team_name not in queue.queued_teams]
+        for queued_team in rng.sample(candidates, min(size, len(candidates))):
+            queue.enqueue_team(queued_team)
+        return
+    candidates = [p for p in queue.player_pool.players if p.player_name not in queue.queued_players]
+    rng.shuffle(candidates)
+    sizes, weights = list(PARTY_MIX), list(PARTY_MIX.values())
+    while len(queue) < size and candidates:
+        party_size = rng.choices(sizes, weights)[0] if queue.queue_type == '3v3 flex' else 1
+        party_size = min(party_size, len(candidates), size - len(queue))
+        party = [candidates.pop() for _ in range(party_size)]
+        if party_size == 1:
+            queue.enqueue_player(party[0])
+        else:
+            queue.enqueue_party(party)
+
+
+# measurement
+def percentile(samples: list[float], pct: float):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def measure(setup, call, repeats: int):
+    '''
+    Time a call repeatedly. setup() runs before every call, outside the timing,
+    and returns the arguments passed to call(). Peak memory comes from one extra traced call.
+
+    returns: dict with p50/p99/mean in milliseconds, sample count and peak memory in KiB
+    '''
+    samples = []
+    with contextlib.redirect_stdout(io.StringIO()): # the core logs every match with print
+        for _ in range(repeats):
+            args = setup()
+            gc.collect()
+            start = time.perf_counter()
+            call(*args)
+            elapsed = time.perf_counter() - start
+            samples.append(elapsed)
+            if elapsed > CALL_BUDGET:
+                break
+
+        # one extra traced call for memory, tracemalloc slows the timed calls down too much
+        args = setup()
+        tracemalloc.start()
+        call(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {
+        'p50_ms': percentile(samples, 50) * 1000,
+        'p99_ms': percentile(samples, 99) * 1000,
+        'mean_ms': sum(samples) / len(samples) * 1000,
+        'samples': len(samples),
+        'peak_kib': peak / 1024,
+    }
+
+
+# benchmark cases
+def bench_matchmaking(player_registry: players_db, teams_registry: teams_db, queue_type: str, queue_size: int, repeats: int):
+    queue = MatchQueue(queue_type, player_registry, teams_registry)
+    fill_queue(queue, queue_size)
+
+    def setup():
+        fill_queue(queue, queue_size, seed=random.randrange(1 << 30)) # top the queue back up after a pop
+        return ()
+    return measure(setup, queue.get_valid_match_from_queue, repeats)
+
+def bench_report_match(player_registry: players_db, teams_registry: teams_db, match_type: str, repeats: int):
+    rng = random.Random(1)
+
+    def setup():
+        if match_type == '1v1':
+            alpha, beta = rng.sample(player_registry.players, 2)
+            new_match = match('1v1', player_alpha=alpha, player_beta=beta)
+        elif match_type == '3v3 flex':
+            players = rng.sample(player_registry.players, 6)
+            alpha, beta = players[:3], players[3:]
+            new_match = match('3v3 flex', team_alpha=alpha, team_beta=beta)
+        else:
+            alpha, beta = rng.sample(teams_registry.teams, 2)
+            new_match = match('3v3 reg', team_alpha=alpha, team_beta=beta)
+        return new_match, alpha, beta
+    return measure(setup, lambda m, alpha, beta: m.report_match_results(alpha, beta), repeats)
+
+def bench_leaderboard(player_registry: players_db, teams_registry: teams_db, repeats: int):
+    def leaderboards():
+        player_registry.get_top_singles_players(10)
+        player_registry.get_top_teams_players(10)
+        teams_registry.get_top_teams(5)
+    return measure(lambda: (), leaderboards, repeats)
+
+def bench_persistence(player_registry: players_db, teams_registry: teams_db, repeats: int):
+    directory = tempfile.mkdtemp()
+    players_path = os.path.join(directory, 'players.db')
+    teams_path = os.path.join(directory, 'teams.db')
+
+    def dump():
+        player_registry.dump_players_db(players_path)
+        teams_registry.dump_teams_db(teams_path)
+
+    def load():
+        loaded_players = players_db()
+        loaded_players.load_players_db(players_path)
+        teams_db(loaded_players).load_teams_db(teams_path)
+    dump_result = measure(lambda: (), dump, repeats)
+    load_result = measure(lambda: (), load, max(1, repeats // 5)) # load is O(n^2) through add_player
+    return dump_result, load_result
+
+def run_benchmarks(ladder_sizes: list[int], queue_sizes: list[int], repeats: int):
+    '''
+    Run every benchmark case
+
+    returns: dict mapping case name to its measurement
+    '''
+    results = {}
+    over_budget = set() # (case family) that already exceeded the call budget at a smaller size
+
+    def record(name: str, family: str, bench, *args):
+        if family in over_budget:
+            print(f'{name:<45} skipped (smaller size exceeded {CALL_BUDGET}s per call)')
+            return
+        result = bench(*args)
+        results[name] = result
+        print(f"{name:<45} p50 {result['p50_ms']:10.3f} ms  p99 {result['p99_ms']:10.3f} ms  peak {result['peak_kib']:10.1f} KiB  (n={result['samples']})")
+        if result['samples'] < repeats and result['p50_ms'] > CALL_BUDGET * 1000:
+            over_budget.add(family)
+
+    for ladder_size in ladder_sizes:
+        player_registry, teams_registry = generate_ladder(ladder_size)
+        for queue_type in ['1v1', '3v3 flex', '3v3 reg']:
+            for queue_size in queue_sizes:
+                if queue_size > (len(teams_registry) if queue_type == '3v3 reg' else ladder_size):
+                    continue
+                record(f'matchmaking[{queue_type}] ladder={ladder_size} queue={queue_size}', f'matchmaking[{queue_type}]',
+                       bench_matchmaking, player_registry, teams_registry, queue_type, queue_size, repeats)
+        for match_type in ['1v1', '3v3 flex', '3v3 reg']:
+            record(f'report_match[{match_type}] ladder={ladder_size}', f'report_match[{match_type}]',
+                   bench_report_match, player_registry, teams_registry, match_type, repeats)
+        record(f'leaderboards ladder={ladder_size}', 'leaderboards', bench_leaderboard, player_registry, teams_registry, repeats)
+        if 'load' not in over_budget:
+            dump_result, load_result = bench_persistence(player_registry, teams_registry, repeats)
+            for name, result in [(f'dump ladder={ladder_size}', dump_result), (f'load ladder={ladder_size}', load_result)]:
+                results[name] = result
+                print(f"{name:<45} p50 {result['p50_ms']:10.3f} ms  p99 {result['p99_ms']:10.3f} ms  peak {result['peak_kib']:10.1f} KiB  (n={result['samples']})")
+            if load_result['p50_ms'] > CALL_BUDGET * 1000:
+                over_budget.add('load')
+    return results
+
+def compare_to_baseline(results: dict, baseline: dict, tolerance: float = DEFAULT_TOLERANCE):
+    '''
+    Compare results to a saved baseline
+
+    returns: list of (case name, baseline p50, current p50) for every regressed case
+    '''
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous and result['p50_ms'] > previous['p50_ms'] * (1 + tolerance):
+            regressions.append((name, previous['p50_ms'], result['p50_ms']))
+    return regressions
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(description='Benchmark the Ravens Nest hot paths.')
+    parser.add_argument('--quick', action='store_true', help='small ladders and queues only')
+    parser.add_argument('--ladder-sizes', type=int, nargs='+', help=f'default {LADDER_SIZES}')
+    parser.add_argument('--queue-sizes', type=int, nargs='+', help=f'default {QUEUE_SIZES}')
+    parser.add_argument('--repeats', type=int, default=50, help='calls per case')
+    parser.add_argument('--save', help='write results to this JSON file')
+    parser.add_argument('--compare', help='baseline JSON file to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help='allowed p50 slowdown as a fraction')
+    args = parser.parse_args(argv)
+
+    ladder_sizes = args.ladder_sizes or (QUICK_LADDER_SIZES if args.quick else LADDER_SIZES)
+    queue_sizes = args.queue_sizes or (QUICK_QUEUE_SIZES if args.quick else QUEUE_SIZES)
+    results = run_benchmarks(ladder_sizes, queue_sizes, args.repeats)
+
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+        print(f'Results saved to {args.save}')
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            baseline = json.load(file)
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        for name, before, after in regressions:
+            print(f'REGRESSION {name}: p50 {before:.3f} ms -> {after:.3f} ms')
+        if regressions:
+            return 1
+        print(f'No regressions against {args.compare}')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
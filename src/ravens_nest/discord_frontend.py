@@ -9,6 +9,14 @@ import random
 from discord import app_commands
 from ravens_nest.elo_core import *
 from ravens_nest.player_queue import *
+from ravens_nest.guild_state import *
+from ravens_nest.match_workers import *
+from ravens_nest.metrics import *
+from ravens_nest.profiler import *
+from ravens_nest.loop_monitor import *
+from ravens_nest.notifications import *
+from ravens_nest.analytics import *
+from ravens_nest.leaderboards import *
 from rich.table import Table
 from rich.console import Console
 
@@ -27,38 +35,185 @@ client = discord.Client(intents=intents)
 # Create a tree to register and manage slash commands
 tree = app_commands.CommandTree(client)
 
-# establish all databases and queues #
-players_path = 'players.db'
-teams_path = 'teams.db'
-matches_path = 'matches.db'
-
-if os.path.exists(players_path):
-    player_registry = players_db()
-    player_registry.load_players_db(players_path)
-    print(f'Players_db loaded from file {players_path}')
-else:
-    player_registry = players_db()
-    print('initalized new player_registry')
-
-if os.path.exists(teams_path):
-    teams_registry = teams_db(player_registry)
-    teams_registry.load_teams_db(teams_path)
-    print(f'Teams_db loaded from file {teams_path}')
-else:
-    teams_registry = teams_db(player_registry)
-    print('initalized new teams_registry')
-
-if os.path.exists(matches_path):
-    matches_db = match_db()
-    matches_db.load_matches_db(matches_path)
-    print(f'Matches_db loaded from file {matches_path}')
-else:
-    matches_db = match_db()
-    print('initalized new matches_db')
-
-ones_queue = MatchQueue('1v1', player_registry, teams_registry)
-threes_flex_queue = MatchQueue('3v3 flex', player_registry, teams_registry)
-threes_reg_queue = MatchQueue('3v3 reg', player_registry, teams_registry)
+# establish per-guild databases and queues #
+# each guild gets its own registries, queues and database files, loaded on first use
+guild_states = GuildStateManager()
+
+# matchmaking searches run in worker processes so the gateway loop only does I/O #
+# set RAVENS_NEST_INLINE_MATCHMAKING=1 to search in-process instead
+matchmaking_pool = MatchmakingPool(inline=os.getenv('RAVENS_NEST_INLINE_MATCHMAKING') == '1')
+
+# metrics: per-command latency, matchmaking/report/render/persistence timers and queue gauges #
+# set RAVENS_NEST_METRICS_PORT to serve them locally, RAVENS_NEST_METRICS_LOG_INTERVAL to log snapshots
+def collect_queue_metrics():
+    '''
+    Queue depth and longest wait for every loaded guild, read at scrape time.
+    '''
+    for guild_id, state in guild_states.states.items():
+        for queue in (state.ones_queue, state.threes_flex_queue, state.threes_reg_queue):
+            yield 'ravens_nest_queue_depth', {'guild': guild_id, 'queue': queue.queue_type}, len(queue)
+            yield 'ravens_nest_queue_oldest_wait_seconds', {'guild': guild_id, 'queue': queue.queue_type}, queue.oldest_wait()
+    yield 'ravens_nest_loaded_guilds', {}, len(guild_states)
+    yield 'ravens_nest_notifications_pending', {}, notifier.pending()
+
+METRICS.add_collector(collect_queue_metrics)
+
+# event loop lag monitor: dumps the loop's stack when a callback holds it too long #
+# set RAVENS_NEST_LOOP_LAG_THRESHOLD (seconds, default 0.5) to tune the stack dumps
+loop_monitor = LoopLagMonitor()
+
+# match notifications: handlers acknowledge first, announcements, pings and DMs are queued #
+notifier = NotificationQueue()
+
+QUEUE_VIEW_ROWS = 15 # entries listed by the view queue commands, the rest are counted
+
+LOBBY_SETTINGS = {
+    '1v1': 'a 2 person lobby, rotation locked, with a 2 minute match timer',
+    '3v3 flex': 'a 9 person lobby, rotation locked, with a 5 minute match timer',
+    '3v3 reg': 'a 9 person lobby, rotation locked, with a 5 minute match timer',
+}
+
+def match_sides(match: match):
+    '''
+    The players on each side of a match, whatever the match type.
+    Empty roster slots of a 3v3 reg team are left out.
+
+    returns: (alpha players, beta players)
+    '''
+    if match.match_type == '1v1':
+        return [match.player_alpha], [match.player_beta]
+    elif match.match_type == '3v3 reg':
+        return ([player for player in match.team_alpha.roster if player is not None],
+                [player for player in match.team_beta.roster if player is not None])
+    return list(match.team_alpha), list(match.team_beta)
+
+async def resolve_user(user_id: int):
+    return client.get_user(user_id) or await client.fetch_user(user_id)
+
+def announce_match(interaction: discord.Interaction, match: match):
+    '''
+    Queues the announcement of a popped match, pinging every player in it, and a DM to each player.
+    '''
+    alpha, beta = match_sides(match)
+    host = random.choice(alpha + beta)
+    alpha_mentions = ", ".join([f"<@{player.player_id}>" for player in alpha])
+    beta_mentions = ", ".join([f"<@{player.player_id}>" for player in beta])
+    sides = "Players" if match.match_type == '1v1' else "Teams"
+    alpha_odds, quality = match.predicted_odds()
+    notifier.post(interaction.channel or interaction.followup, f'Match setup for match `{match.match_id}` complete. Host: <@{host.player_id}>. Remember to create {LOBBY_SETTINGS[match.match_type]}. Use Map: {match.match_map}, Use Keyword: {match.keyword}. {sides}: {alpha_mentions} vs {beta_mentions}. Predicted odds: {alpha_odds:.0%} vs {1 - alpha_odds:.0%}, match quality {quality:.2f}.')
+    server = interaction.guild.name if interaction.guild else "the Ravens Nest"
+    for player in alpha + beta:
+        if player.player_id: # players loaded from disk may not have a Discord ID
+            notifier.post_dm(int(player.player_id), resolve_user, f'Your {match.match_type} match `{match.match_id}` in {server} is ready. Host: {host.player_name}. Use Map: {match.match_map}, Use Keyword: {match.keyword}.')
+
+async def pop_match(interaction: discord.Interaction, state: GuildState, queue: MatchQueue):
+    '''
+    Tries to make a match from a queue, registers it and queues its announcement.
+    '''
+    match = await matchmaking_pool.find_match(queue)
+    if match:
+        match.setup_match_parameters(state.map_rotation)
+        await state.matches_db.add_match_async(match)
+        announce_match(interaction, match)
+
+# AUTOCOMPLETE #
+# answered from the per-guild prefix indexes kept by the registries, never a scan of the registry
+async def player_name_autocomplete(interaction: discord.Interaction, current: str):
+    state = guild_states.get(interaction.guild_id)
+    return [app_commands.Choice(name=name, value=name) for name in state.player_registry.name_index.complete(current)]
+
+async def team_name_autocomplete(interaction: discord.Interaction, current: str):
+    state = guild_states.get(interaction.guild_id)
+    return [app_commands.Choice(name=name, value=name) for name in state.teams_registry.name_index.complete(current)]
+
+async def pending_match_autocomplete(interaction: discord.Interaction, current: str):
+    state = guild_states.get(interaction.guild_id)
+    return [app_commands.Choice(name=str(match_id), value=match_id) for match_id in state.matches_db.pending_index.complete(current)]
+
+async def match_side_autocomplete(interaction: discord.Interaction, current: str):
+    '''
+    Suggests the players (or teams, for 3v3 reg) of the match being reported, falling back to every player.
+    '''
+    state = guild_states.get(interaction.guild_id)
+    reported = state.matches_db.get_match(getattr(interaction.namespace, 'match_id', None))
+    if reported is None or reported.player_alpha is None and reported.team_alpha is None:
+        return await player_name_autocomplete(interaction, current)
+    if reported.match_type == '3v3 reg':
+        names = [reported.team_alpha.team_name, reported.team_beta.team_name]
+    else:
+        alpha, beta = match_sides(reported)
+        names = [player.player_name for player in alpha + beta]
+    prefix = current.casefold()
+    return [app_commands.Choice(name=name, value=name) for name in names if name.casefold().startswith(prefix)]
+
+# SEASONS #
+# past seasons are read from their archive files per query, never loaded into the guild state
+def season_suffix(state: GuildState, season: Optional[int]):
+    return '' if season is None or season == state.settings['season'] else f' (Season {season})'
+
+def season_heading(state: GuildState, season: Optional[int]):
+    suffix = season_suffix(state, season)
+    return f"**Archived{suffix}**\n" if suffix else ''
+
+# LEADERBOARDS #
+# the current season is served from the publisher's cache, rendered once per change in the standings
+leaderboard_publisher = LeaderboardPublisher(embed=lambda text: discord.Embed(description=text))
+
+async def send_leaderboard(interaction: discord.Interaction, leaderboard: str, season: Optional[int]):
+    state = guild_states.get(interaction.guild_id)
+    suffix = season_suffix(state, season)
+    if not suffix:
+        await interaction.response.send_message(leaderboard_publisher.leaderboard(state, leaderboard))
+        return
+    try:
+        player_registry, teams_registry = state.season_registries(season)
+    except ValueError as error:
+        await interaction.response.send_message(f"{error}.")
+        return
+    await interaction.response.send_message(render_leaderboard(leaderboard, player_registry, teams_registry, suffix))
+
+async def resolve_channel(channel_id: int):
+    return client.get_channel(channel_id) or await client.fetch_channel(channel_id)
+
+def ladder_page(state: GuildState, ladder: str, season: Optional[int], **kwargs):
+    '''
+    One page of a ladder: the current season from the cached LadderIndex, a past one from its archive
+    '''
+    if not season_suffix(state, season):
+        return leaderboard_publisher.ladder_index(state, ladder).page(**kwargs)
+    archive, _ = state.season_registries(season)
+    return archive.ladder_page(ladder, **kwargs)
+
+class LadderView(discord.ui.View):
+    '''
+    Previous and next buttons under a /leaderboard page. The buttons carry cursors, not page numbers,
+    so a click lands next to the entries on screen even after the standings moved.
+    '''
+    def __init__(self, ladder: str, season: Optional[int], rank: Optional[str], team_name: Optional[str], page: LadderPage):
+        super().__init__(timeout=300)
+        self.ladder, self.season, self.rank, self.team_name = ladder, season, rank, team_name
+        self.show(page)
+
+    def show(self, page: LadderPage):
+        self.page = page
+        self.previous_page.disabled = not page.has_previous
+        self.next_page.disabled = not page.has_next
+
+    async def turn(self, interaction: discord.Interaction, **cursor):
+        state = guild_states.get(interaction.guild_id)
+        page = ladder_page(state, self.ladder, self.season, rank=self.rank, team_name=self.team_name, **cursor)
+        if not page.entries: # the entries around the cursor left the filter, start over
+            page = ladder_page(state, self.ladder, self.season, rank=self.rank, team_name=self.team_name)
+        self.show(page)
+        await interaction.response.edit_message(content=render_ladder_page(self.ladder, page, season_suffix(state, self.season)), view=self)
+
+    @discord.ui.button(label="Previous", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.turn(interaction, before=ladder_cursor(self.ladder, self.page.first))
+
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.turn(interaction, after=ladder_cursor(self.ladder, self.page.last))
 
 # DISCORD BOT EVENTS - MAIN FUNCTIONS #
 
@@ -80,17 +235,18 @@ async def on_ready():
 
 # ONBOARDING COMMANDS #
 @tree.command(name="onboard_player", description="Onboards a player to the database.")
+@app_commands.autocomplete(player_team=team_name_autocomplete)
+@instrument_command
 async def onboard_player(interaction: discord.Interaction, player_name: str, player_team: Optional[str] = None):
     '''
     Onboards a player to the database.
     '''
-    # Check if the player is already in the database
-    if player_registry.get_player(player_name):
+    state = guild_states.get(interaction.guild_id)
+    # Add the player to the database, unless the name is already taken
+    new_player = Player(player_name, player_team, player_id = interaction.user.id)
+    if not await state.player_registry.add_player_async(new_player):
         await interaction.response.send_message(f"Player {player_name} is already in the database.")
     else:
-        # Add the player to the database
-        new_player = Player(player_name, player_team, player_id = interaction.user.id)
-        player_registry.add_player(new_player)
         if player_team:
             await interaction.response.send_message(f"Player {player_name} has been onboarded to team {player_team}. Welcome to the Ravens Nest.")
             print(f'Onboard player command used to onboard player {player_name} to team {player_team}.')
@@ -99,13 +255,16 @@ async def onboard_player(interaction: discord.Interaction, player_name: str, pla
             print(f"Onboard player command used to onboard player {player_name}.")
 
 @tree.command(name="onboard_team", description="Onboards a team to the database.")
+@app_commands.autocomplete(player1=player_name_autocomplete, player2=player_name_autocomplete, player3=player_name_autocomplete)
+@instrument_command
 async def onboard_team(interaction: discord.Interaction, team_name: str, player1: str, player2: str, player3: str):
     '''
     Onboards a team to the database.
     '''
-    roster = [player_registry.get_player(player1),
-              player_registry.get_player(player2),
-              player_registry.get_player(player3)] # to avoid discord type complaining
+    state = guild_states.get(interaction.guild_id)
+    roster = [state.player_registry.get_player(player1),
+              state.player_registry.get_player(player2),
+              state.player_registry.get_player(player3)] # to avoid discord type complaining
 
     if any(player is None for player in roster):
         missing_players = [player_name for player_name, player in zip([player1, player2, player3], roster) if player is None]
@@ -113,31 +272,56 @@ async def onboard_team(interaction: discord.Interaction, team_name: str, player1
         print(f"Onboard team command used to onboard team {team_name}, but player(s) {', '.join(missing_players)} is/are not in the database.")
         return
 
-    for player in roster: # assign team name to roster players
-        player.player_team = team_name
-
-    # Check if the team is already in the database
-    if teams_registry.get_team(team_name):
+    # Add the team to the database, unless the name is already taken
+    new_team = team(team_name, roster)
+    if not await state.teams_registry.add_team_async(new_team):
         await interaction.response.send_message(f"Team {team_name} is already in the database.")
     else:
-        # Add the team to the database
-        new_team = team(team_name, roster)
-        teams_registry.add_team(new_team)
+        for player in roster: # assign team name to roster players
+            player.player_team = team_name
         await interaction.response.send_message(f"Team {team_name} has been onboarded. Welcome to the Ravens Nest.")
         print(f"Onboard team command used to onboard team {team_name}.")
 
+@tree.command(name="set_roles", description="Sets the roles a player prefers in 3v3 flex matches.")
+@app_commands.autocomplete(player_name=player_name_autocomplete)
+@instrument_command
+async def set_roles(interaction: discord.Interaction, player_name: str, roles: Optional[str] = None):
+    '''
+    Sets the roles a player prefers in 3v3 flex matches, separated by semicolons. Leave roles out to play any.
+    Flex teams are packed so they can field ROLE_COVERAGE distinct roles.
+    '''
+    state = guild_states.get(interaction.guild_id)
+    player = state.player_registry.get_player(player_name)
+    if not player:
+        await interaction.response.send_message(f"Player {player_name} is not in the database.")
+        return
+    if player.player_id is not None and player.player_id != interaction.user.id:
+        await interaction.response.send_message(f"Only the pilot who onboarded {player_name} can set their roles.")
+        return
+    try:
+        player.set_roles(roles.replace(',', ';').split(';') if roles else [])
+    except ValueError as error:
+        await interaction.response.send_message(f"{error}.")
+        return
+    await interaction.response.send_message(f"{player_name} now plays {', '.join(player.player_roles) if player.player_roles else 'any role'} in 3v3 flex matches.")
+    print(f"set_roles command used to set the roles of {player_name} to {player.player_roles}.")
+
 @tree.command(name="remove_player", description="Removes a player from the database.")
+@app_commands.autocomplete(player_name=player_name_autocomplete)
+@instrument_command
 async def remove_player(interaction: discord.Interaction, admin_passwd: str, player_name: str):
     '''
     Removes a player from the database.
     '''
+    state = guild_states.get(interaction.guild_id)
     if admin_passwd != os.getenv('ADMIN_PASSWD'):
         await interaction.response.send_message("Invalid admin password.")
         print(f"Remove player command used with invalid admin password.")
         return
-    player = player_registry.get_player(player_name)
+    player = state.player_registry.get_player(player_name)
     if player:
-        player_registry.remove_player(player.player_name)
+        await state.player_registry.remove_player_async(player.player_name)
+        state.map_rotation.forget(('player', player.player_name))
         await interaction.response.send_message(f"Player {player_name} has been removed from the database.")
         print(f"Remove player command used to remove player {player_name}.")
     else:
@@ -145,17 +329,21 @@ async def remove_player(interaction: discord.Interaction, admin_passwd: str, pla
         print(f"Remove player command used to remove player {player_name}, but player is not in the database.")
 
 @tree.command(name="remove_team", description="Removes a team from the database.")
+@app_commands.autocomplete(team_name=team_name_autocomplete)
+@instrument_command
 async def remove_team(interaction: discord.Interaction, admin_passwd: str, team_name: str):
     '''
     Removes a team from the database.
     '''
+    state = guild_states.get(interaction.guild_id)
     if admin_passwd != os.getenv('ADMIN_PASSWD'):
         await interaction.response.send_message("Invalid admin password.")
         print(f"Remove team command used with invalid admin password.")
         return
-    team = teams_registry.get_team(team_name)
+    team = state.teams_registry.get_team(team_name)
     if team:
-        teams_registry.remove_team(team.team_name)
+        await state.teams_registry.remove_team_async(team.team_name)
+        state.map_rotation.forget(('team', team.team_name))
         await interaction.response.send_message(f"Team {team_name} has been removed from the database.")
         print(f"Remove team command used to remove team {team_name}.")
     else:
@@ -164,300 +352,442 @@ async def remove_team(interaction: discord.Interaction, admin_passwd: str, team_
 
 # STATS COMMANDS #
 @tree.command(name="playerstats", description="Views the stats of a player.")
-async def playerstats(interaction: discord.Interaction, player_name: str):
+@app_commands.autocomplete(player_name=player_name_autocomplete)
+@instrument_command
+async def playerstats(interaction: discord.Interaction, player_name: str, season: Optional[int] = None):
     '''
-    Views the stats of a player.
+    Views the stats of a player, in the current season or an archived one.
     '''
+    state = guild_states.get(interaction.guild_id)
+    try:
+        player_registry, _ = state.season_registries(season)
+    except ValueError as error:
+        await interaction.response.send_message(f"{error}.")
+        return
     player = player_registry.get_player(player_name)
     if player:
-        await interaction.response.send_message(f"{player}")
+        await interaction.response.send_message(f"{season_heading(state, season)}{player}")
     else:
         await interaction.response.send_message(f"Player {player_name} is not in the database.")
     print(f"Playerstats command used to view player {player_name}.")
 
 @tree.command(name="teamstats", description="Views the stats of a team.")
-async def teamstats(interaction: discord.Interaction, team_name: str):
+@app_commands.autocomplete(team_name=team_name_autocomplete)
+@instrument_command
+async def teamstats(interaction: discord.Interaction, team_name: str, season: Optional[int] = None):
     '''
-    Views the stats of a team.
+    Views the stats of a team, in the current season or an archived one.
     '''
+    state = guild_states.get(interaction.guild_id)
+    try:
+        _, teams_registry = state.season_registries(season)
+    except ValueError as error:
+        await interaction.response.send_message(f"{error}.")
+        return
     team = teams_registry.get_team(team_name)
     if team:
-        await interaction.response.send_message(f"{team}")
+        await interaction.response.send_message(f"{season_heading(state, season)}{team}")
     else:
         await interaction.response.send_message(f"Team {team_name} is not in the database.")
     print(f"Teamstats command used to view team {team_name}.")
 
 @tree.command(name="solo_leaderboard", description="Views the leaderboard for 1v1 matches.")
-async def solo_leaderboard(interaction: discord.Interaction):
+@instrument_command
+async def solo_leaderboard(interaction: discord.Interaction, season: Optional[int] = None):
     '''
-    Views the leaderboard for 1v1 matches.
+    Views the leaderboard for 1v1 matches, in the current season or an archived one.
     '''
-    leaderboard = player_registry.get_top_singles_players(10)
-    console = Console(force_terminal=False)
-    table = Table(title="1v1 Leaderboard")
-
-    table.add_column("Position", justify="center")
-    table.add_column("Player Name", justify="center")
-    table.add_column("ELO", justify="center")
-
-    for position, player in enumerate(leaderboard, start=1):
-        if position == 1:
-            medal = "🥇 "
-        elif position == 2:
-            medal = "🥈 "
-        elif position == 3:
-            medal = "🥉 "
-        else:
-            medal = f"{position}"
-        table.add_row(medal, player.player_name, str(player.player_singles_ELO))
-
-    with console.capture() as capture:
-            console.print(table)
-    table_output = capture.get()
-
-    await interaction.response.send_message(f"```{table_output}```")
+    await send_leaderboard(interaction, 'solo_leaderboard', season)
     print("solo_leaderboard command used to view 1v1 leaderboard.")
 
 @tree.command(name="reg_teams_leaderboard", description="Views the leaderboard for 3v3 matches.")
-async def reg_teams_leaderboard(interaction: discord.Interaction):
+@instrument_command
+async def reg_teams_leaderboard(interaction: discord.Interaction, season: Optional[int] = None):
     '''
-    Views the leaderboard for 3v3 matches.
+    Views the leaderboard for 3v3 matches, in the current season or an archived one.
     '''
-    leaderboard = teams_registry.get_top_teams(5)
-    console = Console(force_terminal=False)
-    table = Table(title="3v3 Leaderboard")
-
-    table.add_column("Position", justify="center")
-    table.add_column("Team Name", justify="center")
-    table.add_column("ELO", justify="center")
-
-    for position, team in enumerate(leaderboard, start=1):
-        if position == 1:
-            medal = "🥇"
-        elif position == 2:
-            medal = "🥈"
-        elif position == 3:
-            medal = "🥉"
-        else:
-            medal = f"{position}"
-        table.add_row(medal, f'{team.team_name} {[player.player_name for player in team.roster]}', str(team.team_ELO))
-
-    with console.capture() as capture:
-            console.print(table)
-    table_output = capture.get()
-
-    await interaction.response.send_message(f"```{table_output}```")
+    await send_leaderboard(interaction, 'reg_teams_leaderboard', season)
     print("reg_teams_leaderboard command used to view 3v3 reg leaderboard.")
 
 @tree.command(name="flex_teams_leaderboard", description="Views the leaderboard for 3v3 flex match performance.")
-async def flex_teams_leaderboard(interaction: discord.Interaction):
+@instrument_command
+async def flex_teams_leaderboard(interaction: discord.Interaction, season: Optional[int] = None):
     '''
-    Views the leaderboard for 3v3 flex match performance.
+    Views the leaderboard for 3v3 flex match performance, in the current season or an archived one.
     '''
-    leaderboard = player_registry.get_top_teams_players(10)
-    console = Console(force_terminal=False)
-    table = Table(title="3v3 Flex Leaderboard")
-
-    table.add_column("Position", justify="center")
-    table.add_column("Player Name", justify="center")
-    table.add_column("ELO", justify="center")
+    await send_leaderboard(interaction, 'flex_teams_leaderboard', season)
+    print("flex_teams_leaderboard command used to view 3v3 flex leaderboard.")
 
-    for position, player in enumerate(leaderboard, start=1):
-        if position == 1:
-            medal = "🥇"
-        elif position == 2:
-            medal = "🥈"
-        elif position == 3:
-            medal = "🥉"
-        else:
-            medal = f"{position}"
-        table.add_row(medal, player.player_name, str(player.player_teams_ELO))
+@tree.command(name="leaderboard", description="Pages through a whole ladder, optionally filtered by rank and team.")
+@app_commands.autocomplete(team_name=team_name_autocomplete, player_name=player_name_autocomplete)
+@instrument_command
+async def leaderboard(interaction: discord.Interaction, ladder: str = '1v1', rank: Optional[str] = None,
+                      team_name: Optional[str] = None, player_name: Optional[str] = None, season: Optional[int] = None):
+    '''
+    Pages through a whole ladder, optionally filtered by rank and team, starting at the top or at a player or team.
+    '''
+    state = guild_states.get(interaction.guild_id)
+    try:
+        check_ladder_filters(ladder, rank, team_name)
+        page = ladder_page(state, ladder, season, rank=rank, team_name=team_name, at=player_name)
+    except ValueError as error:
+        await interaction.response.send_message(f"{error}.")
+        return
+    if player_name is not None and not page.entries:
+        await interaction.response.send_message(f"{player_name} is not on the {ladder} ladder with these filters.")
+        return
+    await interaction.response.send_message(render_ladder_page(ladder, page, season_suffix(state, season)),
+                                            view=LadderView(ladder, season, rank, team_name, page))
+    print(f"leaderboard command used to view the {ladder} ladder.")
 
-    with console.capture() as capture:
-            console.print(table)
-    table_output = capture.get()
+@tree.command(name="publish_leaderboards", description="Keeps the standings pinned in this channel, edited as they change.")
+@instrument_command
+async def publish_leaderboards(interaction: discord.Interaction, admin_passwd: str, interval: Optional[int] = None, stop: bool = False):
+    '''
+    Keeps all three leaderboards in one pinned message in this channel, edited at most once per interval when the standings change.
+    '''
+    if admin_passwd != os.getenv('ADMIN_PASSWD'):
+        await interaction.response.send_message("Invalid admin password.")
+        return
+    state = guild_states.get(interaction.guild_id)
+    try:
+        state.set_leaderboard_channel(None if stop else interaction.channel_id, interval)
+    except ValueError as error:
+        await interaction.response.send_message(f"{error}.")
+        return
+    state.dump()
+    if stop:
+        await interaction.response.send_message("Standings are no longer published.")
+    else:
+        await interaction.response.send_message(f"Standings will be pinned in this channel and edited at most every {state.settings['leaderboard_interval']} seconds when they change.")
+    print(f"publish_leaderboards command used to {'stop publishing' if stop else f'publish to channel {interaction.channel_id}'}.")
+
+# ANALYTICS COMMANDS #
+# answered from running totals kept as matches are reported, never a scan of match history
+@tree.command(name="map_winrates", description="Views win rates per map and rank.")
+@instrument_command
+async def map_winrates(interaction: discord.Interaction, match_type: str = '1v1'):
+    '''
+    Views win rates per map and rank for a match type.
+    '''
+    state = guild_states.get(interaction.guild_id)
+    if match_type not in MATCH_TYPES:
+        await interaction.response.send_message("Invalid match type. Please use '1v1', '3v3 flex', or '3v3 reg'.")
+        return
+    await interaction.response.send_message(f"```{render_map_win_rates(state.matches_db.analytics, match_type)}```")
+    print(f"map_winrates command used to view {match_type} map win rates.")
 
-    await interaction.response.send_message(f"```{table_output}```")
-    print("flex_teams_leaderboard command used to view 3v3 flex leaderboard.")
+@tree.command(name="head_to_head", description="Views the record and streaks of two players or teams against each other.")
+@app_commands.autocomplete(name=player_name_autocomplete, opponent=player_name_autocomplete)
+@instrument_command
+async def head_to_head(interaction: discord.Interaction, name: str, opponent: str, match_type: str = '1v1'):
+    '''
+    Views the record and streaks of two players (or teams, for 3v3 reg) against each other.
+    '''
+    state = guild_states.get(interaction.guild_id)
+    if match_type not in MATCH_TYPES:
+        await interaction.response.send_message("Invalid match type. Please use '1v1', '3v3 flex', or '3v3 reg'.")
+        return
+    analytics = state.matches_db.analytics
+    wins, losses = analytics.record_between(match_type, name, opponent)
+    streaks = []
+    for pilot in (name, opponent):
+        current, best = analytics.streak(match_type, pilot)
+        streaks.append(f"{pilot}: current streak {current:+d}, best win streak {best}")
+    await interaction.response.send_message(f"{match_type} head to head: {name} {wins} - {losses} {opponent}.\n" + "\n".join(streaks))
+    print(f"head_to_head command used to view {name} against {opponent} in {match_type}.")
+
+@tree.command(name="rating_calibration", description="Views predicted against actual win rates, to check the ELO K factor.")
+@instrument_command
+async def rating_calibration(interaction: discord.Interaction, match_type: Optional[str] = None):
+    '''
+    Views predicted against actual win rates, over one match type or all of them.
+    '''
+    state = guild_states.get(interaction.guild_id)
+    if match_type is not None and match_type not in MATCH_TYPES:
+        await interaction.response.send_message("Invalid match type. Please use '1v1', '3v3 flex', or '3v3 reg'.")
+        return
+    await interaction.response.send_message(f"```{render_calibration(state.matches_db.analytics, match_type)}```")
+    print(f"rating_calibration command used to view {match_type or 'all'} calibration.")
 
 # QUEUE COMMANDS #
 @tree.command(name="solo_queue", description="Adds a player to a match queue.")
+@app_commands.autocomplete(player_name=player_name_autocomplete)
+@instrument_command
 async def solo_queue(interaction: discord.Interaction, player_name: str, match_type: str, rank_restriction: Optional[bool] = False):
     '''
     Adds a player to a match queue.
     '''
-    player = player_registry.get_player(player_name)
-    if player:
-        if match_type == "1v1":
-            try:
-                ones_queue.enqueue_player(player)
-                await interaction.response.send_message(f"{player_name} added to the 1v1 match queue.")
-                # Attempt to create a match
-                match = ones_queue.get_valid_match_from_queue()
-                if match:
-                    match.setup_match_parameters()
-                    matches_db.add_match(match)
-                    alpha_mention = f"<@{match.player_alpha.player_id}>"
-                    beta_mention = f"<@{match.player_beta.player_id}>"
-                    host = random.choice([alpha_mention, beta_mention])
-                    await interaction.followup.send(f'Match setup for match `{match.match_id}` complete. Host: {host}. Remember to create a 2 person lobby, rotation locked, with a 2 minute match timer. Use Map: {match.match_map}, Use Keyword: {match.keyword}. Players: {alpha_mention} vs {beta_mention}')
-            except ValueError:
-                await interaction.response.send_message(f"Player {player_name} is already in the 1v1 queue.")
-        elif match_type == "3v3 flex":
-            try:
-                threes_flex_queue.enqueue_player(player)
-                await interaction.response.send_message(f"{player_name} added to the 3v3 flex match queue.")
-                # Attempt to create a match
-                match = threes_flex_queue.get_valid_match_from_queue()
-                if match:
-                    match.setup_match_parameters()
-                    matches_db.add_match(match)
-                    alpha_mentions = ", ".join([f"<@{player.player_id}>" for player in match.team_alpha])
-                    beta_mentions = ", ".join([f"<@{player.player_id}>" for player in match.team_beta])
-                    host = random.choice([player.player_id for player in match.team_alpha + match.team_beta])
-                    await interaction.followup.send(f'Match setup for match `{match.match_id}` complete. Host: {host}. Remember to create a 9 person lobby, rotation locked, with a 5 minute match timer. Use Map: {match.match_map}, Use Keyword: {match.keyword}. Teams: {alpha_mentions} vs {beta_mentions}')
-            except ValueError:
-                await interaction.response.send_message(f"Player {player_name} is already in the 3v3 flex queue.")
-        else:
-            await interaction.response.send_message("Invalid match type. Please use '1v1' or '3v3 flex'.")
-    else:
+    state = guild_states.get(interaction.guild_id)
+    player = state.player_registry.get_player(player_name)
+    if not player:
         await interaction.response.send_message(f"Player {player_name} is not in the database.")
+        return
+    if match_type not in ("1v1", "3v3 flex"):
+        await interaction.response.send_message("Invalid match type. Please use '1v1' or '3v3 flex'.")
+        return
+
+    queue = state.get_queue(match_type)
+    try:
+        await queue.enqueue_player_async(player, rank_restriction)
+    except ValueError as error:
+        await interaction.response.send_message(f"{error}.")
+        return
+    await interaction.response.send_message(f"{player_name} added to the {match_type} match queue.")
+    # Attempt to create a match, the announcement goes out through the notification queue
+    await pop_match(interaction, state, queue)
 
 @tree.command(name="team_queue", description="Adds a team to the 3v3 reg match queue.")
+@app_commands.autocomplete(team_name=team_name_autocomplete)
+@instrument_command
 async def team_queue(interaction: discord.Interaction, team_name: str, match_type: str, rank_restriction: Optional[bool] = False):
-    if match_type == "3v3 reg":
-        team = teams_registry.get_team(team_name)
-        if team:
-            try:
-                threes_reg_queue.enqueue_team(team)
-                await interaction.response.send_message(f"{team_name} added to the 3v3 reg match queue.")
-                # Attempt to create a match
-                match = threes_reg_queue.get_valid_match_from_queue()
-                if match:
-                    match.setup_match_parameters()
-                    matches_db.add_match(match)
-                    alpha_mentions = ", ".join([f"<@{player.player_id}>" for player in match.team_alpha.roster])
-                    beta_mentions = ", ".join([f"<@{player.player_id}>" for player in match.team_beta.roster])
-                    host = random.choice([player.player_id for player in match.team_alpha.roster + match.team_beta.roster])
-                    await interaction.followup.send(f'Match setup for match `{match.match_id}` complete. Host: {host}. Remember to create a 9 person lobby, rotation locked, with a 5 minute match timer. Use Map: {match.match_map}, Use Keyword: {match.keyword}. Teams: {alpha_mentions} vs {beta_mentions}')
-            except ValueError:
-                await interaction.response.send_message(f"Team {team_name} is already in the 3v3 reg queue.")
-        else:
-            await interaction.response.send_message(f"Team {team_name} is not in the database.")
-    else:
+    state = guild_states.get(interaction.guild_id)
+    if match_type != "3v3 reg":
         await interaction.response.send_message("Invalid match type. Please use '3v3 reg'.")
+        return
+    team = state.teams_registry.get_team(team_name)
+    if not team:
+        await interaction.response.send_message(f"Team {team_name} is not in the database.")
+        return
+
+    try:
+        await state.threes_reg_queue.enqueue_team_async(team, rank_restriction)
+    except ValueError as error:
+        await interaction.response.send_message(f"{error}.")
+        return
+    await interaction.response.send_message(f"{team_name} added to the 3v3 reg match queue.")
+    # Attempt to create a match, the announcement goes out through the notification queue
+    await pop_match(interaction, state, state.threes_reg_queue)
 
 @tree.command(name="party_queue", description="Adds a party to the 3v3 flex match queue.")
+@app_commands.autocomplete(player_1=player_name_autocomplete, player_2=player_name_autocomplete, player_3=player_name_autocomplete)
+@instrument_command
 async def party_queue(interaction: discord.Interaction, player_1: str, player_2: Optional[str] = None, player_3: Optional[str] = None, rank_restriction: Optional[bool] = False):
     '''
     Adds a party to the 3v3 flex match queue.
     '''
-    party = [player_registry.get_player(player_1)]
+    state = guild_states.get(interaction.guild_id)
+    party = [state.player_registry.get_player(player_1)]
     if player_2:
-        party.append(player_registry.get_player(player_2))
+        party.append(state.player_registry.get_player(player_2))
     if player_3:
-        party.append(player_registry.get_player(player_3))
-    if all(party):
-        try:
-            threes_flex_queue.enqueue_party(party, rank_restriction)
-            await interaction.response.send_message(f"Party {', '.join([player.player_name for player in party])} added to the 3v3 flex match queue.")
-            # Attempt to create a match
-            match = threes_flex_queue.get_valid_match_from_queue()
-            if match:
-                match.setup_match_parameters()
-                matches_db.add_match(match)
-                alpha_mentions = ", ".join([f"<@{player.player_id}>" for player in match.team_alpha])
-                beta_mentions = ", ".join([f"<@{player.player_id}>" for player in match.team_beta])
-                host = random.choice([player.player_id for player in match.team_alpha + match.team_beta])
-                await interaction.followup.send(f'Match setup for match `{match.match_id}` complete. Host: {host}. Remember to create a 9 person lobby, rotation locked, with a 5 minute match timer. Use Map: {match.match_map}, Use Keyword: {match.keyword}. Teams: {alpha_mentions} vs {beta_mentions}')
-        except ValueError:
-            await interaction.response.send_message("Party is already in the 3v3 flex queue.")
-    else:
+        party.append(state.player_registry.get_player(player_3))
+    if not all(party):
         await interaction.response.send_message("Invalid party. Please ensure all players are in the database.")
+        return
+
+    try:
+        await state.threes_flex_queue.enqueue_party_async(party, rank_restriction)
+    except ValueError as error:
+        await interaction.response.send_message(f"Party could not be queued. {error}.")
+        return
+    await interaction.response.send_message(f"Party {', '.join([player.player_name for player in party])} added to the 3v3 flex match queue.")
+    # Attempt to create a match, the announcement goes out through the notification queue
+    await pop_match(interaction, state, state.threes_flex_queue)
+
+@tree.command(name="leave_queue", description="Removes a player, and their party or team, from every queue they are in.")
+@app_commands.autocomplete(player_name=player_name_autocomplete)
+@instrument_command
+async def leave_queue(interaction: discord.Interaction, player_name: str):
+    '''
+    Removes a player, and their party or team, from every queue they are in.
+    '''
+    state = guild_states.get(interaction.guild_id)
+    queue_types = state.queue_membership.queues_for(player_name)
+    if not queue_types:
+        await interaction.response.send_message(f"Player {player_name} is not in any queue.")
+        return
+    left = []
+    for queue_type in queue_types:
+        left += await state.get_queue(queue_type).leave_async(player_name)
+    await interaction.response.send_message(f"{', '.join(left)} left the {', '.join(queue_types)} queue(s).")
+    print(f"leave_queue command used to remove {player_name} from {queue_types}.")
+
+@tree.command(name="set_queue_policy", description="Sets whether players may queue for several match types at once.")
+@instrument_command
+async def set_queue_policy(interaction: discord.Interaction, admin_passwd: str, policy: str):
+    '''
+    Sets whether players may queue for several match types at once.
+    'exclusive' allows one queue per player, 'multi' allows several and withdraws players from the rest when a match pops.
+    '''
+    state = guild_states.get(interaction.guild_id)
+    if admin_passwd != os.getenv('ADMIN_PASSWD'):
+        await interaction.response.send_message("Invalid admin password.")
+        print("set_queue_policy command used with invalid admin password.")
+        return
+    try:
+        state.set_queue_policy(policy)
+    except ValueError as error:
+        await interaction.response.send_message(f"{error}.")
+        return
+    await interaction.response.send_message(f"Queue policy set to {policy}.")
+    print(f"set_queue_policy command used to set the queue policy to {policy}.")
+
+# ADMIN COMMANDS #
+@tree.command(name="set_rank_threshold", description="Sets a placement, promotion or demotion ELO and re-ranks the ladder.")
+@instrument_command
+async def set_rank_threshold(interaction: discord.Interaction, admin_passwd: str, rank: str, threshold: str, elo: int):
+    '''
+    Sets a placement, promotion or demotion ELO and re-ranks the ladder.
+    '''
+    state = guild_states.get(interaction.guild_id)
+    if admin_passwd != os.getenv('ADMIN_PASSWD'):
+        await interaction.response.send_message("Invalid admin password.")
+        print("set_rank_threshold command used with invalid admin password.")
+        return
+    try:
+        changed = state.set_rank_threshold(rank, threshold, elo)
+    except ValueError as error:
+        await interaction.response.send_message(f"{error}.")
+        return
+    await interaction.response.send_message(f"The {rank} {threshold} ELO is now {elo}. {changed} rank(s) changed.")
+    print(f"set_rank_threshold command used to set the {rank} {threshold} ELO to {elo}, {changed} rank(s) changed.")
+
+@tree.command(name="reset_season", description="Archives the current season and soft-resets every rating toward the ladder mean.")
+@instrument_command
+async def reset_season(interaction: discord.Interaction, admin_passwd: str, compression: float = SEASON_RESET_COMPRESSION):
+    '''
+    Archives the current season and soft-resets every rating toward the ladder mean.
+    '''
+    state = guild_states.get(interaction.guild_id)
+    if admin_passwd != os.getenv('ADMIN_PASSWD'):
+        await interaction.response.send_message("Invalid admin password.")
+        print("reset_season command used with invalid admin password.")
+        return
+    try:
+        archived = state.reset_season(compression)
+    except ValueError as error:
+        await interaction.response.send_message(f"{error}.")
+        return
+    await interaction.response.send_message(f"Season {archived} archived. Season {archived + 1} has begun, ratings were compressed {compression:.0%} toward the ladder mean.")
+    print(f"reset_season command used to archive season {archived} with compression {compression}.")
+
+@tree.command(name="set_map_pool", description="Sets the maps a season draws from, separated by semicolons.")
+@instrument_command
+async def set_map_pool(interaction: discord.Interaction, admin_passwd: str, pool: str, maps: str, season: Optional[int] = None):
+    '''
+    Sets the maps a season draws from, separated by semicolons since map names can contain commas.
+    '''
+    state = guild_states.get(interaction.guild_id)
+    if admin_passwd != os.getenv('ADMIN_PASSWD'):
+        await interaction.response.send_message("Invalid admin password.")
+        print("set_map_pool command used with invalid admin password.")
+        return
+    try:
+        state.set_map_pool(pool, maps.split(';'), season)
+    except ValueError as error:
+        await interaction.response.send_message(f"{error}.")
+        return
+    season = state.settings['season'] if season is None else season
+    pool_maps = state.settings['map_pools'][str(season)][pool]
+    await interaction.response.send_message(f"The season {season} {pool} map pool is now: {', '.join(pool_maps)}.")
+    print(f"set_map_pool command used to set the season {season} {pool} map pool to {pool_maps}.")
 
 # QUEUE VISUALIZING COMMANDS #
-@tree.command(name="view_ones_queue", description="Views the 1v1 match queue.")
-async def view_ones_queue(interaction: discord.Interaction):
+def format_wait(seconds: Optional[float]):
+    if seconds is None:
+        return "unknown"
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes}m {seconds:02d}s" if minutes else f"{seconds}s"
+
+def render_queue(queue: MatchQueue, title: str):
     '''
-    Views the 1v1 match queue.
+    The first QUEUE_VIEW_ROWS entries of a queue with their waits, rendered from its snapshot so no queue lock is needed
     '''
     console = Console(force_terminal=False)
-    table = Table(title="1v1 Match Queue")
-
-    table.add_column("Player Name", justify="center")
-    table.add_column("Player ELO", justify="center")
+    entries = queue.snapshot()
+    table = Table(title=f"{title}: {len(entries)} {'teams' if queue.queue_type == '3v3 reg' else 'players'} in queue")
+    table.add_column("Team Name" if queue.queue_type == '3v3 reg' else "Player Name", justify="center")
+    table.add_column("ELO", justify="center")
     table.add_column("Rank Restriction", justify="center")
-
-    for player, rank_restriction, party_id in ones_queue.queued_players:
-        table.add_row(player.player_name, str(player.player_singles_ELO), f'{player.player_singles_rank}+' if rank_restriction else "None")
+    if queue.queue_type == '3v3 flex':
+        table.add_column("Party ID", justify="center")
+    table.add_column("Waited", justify="center")
+    table.add_column("ETA", justify="center")
+
+    for entry in entries[:QUEUE_VIEW_ROWS]:
+        status = queue.status(entry.name)
+        row = [entry.name, f"{entry.ELO:.0f}", f'{RANKS[entry.rank]}+' if entry.rank_restriction else "None"]
+        if queue.queue_type == '3v3 flex':
+            row.append(str(entry.party_id) if entry.party_id else "None")
+        table.add_row(*row, format_wait(status.waited), format_wait(status.eta))
 
     with console.capture() as capture:
         console.print(table)
-    table_output = capture.get()
+    more = f"...and {len(entries) - QUEUE_VIEW_ROWS} more, use /queue_status to find an entry." if len(entries) > QUEUE_VIEW_ROWS else ""
+    return f"```{capture.get()}```{more}"
 
-    await interaction.response.send_message(f"{len(ones_queue)} Players are currently in queue for 1v1 matches")
+@tree.command(name="view_ones_queue", description="Views the 1v1 match queue.")
+@instrument_command
+async def view_ones_queue(interaction: discord.Interaction):
+    '''
+    Views the 1v1 match queue.
+    '''
+    state = guild_states.get(interaction.guild_id)
+    await interaction.response.send_message(render_queue(state.ones_queue, "1v1 Match Queue"))
     print("view_ones_queue command used to view 1v1 match queue.")
 
 @tree.command(name="view_threes_reg_queue", description="Views the 3v3 reg match queue.")
+@instrument_command
 async def view_threes_reg_queue(interaction: discord.Interaction):
     '''
     Views the 3v3 match queue.
     '''
-    console = Console(force_terminal=False)
-    table = Table(title="3v3 Reg Match Queue")
-
-    table.add_column("Team Name", justify="center")
-    table.add_column("Team ELO", justify="center")
-    table.add_column("Rank Restriction", justify="center")
-
-    for team, rank_restriction, party_id in threes_reg_queue.queued_teams:
-        table.add_row(team.team_name, str(team.team_ELO), f'{team.team_rank}+' if rank_restriction else "None")
-
-    with console.capture() as capture:
-        console.print(table)
-    table_output = capture.get()
-
-    await interaction.response.send_message(f"{len(threes_reg_queue)} Teams are in queue for 3v3 reG matches")
+    state = guild_states.get(interaction.guild_id)
+    await interaction.response.send_message(render_queue(state.threes_reg_queue, "3v3 Reg Match Queue"))
     print("view_threes_reg_queue command used to view 3v3 reg match queue.")
 
 @tree.command(name="view_threes_flex_queue", description="Views the 3v3 flex match queue.")
+@instrument_command
 async def view_threes_flex_queue(interaction: discord.Interaction):
     '''
     Views the 3v3 flex match queue.
     '''
-    console = Console(force_terminal=False)
-    table = Table(title="3v3 Flex Match Queue")
-
-    table.add_column("Player Name", justify="center")
-    table.add_column("Player ELO", justify="center")
-    table.add_column("Rank Restriction", justify="center")
-    table.add_column("Party ID", justify="center")
-
-    for player, rank_restriction, party_id in threes_flex_queue.queued_players:
-        table.add_row(player.player_name, str(player.player_teams_ELO), f'{player.player_teams_rank}+' if rank_restriction else "None", str(party_id) if party_id else "None")
-
-    with console.capture() as capture:
-        console.print(table)
-    table_output = capture.get()
-
-    await interaction.response.send_message(f"{len(threes_flex_queue)} Players are currently in queue for 3v3 flex matches")
+    state = guild_states.get(interaction.guild_id)
+    await interaction.response.send_message(render_queue(state.threes_flex_queue, "3v3 Flex Match Queue"))
     print("view_threes_flex_queue command used to view 3v3 flex match queue.")
 
+@tree.command(name="queue_status", description="Shows a player's place in queue and their estimated wait.")
+@app_commands.autocomplete(player_name=player_name_autocomplete)
+@instrument_command
+async def queue_status(interaction: discord.Interaction, player_name: str):
+    '''
+    Shows a player's position, ELO window and estimated wait in every queue they are in.
+    The estimate divides the entries ahead of them in their ELO window by the recent pop rate in that window.
+    '''
+    state = guild_states.get(interaction.guild_id)
+    queue_types = state.queue_membership.queues_for(player_name)
+    if not queue_types:
+        await interaction.response.send_message(f"Player {player_name} is not in any queue.")
+        return
+    lines = []
+    for queue_type in queue_types:
+        status = state.get_queue(queue_type).status(player_name)
+        eta = format_wait(status.eta) if status.eta is not None else "unknown until matches pop in this ELO window"
+        lines.append(f"{status.name} is #{status.position} of {status.queue_length} in the {queue_type} queue, "
+                     f"{status.ahead} ahead within ELO {status.ELO_low:.0f}-{status.ELO_high:.0f}. "
+                     f"Waited {format_wait(status.waited)}, estimated wait {eta}.")
+    await interaction.response.send_message("\n".join(lines))
+    print(f"queue_status command used to show {player_name} in {queue_types}.")
+
 # MATCHING SLASH COMMANDS #
 @tree.command(name="private_singles_match_setup", description="Creates a private match between two players.")
+@app_commands.autocomplete(player1=player_name_autocomplete, player2=player_name_autocomplete)
+@instrument_command
 async def private_singles_match_setup(interaction: discord.Interaction, player1: str, player2: str):
     '''
     Creates a match between two players.
     '''
+    state = guild_states.get(interaction.guild_id)
     # Check if the players are in the database
-    alpha = player_registry.get_player(player1)
-    beta = player_registry.get_player(player2)
+    alpha = state.player_registry.get_player(player1)
+    beta = state.player_registry.get_player(player2)
 
     if alpha and beta:
         # Create a match
         new_match = match(match_type='1v1', player_alpha=alpha, player_beta=beta)
-        new_match.setup_match_parameters()
-        matches_db.add_match(new_match)
+        new_match.setup_match_parameters(state.map_rotation)
+        await state.matches_db.add_match_async(new_match)
         await interaction.response.send_message(f'Match setup for match `{new_match.match_id}` complete. Remember to create a 2 person lobby, rotation locked, with a 5 minute match timer. Use Map: {new_match.match_map}, Use Keyword: {new_match.keyword}')
         print(f'single_match_setup command used to create a match between {player1} and {player2}.')
     else:
@@ -465,19 +795,22 @@ async def private_singles_match_setup(interaction: discord.Interaction, player1:
         print(f"single_match_setup command used to create a match between {player1} and {player2}, but one or both players are not in the database.")
 
 @tree.command(name="private_team_match_setup", description="Creates a private 3v3 reg match between two teams.")
+@app_commands.autocomplete(team1=team_name_autocomplete, team2=team_name_autocomplete)
+@instrument_command
 async def private_team_match_setup(interaction: discord.Interaction, team1: str, team2: str):
     '''
     Creates a match between two teams.
     '''
+    state = guild_states.get(interaction.guild_id)
     # Check if the teams are in the database
-    alpha_squad = teams_registry.get_team(team1)
-    beta_squad = teams_registry.get_team(team2)
+    alpha_squad = state.teams_registry.get_team(team1)
+    beta_squad = state.teams_registry.get_team(team2)
 
     if alpha_squad and beta_squad:
         # Create a match
         new_match = match(match_type='3v3 reg', team_alpha=alpha_squad, team_beta=beta_squad)
-        new_match.setup_match_parameters()
-        matches_db.add_match(new_match)
+        new_match.setup_match_parameters(state.map_rotation)
+        await state.matches_db.add_match_async(new_match)
         await interaction.response.send_message(f'Match setup for match `{new_match.match_id}` complete. Remember to create a 9 person lobby, rotation locked, with a 5 minute match timer. Use Map: {new_match.match_map}, Use Keyword: {new_match.keyword}')
         print(f'team_match_setup command used to create a match between {team1} and {team2}.')
     else:
@@ -485,73 +818,97 @@ async def private_team_match_setup(interaction: discord.Interaction, team1: str,
         print(f"team_match_setup command used to create a match between {team1} and {team2}, but one or both teams are not in the database.")
 
 @tree.command(name="cancel_match", description="Cancels a match.")
+@app_commands.autocomplete(match_id=pending_match_autocomplete)
+@instrument_command
 async def cancel_match(interaction: discord.Interaction, admin_passwd: str, match_id: int):
     '''
     Cancels a match.
     '''
+    state = guild_states.get(interaction.guild_id)
     if admin_passwd != os.getenv('ADMIN_PASSWD'):
         await interaction.response.send_message(f"Invalid password.")
         print(f"cancel_match command used with invalid password.")
         return
-    match_to_cancel = matches_db.get_match(match_id)
+    match_to_cancel = state.matches_db.get_match(match_id)
     if match_to_cancel:
-        matches_db.remove_match(match_to_cancel.match_id)
-        await interaction.response.send_message(f"Match {match_id} has been cancelled and will not affect statistics.")
+        kept = match_to_cancel.match_status == 'completed' and match_to_cancel.result is None
+        reverted = await state.matches_db.cancel_match_async(match_to_cancel.match_id)
+        if kept:
+            await interaction.response.send_message(f"Match {match_id} has been cancelled. It was completed before the last restart, so its rating changes stay.")
+        elif reverted:
+            await interaction.response.send_message(f"Match {match_id} has been cancelled and its rating changes reverted.\n```{reverted.explain()}```")
+        else:
+            await interaction.response.send_message(f"Match {match_id} has been cancelled and will not affect statistics.")
         print(f"cancel_match command used to cancel match {match_id}.")
     else:
         await interaction.response.send_message(f"Match {match_id} is not in the database.")
         print(f"cancel_match command used to cancel match {match_id}, but match is not in the database.")
 
-@tree.command(name="report_match_results", description="Records the results of a match.")
-async def report_match_results(interaction: discord.Interaction, match_id: int, win: str, lose: str, win_2: Optional[str] = None, win_3: Optional[str] = None, lose_2: Optional[str] = None, lose_3: Optional[str] = None):
+@tree.command(name="report_match_results", description="Reports who won a match, recorded once both sides agree.")
+@app_commands.autocomplete(match_id=pending_match_autocomplete, win=match_side_autocomplete, lose=match_side_autocomplete, win_2=match_side_autocomplete, win_3=match_side_autocomplete, lose_2=match_side_autocomplete, lose_3=match_side_autocomplete)
+@instrument_command
+async def report_match_results(interaction: discord.Interaction, match_id: int, win: str, lose: str, win_2: Optional[str] = None, win_3: Optional[str] = None, lose_2: Optional[str] = None, lose_3: Optional[str] = None, admin_passwd: Optional[str] = None):
     '''
-    Records the results of a match.
+    Reports who won a match. The result is recorded once a player from each side has reported the same winner,
+    or at once with the admin password. Sides that disagree put the match in dispute, reverting a recorded result.
     '''
+    state = guild_states.get(interaction.guild_id)
     # Check if the match is in the database
-    match = matches_db.get_match(match_id)
-    if match:
-        if match.match_status == "completed":
-            await interaction.response.send_message(f"Match {match_id} has already been completed.")
-            print(f"match_results command used to record results of match {match_id}, but match has already been completed.")
-            return
-        else:
-            if match.match_type == '1v1':
-                winner = player_registry.get_player(win)
-                loser = player_registry.get_player(lose)
-                match.report_match_results(winner, loser)
-                await interaction.response.send_message(f"Match {match_id} results recorded. {winner.player_name} wins.")
-            elif match.match_type == '3v3 reg':
-                winner = teams_registry.get_team(win)
-                loser = teams_registry.get_team(lose)
-                match.report_match_results(winner, loser)
-                await interaction.response.send_message(f"Match {match_id} results recorded. {winner.team_name} wins.")
-            else:  # '3v3 flex'
-                winner = [player_registry.get_player(win)]
-                loser = [player_registry.get_player(lose)]
-                if win_2:
-                    winner.append(player_registry.get_player(win_2))
-                if win_3:
-                    winner.append(player_registry.get_player(win_3))
-                if lose_2:
-                    loser.append(player_registry.get_player(lose_2))
-                if lose_3:
-                    loser.append(player_registry.get_player(lose_3))
-                if all(winner) and all(loser):
-                    match.report_match_results(winner, loser)
-                    await interaction.response.send_message(f"Match {match_id} results recorded. Winning team: {', '.join([player.player_name for player in winner])}")
-                else:
-                    await interaction.response.send_message("One or more players in the winning or losing team are not in the database.")
-            print(f"match_results command used to record results of match {match_id}.")
-    else:
+    match = state.matches_db.get_match(match_id)
+    if not match:
         await interaction.response.send_message(f"Match {match_id} is not in the database.")
         print(f"match_results command used to record results of match {match_id}, but match is not in the database.")
+        return
+    if admin_passwd is not None and admin_passwd != os.getenv('ADMIN_PASSWD'):
+        await interaction.response.send_message("Invalid admin password.")
+        return
+    name = RESULT_FIELDS[match.match_type][0]
+    side_names = dict(zip(('alpha', 'beta'), ([getattr(member, name) for member in side] for side in match.sides())))
+    winners = [player for player in (win, win_2, win_3) if player]
+    losers = [player for player in (lose, lose_2, lose_3) if player]
+    winner_side = next((side for side, names in side_names.items() if names and all(player in names for player in winners)), None)
+    if winner_side is None or not all(player in side_names[other_side(winner_side)] for player in losers):
+        await interaction.response.send_message(f"{', '.join(winners)} and {', '.join(losers)} are not on opposite sides of match {match_id}.")
+        return
+    reporter_side = None
+    if admin_passwd is None:
+        alpha, beta = match_sides(match)
+        reporter_side = next((side for side, players in (('alpha', alpha), ('beta', beta))
+                              if any(player.player_id == interaction.user.id for player in players)), None)
+        if reporter_side is None:
+            await interaction.response.send_message(f"Only players in match {match_id} can report its result.")
+            return
+    try:
+        # reports are applied under the database lock, so concurrent and repeated reports settle once
+        status, result = await state.matches_db.submit_report(match_id, reporter_side, winner_side, f"{match_id}:{interaction.user.id}:{winner_side}")
+    except ValueError as error:
+        await interaction.response.send_message(f"{error}.")
+        return
+    winner_names = ', '.join(side_names[winner_side])
+    if status == 'duplicate':
+        message = f"Your report for match {match_id} was already recorded."
+    elif status == 'awaiting':
+        message = f"Report recorded: {winner_names} won match {match_id}. Waiting for the other side to confirm."
+    elif status == 'confirmed' and result:
+        message = f"Match {match_id} results recorded. {winner_names} wins.\n```{result.explain()}```"
+    elif status == 'confirmed':
+        message = f"Match {match_id} result confirmed."
+    else: # disputed
+        message = f"Match {match_id} is disputed, the sides reported different winners. Agree on the result or ask an admin to decide it."
+        if result:
+            message += f" The result recorded earlier was reverted.\n```{result.explain()}```"
+    await interaction.response.send_message(message)
+    print(f"match_results command used to report match {match_id}: {status}.")
 
 @tree.command(name="match_summary", description="Views the status of a match.")
+@app_commands.autocomplete(match_id=pending_match_autocomplete)
+@instrument_command
 async def match_summary(interaction: discord.Interaction, match_id: int):
     '''
     Views the status of a match.
     '''
-    match = matches_db.get_match(match_id)
+    state = guild_states.get(interaction.guild_id)
+    match = state.matches_db.get_match(match_id)
     if match:
         await interaction.response.send_message(f"{match}")
     else:
@@ -560,23 +917,48 @@ async def match_summary(interaction: discord.Interaction, match_id: int):
 
 # DUMP COMMAND #
 @tree.command(name="dump_databases", description="Dumps all databases to their respective files.")
+@instrument_command
 async def dump_databases(interaction: discord.Interaction, admin_passwd: str):
     '''
     Dumps all databases to their respective files.
     '''
+    state = guild_states.get(interaction.guild_id)
     if admin_passwd != os.getenv('ADMIN_PASSWD'):
         await interaction.response.send_message("Invalid admin password.")
         print("dump_databases command used with invalid admin password.")
         return
 
-    player_registry.dump_players_db(players_path)
-    teams_registry.dump_teams_db(teams_path)
-    matches_db.dump_matches_db(matches_path)
+    state.dump()
     await interaction.response.send_message("All databases have been dumped to their respective files.")
     print("dump_databases command used to dump all databases.")
 
+# PROFILE COMMAND #
+@tree.command(name="profile", description="Samples the bot for a number of seconds and posts the busiest functions.")
+@instrument_command
+async def profile(interaction: discord.Interaction, admin_passwd: str, seconds: int = 30):
+    '''
+    Samples the bot for a number of seconds and posts the busiest functions.
+    The full collapsed-stack profile is written to the profiles directory.
+    '''
+    if admin_passwd != os.getenv('ADMIN_PASSWD'):
+        await interaction.response.send_message("Invalid admin password.")
+        print("profile command used with invalid admin password.")
+        return
+
+    seconds = max(1, min(seconds, MAX_PROFILE_SECONDS))
+    await interaction.response.send_message(f"Profiling for {seconds} seconds.")
+    try:
+        sampler, file_path = await profile_event_loop(seconds)
+    except ValueError as error:
+        await interaction.followup.send(f"{error}.")
+        return
+    summary = sampler.summary()[:1800]
+    await interaction.followup.send(f"Profile written to `{file_path}`.\n```\n{summary}\n```")
+    print(f"profile command used to sample the bot for {seconds} seconds, written to {file_path}.")
+
 # HELP COMMAND #
 @tree.command(name="help", description="Displays all commands available.")
+@instrument_command
 async def help(interaction: discord.Interaction):
     '''
     Displays all commands available.
@@ -586,28 +968,45 @@ async def help(interaction: discord.Interaction):
  
     **Onboarding Commands**
     - `/onboard_player <player_name> [player_team]` - Onboards a player to the database.
+    - `/set_roles <player_name> [role; role; ...]` - Sets the roles a player prefers in 3v3 flex: brawler, skirmisher, artillery or tank.
     - `/onboard_team <team_name> <player1> <player2> <player3>` - Onboards a team to the database.
 
     **Stats Commands**
-    - `/playerstats <player_name>` - Views the stats of a player.
-    - `/teamstats <team_name>` - Views the stats of a team.
-    - `/solo_leaderboard` - Views the leaderboard for 1v1 matches.
-    - `/reg_teams_leaderboard` - Views the leaderboard for 3v3 regular matches.
-    - `/flex_teams_leaderboard` - Views the leaderboard for 3v3 flex matches.
+    - `/playerstats <player_name> [season]` - Views the stats of a player.
+    - `/teamstats <team_name> [season]` - Views the stats of a team.
+    - `/solo_leaderboard [season]` - Views the leaderboard for 1v1 matches.
+    - `/reg_teams_leaderboard [season]` - Views the leaderboard for 3v3 regular matches.
+    - `/flex_teams_leaderboard [season]` - Views the leaderboard for 3v3 flex matches.
+    - `/leaderboard [ladder] [rank] [team_name] [player_name] [season]` - Pages through a whole ladder, filtered by rank and team, from the top or from a player or team.
+
+    **Analytics Commands**
+    - `/map_winrates [match_type]` - Views win rates per map and rank.
+    - `/head_to_head <name> <opponent> [match_type]` - Views the record and streaks of two players or teams against each other.
+    - `/rating_calibration [match_type]` - Views predicted against actual win rates, to check the ELO K factor.
 
     **Queue Commands**
     - `/solo_queue <player_name> <match_type> [rank_restriction]` - Adds a player to a match queue.
     - `/team_queue <team_name> <match_type> [rank_restriction]` - Adds a team to the 3v3 regular match queue.
     - `/party_queue <player_1> [player_2] [player_3] [rank_restriction]` - Adds a party to the 3v3 flex match queue.
+    - `/leave_queue <player_name>` - Removes a player, and their party or team, from every queue they are in.
     - `/view_ones_queue` - Views the 1v1 match queue.
     - `/view_threes_reg_queue` - Views the 3v3 regular match queue.
     - `/view_threes_flex_queue` - Views the 3v3 flex match queue.
+    - `/queue_status <player_name>` - Shows a player's place in queue, ELO window and estimated wait.
+    - `/set_queue_policy <admin_passwd> <exclusive|multi>` - Sets whether players may queue for several match types at once.
 
     **Match Commands**
     - `/private_singles_match_setup <player1> <player2>` - Creates a private match between two players.
     - `/private_team_match_setup <team1> <team2>` - Creates a private 3v3 regular match between two teams.
-    - `/report_match_results <match_id> <win> <lose>` - Records the results of a match.
+    - `/report_match_results <match_id> <win> <lose> [admin_passwd]` - Reports who won a match, recorded once both sides agree or at once with the admin password.
     - `/match_summary <match_id>` - Views the status of a match.
+
+    **Admin Commands**
+    - `/set_rank_threshold <admin_passwd> <rank> <placement|promotion|demotion> <elo>` - Sets a rank threshold and re-ranks the ladder.
+    - `/reset_season <admin_passwd> [compression]` - Archives the current season and soft-resets every rating toward the ladder mean.
+    - `/set_map_pool <admin_passwd> <1v1|3v3> <map; map; ...> [season]` - Sets the maps a season draws from.
+    - `/publish_leaderboards <admin_passwd> [interval] [stop]` - Pins the standings in this channel and keeps them current.
+    - `/profile <admin_passwd> [seconds]` - Samples the bot for a number of seconds and posts the busiest functions.
     
     **Help Command**
     - `/help` - Displays all commands available.
@@ -616,20 +1015,46 @@ async def help(interaction: discord.Interaction):
     print("Help command used to display all available commands.")
 
 # Start the bot #
-bot_token = os.environ.get('DISCORD_BOT_TOKEN')
-
-if bot_token:
-    print("Bot token found, initializing bot.")
-    client.run(bot_token) # activate the Ravens Nest bot
-
-    async def dump_databases():
-        while True:
-            await asyncio.sleep(3600)  # 1 hour interval
-            player_registry.dump_players_db(players_path)
-            teams_registry.dump_teams_db(teams_path)
-            matches_db.dump_matches_db(matches_path)
-            print("Databases dumped.")
-
-    client.loop.create_task(dump_databases())
-else:
-    raise ValueError("Bot token not found. Please set the DISCORD_BOT_TOKEN environment variable.")
+async def dump_databases_periodically():
+    '''
+    Dumps every loaded guild to disk once an hour and evicts guilds that have gone idle.
+    '''
+    while True:
+        await asyncio.sleep(3600)  # 1 hour interval
+        guild_states.dump_all()
+        evicted = guild_states.evict_idle()
+        for guild_id in evicted:
+            leaderboard_publisher.forget(guild_id)
+        print(f"Databases dumped. {len(evicted)} idle guild(s) evicted, {len(guild_states)} guild(s) loaded.")
+
+@client.event
+async def setup_hook():
+    '''
+    Runs once before the bot connects. Starts the background tasks.
+    '''
+    asyncio.create_task(dump_databases_periodically())
+    asyncio.create_task(leaderboard_publisher.run(guild_states, resolve_channel))
+    loop_monitor.start()
+    if os.getenv('RAVENS_NEST_METRICS_PORT'):
+        await serve_metrics(int(os.getenv('RAVENS_NEST_METRICS_PORT')))
+    if os.getenv('RAVENS_NEST_METRICS_LOG_INTERVAL'):
+        asyncio.create_task(log_metrics_periodically(float(os.getenv('RAVENS_NEST_METRICS_LOG_INTERVAL'))))
+
+def main():
+    '''
+    Runs the bot until it is stopped. Importing this module only registers the commands,
+    so the handlers can also be driven offline, see ravens_nest.loadtest.
+    '''
+    bot_token = os.environ.get('DISCORD_BOT_TOKEN')
+
+    if bot_token:
+        print("Bot token found, initializing bot.")
+        client.run(bot_token) # activate the Ravens Nest bot
+        guild_states.dump_all() # persist every loaded guild on shutdown
+        matchmaking_pool.shutdown()
+        loop_monitor.stop()
+    else:
+        raise ValueError("Bot token not found. Please set the DISCORD_BOT_TOKEN environment variable.")
+
+if __name__ == '__main__':
+    main()
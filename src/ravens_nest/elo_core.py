@@ -2,17 +2,25 @@
 Core logic for Armored Core VI ELO bot
 Designed by Ahasuerus for Armored Scrims Server
 '''
-from typing import Optional
+from typing import NamedTuple, Optional
 from datetime import datetime
 from rich.table import Table
 from rich.console import Console
 import random
 import string
 import math
+import heapq
+import asyncio
+import json
+from bisect import bisect_right
+from ravens_nest.metrics import timed
+from ravens_nest.name_index import PrefixIndex
+from ravens_nest.matchmaking import win_probability, match_quality
 
 # constants
 ELO_MAXIMUM = 2200 # the highest possible ELO
 ELO_MINIMUM = 100 # the lowest possible ELO
+ELO_K = 30 # the K factor of ELO_formula, the most a single result can move a rating
 ELO_TO_RANK = {
     'D': {'min': ELO_MINIMUM, 'max': 699},
     'C': {'min': 700, 'max': 949},
@@ -21,6 +29,17 @@ ELO_TO_RANK = {
     'S': {'min': 1500, 'max': 1699},
     'SS': {'min': 1700, 'max': ELO_MAXIMUM},
 }
+RANKS = tuple(ELO_TO_RANK) # lowest to highest
+RANK_ORDINALS = {rank: ordinal for ordinal, rank in enumerate(RANKS)}
+RANK_BOUNDARIES = [values['min'] for values in list(ELO_TO_RANK.values())[1:]] # the ELO each rank above D starts at
+PLACEMENT_MATCHES = 5 # matches a new pilot (or team) plays on a ladder before being placed into a rank
+DEMOTION_MARGIN = 50 # by default a rank is kept until the ELO drops this far below the rank minimum
+RESULT_FIELDS = { # match type -> attributes a result changes: (name, ELO, rank, wins, losses, placement matches played)
+    '1v1': ('player_name', 'player_singles_ELO', 'player_singles_rank', 'singles_wins', 'singles_losses', 'singles_placement_played'),
+    '3v3 flex': ('player_name', 'player_teams_ELO', 'player_teams_rank', 'teams_wins', 'teams_losses', 'teams_placement_played'),
+    '3v3 reg': ('team_name', 'team_ELO', 'team_rank', 'wins', 'losses', 'placement_played'),
+}
+PLAYER_ROLES = ('brawler', 'skirmisher', 'artillery', 'tank') # AC build archetypes a pilot can prefer in 3v3 flex
 
 APPROVED_1S_MAPS = ['Contaminated City A', 'Xylem, the Floating City',
                     'Jorgen Refueling Base', 'Grid 086 A',
@@ -32,19 +51,172 @@ APPROVED_3S_MAPS = ['Contaminated City B', 'Bona Dea Dunes A',
 
 
 # Helper functions
+def get_rank_ordinal(ELO: int):
+    '''
+    Get the position of the rank an ELO value falls in, 0 for D up to 5 for SS
+
+    :param ELO: The ELO value of the player
+
+    returns: The rank ordinal, see RANKS
+    '''
+    return bisect_right(RANK_BOUNDARIES, ELO)
+
 def get_rank_from_ELO(ELO: int):
     '''
     Get the rank from the ELO value
 
     :param ELO: The ELO value of the player
 
-    returns: The rank of the player
+    returns: The rank of the player, SS ranks carry the ELO as SS_<ELO>
+    '''
+    return rank_name(get_rank_ordinal(ELO), ELO)
+
+def rank_name(ordinal: int, ELO: int):
+    '''
+    Get the rank string stored on players and teams for a rank ordinal, SS ranks carry the ELO as SS_<ELO>
+    '''
+    rank = RANKS[ordinal]
+    return f'SS_{ELO}' if rank == 'SS' else rank
+
+def rank_ordinal(rank: str):
+    '''
+    Get the ordinal of a stored rank string, so ranks compare by tier rather than alphabetically
+
+    :param rank: A rank as stored on a player or team, e.g. 'B' or 'SS_1800'
+
+    returns: The rank ordinal, see RANKS
+    '''
+    return RANK_ORDINALS[rank.split('_', 1)[0]]
+
+class RankThresholds:
     '''
-    for rank, values in ELO_TO_RANK.items():
-        if values['min'] <= ELO <= values['max']:
+    Class holding the placement, promotion and demotion ELO of every rank (elo_schema.txt items 13 and 14).
+    A placed pilot is promoted once their ELO reaches the promotion ELO of their rank and demoted once it
+    falls below the demotion ELO, so a pilot sitting on a rank boundary does not flip rank every match.
+    '''
+    placement: list[float] # minimum ELO to be placed into each rank after placement matches
+    promotion: list[float] # ELO at which each rank promotes to the next
+    demotion: list[float] # ELO below which each rank demotes to the previous
+
+    def __init__(self, placement: Optional[list[float]] = None, promotion: Optional[list[float]] = None,
+                 demotion: Optional[list[float]] = None):
+        '''
+        Defaults: placed and promoted at the rank minimum, demoted DEMOTION_MARGIN below it.
+        Raises ValueError if a promotion would land a pilot below the demotion ELO of the next rank.
+        '''
+        minimums = [values['min'] for values in ELO_TO_RANK.values()]
+        self.placement = list(placement) if placement else list(minimums)
+        self.promotion = list(promotion) if promotion else minimums[1:] + [math.inf]
+        self.demotion = list(demotion) if demotion else [-math.inf] + [ELO - DEMOTION_MARGIN for ELO in minimums[1:]]
+        self.promotion[-1], self.demotion[0] = math.inf, -math.inf # nothing above SS or below D
+        for ordinal in range(len(RANKS) - 1):
+            if self.promotion[ordinal] < self.demotion[ordinal + 1]:
+                raise ValueError(f'The {RANKS[ordinal]} promotion ELO must not be below the {RANKS[ordinal + 1]} demotion ELO')
+            if self.placement[ordinal] > self.placement[ordinal + 1]:
+                raise ValueError('Placement ELOs must increase with rank')
+
+    def place(self, ELO: float):
+        '''
+        The rank ordinal a pilot finishing placement matches with this ELO is placed into
+        '''
+        return bisect_right(self.placement, ELO, lo=1) - 1
+
+    def transition(self, ordinal: int, ELO: float):
+        '''
+        The rank ordinal of a placed pilot after a rating change
+        '''
+        while ordinal < len(RANKS) - 1 and ELO >= self.promotion[ordinal]:
+            ordinal += 1
+        while ordinal > 0 and ELO < self.demotion[ordinal]:
+            ordinal -= 1
+        return ordinal
+
+    def advance(self, rank: str, ELO: float, placement_played: int):
+        '''
+        Run the rank state machine for one ladder after a match
+
+        :param rank: The stored rank string
+        :param ELO: The ELO after the match
+        :param placement_played: Placement matches played before this match
+
+        returns: (placement matches played, new rank string)
+        '''
+        if placement_played < PLACEMENT_MATCHES:
+            placement_played += 1
+            if placement_played < PLACEMENT_MATCHES:
+                return placement_played, rank # unranked pilots keep the starting rank until placed
+            return placement_played, rank_name(self.place(ELO), ELO)
+        return placement_played, rank_name(self.transition(rank_ordinal(rank), ELO), ELO)
+
+    def rerank(self, rank: str, ELO: float, placement_played: int, reset: bool = False):
+        '''
+        Re-evaluate one pilot's rank on a ladder, for threshold changes and season resets
+
+        :param rank: The stored rank string
+        :param ELO: The pilot's ELO on that ladder
+        :param placement_played: Placement matches played on that ladder
+        :param reset: Place a placed pilot from scratch instead of from their current rank
+
+        returns: The new rank string, a pilot still in placement keeps theirs
+        '''
+        if placement_played < PLACEMENT_MATCHES:
             return rank
-        elif ELO >= ELO_TO_RANK['SS']['min']:
-            return f'SS_{ELO}'
+        return rank_name(self.place(ELO) if reset else self.transition(rank_ordinal(rank), ELO), ELO)
+
+    def to_settings(self):
+        return {RANKS[ordinal]: {'placement': self.placement[ordinal],
+                                 'promotion': self.promotion[ordinal] if ordinal < len(RANKS) - 1 else None,
+                                 'demotion': self.demotion[ordinal] if ordinal > 0 else None}
+                for ordinal in range(len(RANKS))}
+
+    @classmethod
+    def from_settings(cls, settings: Optional[dict]):
+        '''
+        Build thresholds from the dict stored in a guild's settings, see to_settings
+        '''
+        if not settings:
+            return cls()
+        defaults = cls()
+        columns = {}
+        for kind in ('placement', 'promotion', 'demotion'):
+            columns[kind] = [settings.get(rank, {}).get(kind) for rank in RANKS]
+            columns[kind] = [getattr(defaults, kind)[i] if value is None else value for i, value in enumerate(columns[kind])]
+        return cls(**columns)
+
+DEFAULT_RANK_THRESHOLDS = RankThresholds()
+
+def rerank_ladder(player_registry: 'players_db', teams_registry: 'teams_db', thresholds: RankThresholds = DEFAULT_RANK_THRESHOLDS, reset: bool = False):
+    '''
+    Re-rank every player (singles and teams ladders) and team, one pilot at a time
+
+    :param reset: Place every placed pilot from their ELO alone, e.g. after a season reset
+
+    returns: The number of ranks that changed
+    '''
+    ladders = [
+        (player_registry, player_registry.players, 'player_singles_rank', 'player_singles_ELO', 'singles_placement_played'),
+        (player_registry, player_registry.players, 'player_teams_rank', 'player_teams_ELO', 'teams_placement_played'),
+        (teams_registry, teams_registry.teams, 'team_rank', 'team_ELO', 'placement_played'),
+    ]
+    changed = 0
+    for registry, members, rank_attr, ELO_attr, placement_attr in ladders:
+        ladder_changed = 0
+        for member in members:
+            rank = getattr(member, rank_attr)
+            new_rank = thresholds.rerank(rank, getattr(member, ELO_attr), getattr(member, placement_attr), reset)
+            if new_rank != rank:
+                setattr(member, rank_attr, new_rank)
+                ladder_changed += 1
+        if ladder_changed:
+            registry.version += 1 # cached leaderboards and ladder rank views are stale
+        changed += ladder_changed
+    return changed
+
+def placement_label(rank: str, placement_played: int):
+    '''
+    The rank as shown in stats, or the placement progress of an unplaced pilot
+    '''
+    return rank if placement_played >= PLACEMENT_MATCHES else f'Placement ({placement_played}/{PLACEMENT_MATCHES})'
 
 def generate_keyword(length = 6):
     characters = string.ascii_letters + string.digits
@@ -61,7 +233,24 @@ def probability_of_victory(player_ELO: int, opponent_ELO: int):
     '''
     return 1.0 / (1 + math.pow(10, (player_ELO - opponent_ELO) / 400.0))
 
-def ELO_formula(player_ELO: int, opponent_ELO: int, result: int, ELO_k: int = 30, ELO_max: int = 2200, ELO_min: int = 100):
+def other_side(side: str):
+    return 'beta' if side == 'alpha' else 'alpha'
+
+def ELO_exchange(player_ELO: int, opponent_ELO: int, result: int, ELO_k: int = ELO_K, ELO_max: int = ELO_MAXIMUM, ELO_min: int = ELO_MINIMUM):
+    '''
+    ELO_formula, keeping the values it is computed from
+
+    returns: ((expected score, unclamped ELO, new ELO) of the player, the same for the opponent)
+    '''
+    prob_beta_victory = probability_of_victory(player_ELO, opponent_ELO)
+    prob_alpha_victory = probability_of_victory(opponent_ELO, player_ELO)
+    player_unclamped = player_ELO + ELO_k * (result - prob_alpha_victory)
+    opponent_unclamped = opponent_ELO + ELO_k * ((1 - result) - prob_beta_victory)
+    player_ELO = min(max(round(player_unclamped), ELO_min), ELO_max) # ensure ELO is within bounds
+    opponent_ELO = min(max(round(opponent_unclamped), ELO_min), ELO_max) # ensure ELO is within bounds
+    return (prob_alpha_victory, player_unclamped, player_ELO), (prob_beta_victory, opponent_unclamped, opponent_ELO)
+
+def ELO_formula(player_ELO: int, opponent_ELO: int, result: int, ELO_k: int = ELO_K, ELO_max: int = ELO_MAXIMUM, ELO_min: int = ELO_MINIMUM):
     '''
     Calculate the new ELO value for a player after a match
 
@@ -71,15 +260,69 @@ def ELO_formula(player_ELO: int, opponent_ELO: int, result: int, ELO_k: int = 30
 
     returns: The new ELO value of the players
     '''
-    prob_beta_victory = probability_of_victory(player_ELO, opponent_ELO)
-    prob_alpha_victory = probability_of_victory(opponent_ELO, player_ELO)
-    player_ELO = round(player_ELO + ELO_k * (result - prob_alpha_victory))
-    opponent_ELO = round(opponent_ELO + ELO_k * ((1 - result) - prob_beta_victory))
-    player_ELO = min(max(player_ELO, ELO_min), ELO_max) # ensure ELO is within bounds
-    opponent_ELO = min(max(opponent_ELO, ELO_min), ELO_max) # ensure ELO is within bounds
+    (_, _, player_ELO), (_, _, opponent_ELO) = ELO_exchange(player_ELO, opponent_ELO, result, ELO_k, ELO_max, ELO_min)
     return player_ELO, opponent_ELO
 
 
+class RatingChange(NamedTuple):
+    '''
+    How one player's or team's rating moved in one reported match
+    '''
+    name: str
+    won: bool
+    opponent: str # the rating this change was computed against
+    expected: float # the chance of winning ELO_formula assumed against the opponent
+    K: int
+    ELO_before: int
+    ELO_after: int
+    clamped: bool # the change was cut short by ELO_MINIMUM or ELO_MAXIMUM
+    rank_before: str
+    rank_after: str
+    placement: bool # the match counted toward placement
+
+    @property
+    def delta(self):
+        return self.ELO_after - self.ELO_before
+
+    def explain(self):
+        '''
+        One line answering "why did my rating move this much"
+        '''
+        line = (f"{self.name}: {self.ELO_before} -> {self.ELO_after} ({self.delta:+d}), "
+                f"{self.expected:.0%} chance to win against {self.opponent}, K {self.K}")
+        if self.clamped:
+            line += f", held at the {'maximum' if self.won else 'minimum'} ELO"
+        if self.rank_after != self.rank_before:
+            line += f", rank {self.rank_before} -> {self.rank_after}"
+        return line
+
+class MatchResult(NamedTuple):
+    '''
+    Everything one reported match changed, as report_match_results computed it
+    '''
+    match_id: int
+    match_type: str
+    win_probability: float # the winning side's chance before the match, as in match.predicted_odds
+    changes: list[RatingChange] # winners first
+
+    @property
+    def winners(self):
+        return [change for change in self.changes if change.won]
+
+    @property
+    def losers(self):
+        return [change for change in self.changes if not change.won]
+
+    def change(self, name: str):
+        for change in self.changes:
+            if change.name == name:
+                return change
+        return None
+
+    def explain(self):
+        return '\n'.join(change.explain() for change in self.changes)
+
+
 # core logic
 class Player:
     '''
@@ -98,6 +341,9 @@ class Player:
     teams_losses: int
     singles_wl_ratio: float = 0.0
     teams_wl_ratio: float = 0.0
+    singles_placement_played: int # placement matches played, see PLACEMENT_MATCHES
+    teams_placement_played: int
+    player_roles: tuple[str, ...] # preferred PLAYER_ROLES in 3v3 flex, empty to play any
 
     def __init__(self, player_name: str, player_team: Optional[str] = None, player_id: Optional[str] = None):
         '''
@@ -119,12 +365,26 @@ class Player:
         self.singles_losses = 0
         self.teams_wins = 0
         self.teams_losses = 0
+        self.singles_placement_played = 0
+        self.teams_placement_played = 0
+        self.player_roles = ()
 
-    def update_player_stats(self, result: int, match_type: str):
+    def set_roles(self, roles: list[str]):
+        '''
+        Set the roles the player prefers in 3v3 flex, see PLAYER_ROLES. No roles means any.
+        '''
+        roles = tuple(dict.fromkeys(role.strip().lower() for role in roles if role.strip()))
+        unknown = [role for role in roles if role not in PLAYER_ROLES]
+        if unknown:
+            raise ValueError(f"Unknown role(s) {', '.join(unknown)}, roles are {', '.join(PLAYER_ROLES)}")
+        self.player_roles = roles
+
+    def update_player_stats(self, result: int, match_type: str, thresholds: RankThresholds = DEFAULT_RANK_THRESHOLDS):
         '''
         Update the player's W/L stats and rank after a match
 
         :param result: The result of the match (1 for win, 0 for loss)
+        :param thresholds: The rank thresholds of the player's ladder
         '''
         if result == 1:
             if match_type == '1v1':
@@ -143,8 +403,12 @@ class Player:
                 teams_db.get_team(self.player_team).losses += 1
 
         self.update_WinLoss()  # Recalculate the W/L ratio
-        self.player_singles_rank = get_rank_from_ELO(self.player_singles_ELO)
-        self.player_teams_rank = get_rank_from_ELO(self.player_teams_ELO)
+        if match_type == '1v1':
+            self.singles_placement_played, self.player_singles_rank = thresholds.advance(
+                self.player_singles_rank, self.player_singles_ELO, self.singles_placement_played)
+        elif match_type == '3v3 flex':
+            self.teams_placement_played, self.player_teams_rank = thresholds.advance(
+                self.player_teams_rank, self.player_teams_ELO, self.teams_placement_played)
 
     def update_WinLoss(self):
         # Calculate the W/L ratio if losses are greater than 0
@@ -158,6 +422,7 @@ class Player:
         else:
             self.teams_wl_ratio = float('inf')
 
+    @timed('ravens_nest_render_seconds', 'Time to render a table', table='player')
     def __str__(self):
         stats_table = Table(title=f"Stats for {self.player_name}")
         stats_table.add_column("Field", justify="right", style="cyan", no_wrap=True)
@@ -166,10 +431,11 @@ class Player:
         stats_table.add_row("Player Name", self.player_name)
         stats_table.add_row("Player ID", str(self.player_id))
         stats_table.add_row("1v1s ELO", str(self.player_singles_ELO))
-        stats_table.add_row("1v1s Rank", self.player_singles_rank)
+        stats_table.add_row("1v1s Rank", placement_label(self.player_singles_rank, self.singles_placement_played))
         stats_table.add_row("Player Team", self.player_team if self.player_team else "N/A")
         stats_table.add_row("3v3s ELO", str(self.player_teams_ELO))
-        stats_table.add_row("3v3s Rank", self.player_teams_rank)
+        stats_table.add_row("3v3s Rank", placement_label(self.player_teams_rank, self.teams_placement_played))
+        stats_table.add_row("3v3s Roles", ', '.join(self.player_roles) if self.player_roles else "Any")
         stats_table.add_row("1v1s Wins", str(self.singles_wins))
         stats_table.add_row("1v1s Losses", str(self.singles_losses))
         stats_table.add_row("1v1s W/L Ratio", f"{self.singles_wins / self.singles_losses:.2f}" if self.singles_losses > 0 else "N/A")
@@ -194,13 +460,21 @@ class players_db:
     Class representing the database of players
     '''
     players: list[Player]
+    name_index: PrefixIndex # player names, for autocomplete
+    version: int # bumped on every add, remove and re-rank, see leaderboards
+    lock: asyncio.Lock # held by async writers, see add_player_async
 
     def __init__(self):
         self.players = []
+        self.name_index = PrefixIndex()
+        self.version = 0
+        self.lock = asyncio.Lock()
 
     def add_player(self, player_obj: Player):
         if player_obj not in self.players:
             self.players.append(player_obj)
+            self.name_index.add(player_obj.player_name)
+            self.version += 1
         else:
             print(f'Player {player_obj.player_name} is already in the database')
 
@@ -208,6 +482,8 @@ class players_db:
         for player in player_objs:
             if player.player_name not in [p.player_name for p in self.players]:
                 self.players.append(player)
+                self.name_index.add(player.player_name)
+                self.version += 1
             else:
                 print(f'Player {player.player_name} is already in the database')
 
@@ -215,12 +491,28 @@ class players_db:
         for player in self.players:
             if player.player_name == player_name:
                 self.players.remove(player)
+                self.name_index.remove(player_name)
+                self.version += 1
                 return
 
     def remove_players(self, player_names: list[str]):
         for player_name in player_names:
             self.remove_player(player_name)
 
+    async def add_player_async(self, player_obj: Player):
+        '''
+        Add a player under the registry lock. Returns False if the name is already taken.
+        '''
+        async with self.lock:
+            if self.get_player(player_obj.player_name):
+                return False
+            self.add_player(player_obj)
+            return True
+
+    async def remove_player_async(self, player_name: str):
+        async with self.lock:
+            self.remove_player(player_name)
+
     def get_player(self, player_name: str):
         if not self.players:
             return None
@@ -233,18 +525,18 @@ class players_db:
         return [player for player in self.players if player.player_name in player_names]
 
     def get_top_singles_players(self, num_players: int):
-        sorted_players = sorted(self.players, key=lambda player: player.player_singles_ELO, reverse=True)
-        return sorted_players[:num_players]
+        return heapq.nlargest(num_players, self.players, key=lambda player: player.player_singles_ELO)
 
     def get_top_teams_players(self, num_players: int):
-        sorted_players = sorted(self.players, key=lambda player: player.player_teams_ELO, reverse=True)
-        return sorted_players[:num_players]
+        return heapq.nlargest(num_players, self.players, key=lambda player: player.player_teams_ELO)
 
+    @timed('ravens_nest_persistence_seconds', 'Time to dump or load a database', db='players', op='dump')
     def dump_players_db(self, file_path: str):
         with open(file_path, 'w') as file:
             for player in self.players:
-                file.write(f"{player.player_name},{player.player_singles_ELO},{player.player_teams_ELO},{player.player_singles_rank},{player.player_teams_rank},{player.player_team},{player.singles_wins},{player.singles_losses},{player.teams_wins},{player.teams_losses},{player.singles_wl_ratio},{player.teams_wl_ratio}\n")
+                file.write(f"{player.player_name},{player.player_singles_ELO},{player.player_teams_ELO},{player.player_singles_rank},{player.player_teams_rank},{player.player_team},{player.singles_wins},{player.singles_losses},{player.teams_wins},{player.teams_losses},{player.singles_wl_ratio},{player.teams_wl_ratio},{player.singles_placement_played},{player.teams_placement_played},{player.player_id},{';'.join(player.player_roles)}\n")
 
+    @timed('ravens_nest_persistence_seconds', 'Time to dump or load a database', db='players', op='load')
     def load_players_db(self, file_path: str):
         with open(file_path, 'r') as file:
             lines = file.readlines()
@@ -262,8 +554,15 @@ class players_db:
                 new_player.teams_losses = int(data[9])
                 new_player.singles_wl_ratio = float(data[10])
                 new_player.teams_wl_ratio = float(data[11])
+                # files written before placements existed hold placed pilots only
+                new_player.singles_placement_played = int(data[12]) if len(data) > 12 else PLACEMENT_MATCHES
+                new_player.teams_placement_played = int(data[13]) if len(data) > 13 else PLACEMENT_MATCHES
+                # the Discord ID identifies who may report a player's matches, files written before it was kept have none
+                new_player.player_id = int(data[14]) if len(data) > 14 and data[14] != 'None' else None
+                new_player.player_roles = tuple(data[15].split(';')) if len(data) > 15 and data[15] else ()
                 self.add_player(new_player)
 
+    @timed('ravens_nest_render_seconds', 'Time to render a table', table='players_db')
     def __str__(self):
         sorted_players = sorted(self.players, key=lambda player: player.player_singles_ELO, reverse=True)
         players_table = Table(title="Players Database")
@@ -321,6 +620,7 @@ class team:
     wins: int
     losses: int
     wl_ratio: float = 0.0
+    placement_played: int # placement matches played, see PLACEMENT_MATCHES
 
     def __init__(self, team_name: str, roster: list[Player]):
         '''
@@ -337,6 +637,7 @@ class team:
         self.team_rank = 'C'
         self.wins = 0
         self.losses = 0
+        self.placement_played = 0
 
     def update_WinLoss(self):
         # Calculate the W/L ratio if losses are greater than 0
@@ -345,13 +646,13 @@ class team:
         else:
             self.wl_ratio = float('inf')
 
-    def update_team_stats(self, result: int):
+    def update_team_stats(self, result: int, thresholds: RankThresholds = DEFAULT_RANK_THRESHOLDS):
         if result == 1:
             self.wins += 1
         else:
             self.losses += 1
         self.update_WinLoss()
-        self.team_rank = get_rank_from_ELO(self.team_ELO)
+        self.placement_played, self.team_rank = thresholds.advance(self.team_rank, self.team_ELO, self.placement_played)
 
     def add_to_team(self, player: Player):
         if len(self.roster) < 3:
@@ -365,15 +666,16 @@ class team:
         else:
             ValueError(f'Player {player.player_name} is not on the team')
 
+    @timed('ravens_nest_render_seconds', 'Time to render a table', table='team')
     def __str__(self):
         team_table = Table(title=f"Stats for Team {self.team_name}")
         team_table.add_column("Field", justify="right", style="cyan", no_wrap=True)
         team_table.add_column("Value", style="magenta")
 
         team_table.add_row("Team Name", self.team_name)
-        team_table.add_row("Roster", ', '.join(player.player_name for player in self.roster))
+        team_table.add_row("Roster", ', '.join(roster_names(self)))
         team_table.add_row("Team ELO", str(self.team_ELO))
-        team_table.add_row("Team Rank", self.team_rank)
+        team_table.add_row("Team Rank", placement_label(self.team_rank, self.placement_played))
         team_table.add_row("Wins", str(self.wins))
         team_table.add_row("Losses", str(self.losses))
         team_table.add_row("W/L Ratio", f"{self.wins / self.losses:.2f}" if self.losses > 0 else "N/A")
@@ -388,24 +690,45 @@ class team:
     def __repr__(self):
         return self.__str__()
 
+def roster_names(team_obj: team, empty: Optional[str] = None):
+    '''
+    The names on a team's roster. A member missing when the teams database was loaded leaves an empty (None) slot.
+
+    :param empty: Written for empty slots so the names keep their positions, e.g. '' in the teams database; None skips them
+
+    returns: list of player names
+    '''
+    return [player.player_name if player is not None else empty for player in team_obj.roster
+            if player is not None or empty is not None]
+
 class teams_db:
     '''
     Class representing the database of teams
     '''
     teams: list[team]
     player_registry: players_db
+    name_index: PrefixIndex # team names, for autocomplete
+    version: int # bumped on every add, remove and re-rank, see leaderboards
+    lock: asyncio.Lock # held by async writers, see add_team_async
 
     def __init__(self, player_registry: players_db):
         self.teams = []
         self.player_registry = player_registry
+        self.name_index = PrefixIndex()
+        self.version = 0
+        self.lock = asyncio.Lock()
 
     def add_team(self, team_obj: team):
         self.teams.append(team_obj)
+        self.name_index.add(team_obj.team_name)
+        self.version += 1
 
     def remove_team(self, team_name: str):
         for team in self.teams:
             if team.team_name == team_name:
                 self.teams.remove(team)
+                self.name_index.remove(team_name)
+                self.version += 1
                 return
 
     def get_team(self, team_name: str):
@@ -414,16 +737,31 @@ class teams_db:
                 return team
         return None
 
+    async def add_team_async(self, team_obj: team):
+        '''
+        Add a team under the registry lock. Returns False if the name is already taken.
+        '''
+        async with self.lock:
+            if self.get_team(team_obj.team_name):
+                return False
+            self.add_team(team_obj)
+            return True
+
+    async def remove_team_async(self, team_name: str):
+        async with self.lock:
+            self.remove_team(team_name)
+
     def get_top_teams(self, num_teams: int):
-        sorted_teams = sorted(self.teams, key=lambda team: team.team_ELO, reverse=True)
-        return sorted_teams[:num_teams]
+        return heapq.nlargest(num_teams, self.teams, key=lambda team: team.team_ELO)
 
+    @timed('ravens_nest_persistence_seconds', 'Time to dump or load a database', db='teams', op='dump')
     def dump_teams_db(self, file_path: str):
         with open(file_path, 'w') as file:
             for team in self.teams:
-                players_str = ','.join(player.player_name for player in team.roster)
-                file.write(f"{team.team_name},{players_str},{team.team_ELO},{team.team_rank},{team.wins},{team.losses},{team.wl_ratio}\n")
+                players_str = ','.join(roster_names(team, empty=''))
+                file.write(f"{team.team_name},{players_str},{team.team_ELO},{team.team_rank},{team.wins},{team.losses},{team.wl_ratio},{team.placement_played}\n")
 
+    @timed('ravens_nest_persistence_seconds', 'Time to dump or load a database', db='teams', op='load')
     def load_teams_db(self, file_path: str):
         with open(file_path, 'r') as file:
             lines = file.readlines()
@@ -438,6 +776,7 @@ class teams_db:
                 wins = int(data[6])
                 losses = int(data[7])
                 wl_ratio = float(data[8])
+                placement_played = int(data[9]) if len(data) > 9 else PLACEMENT_MATCHES
 
                 players = [player1, player2, player3]
                 player_objs = [self.player_registry.get_player(player_name) for player_name in players]
@@ -447,8 +786,10 @@ class teams_db:
                 new_team.wins = wins
                 new_team.losses = losses
                 new_team.wl_ratio = wl_ratio
+                new_team.placement_played = placement_played
                 self.add_team(new_team)
 
+    @timed('ravens_nest_render_seconds', 'Time to render a table', table='teams_db')
     def __str__(self):
         sorted_teams = sorted(self.teams, key=lambda team: team.team_ELO, reverse=True)
         teams_table = Table(title="Teams Database")
@@ -495,8 +836,11 @@ class match:
     match_status: str # either completed, failed, or pending
     match_winner: str # name of the winning team [3v3] or player [1v1] or null [pending/failed]
     match_loser: str # name of the losing team [3v3] or player [1v1] or null [pending/failed]
-    match_map: str # map played on [read in from constant APPROVED_1S_MAPS or APPROVED_3S_MAPS]
+    match_map: str # map played on [from the guild's map pools, see map_rotation, or APPROVED_1S_MAPS/APPROVED_3S_MAPS]
     keyword: str # keyword to be used for lobby
+    result: Optional[MatchResult] # the applied result, kept so it can be reverted exactly, see revert_result
+    reports: dict[str, str] # side ('alpha', 'beta' or 'admin') -> the side it reported as the winner, see match_db.submit_report
+    report_keys: dict[str, str] # idempotency key -> reporting side, for the side's current report only
 
     def __init__(self, match_type: str, player_alpha: Optional[Player] = None, player_beta: Optional[Player] = None,
                  team_alpha: Optional[team|list[Player]] = None, team_beta: Optional[team|list[Player]] = None):
@@ -512,21 +856,86 @@ class match:
         self.match_winner = None
         self.match_loser = None
         self.keyword = None
+        self.result = None
+        self.reports = {}
+        self.report_keys = {}
+
+    def sides(self):
+        '''
+        The players, or teams for 3v3 reg, on each side
+
+        returns: (alpha members, beta members), empty for matches loaded from disk
+        '''
+        if self.match_type == '1v1':
+            return [member for member in (self.player_alpha,) if member], [member for member in (self.player_beta,) if member]
+        if self.match_type == '3v3 reg':
+            return [member for member in (self.team_alpha,) if member], [member for member in (self.team_beta,) if member]
+        return list(self.team_alpha or []), list(self.team_beta or [])
 
-    def setup_match_parameters(self):
+    def side(self, side: str):
+        '''
+        The winner or loser argument of report_match_results for 'alpha' or 'beta'
+        '''
+        if self.match_type == '1v1':
+            return self.player_alpha if side == 'alpha' else self.player_beta
+        return self.team_alpha if side == 'alpha' else self.team_beta
+
+    def map_history_keys(self):
+        '''
+        The players, and teams for 3v3 reg, whose recent maps are weighed when choosing this match's map
+
+        returns: list of ('player', name) and ('team', name) keys, see map_rotation.MapRotation
+        '''
         if self.match_type == '1v1':
+            return [('player', self.player_alpha.player_name), ('player', self.player_beta.player_name)]
+        if self.match_type == '3v3 reg':
+            return [('team', self.team_alpha.team_name), ('team', self.team_beta.team_name)] + \
+                   [('player', player_name) for player_name in roster_names(self.team_alpha) + roster_names(self.team_beta)]
+        return [('player', player.player_name) for player in list(self.team_alpha) + list(self.team_beta)]
+
+    def setup_match_parameters(self, map_rotation: Optional['MapRotation'] = None):
+        '''
+        Pick the map and lobby keyword and mark the match pending
+
+        :param map_rotation: Chooses the map against the participants' recent maps, a uniform draw from the approved maps if None
+        '''
+        if self.match_type not in ('1v1', '3v3 flex', '3v3 reg'):
+            raise ValueError('Invalid match type, please use either 1v1, 3v3 flex, or 3v3 reg')
+        if map_rotation is not None:
+            self.match_map = map_rotation.choose(self.match_type, self.map_history_keys())
+        elif self.match_type == '1v1':
             self.match_map = random.choice(APPROVED_1S_MAPS)
-        elif self.match_type == '3v3 flex':
+        else: # 3v3 flex and 3v3 reg
             self.match_map = random.choice(APPROVED_3S_MAPS)
-        elif self.match_type == '3v3 reg': # match_type == '3v3s reg'
-            self.match_map = random.choice(APPROVED_3S_MAPS)
-        else:
-            raise ValueError('Invalid match type, please use either 1v1, 3v3 flex, or 3v3 reg')
         self.match_status = 'pending'
         self.keyword = generate_keyword()
         print(f'Match setup complete. Use Map: {self.match_map}, Use Keyword: {self.keyword}')
 
-    def report_match_results(self, winner: team|Player|list[Player], loser: team|Player|list[Player]):
+    def predicted_odds(self):
+        '''
+        The predicted chance of side alpha winning and the quality of the match, from the ratings as they stand
+
+        returns: (alpha win probability, quality between 0 and 1), see matchmaking.match_quality
+        '''
+        if self.match_type == '1v1':
+            probability = win_probability(self.player_alpha.player_singles_ELO, self.player_beta.player_singles_ELO)
+            return probability, match_quality(probability)
+        if self.match_type == '3v3 reg':
+            probability = win_probability(self.team_alpha.team_ELO, self.team_beta.team_ELO)
+            return probability, match_quality(probability)
+        alpha = [player.player_teams_ELO for player in self.team_alpha]
+        beta = [player.player_teams_ELO for player in self.team_beta]
+        probability = win_probability(sum(alpha) / len(alpha), sum(beta) / len(beta))
+        return probability, match_quality(probability, max(alpha) - min(alpha) + max(beta) - min(beta))
+
+    @timed('ravens_nest_report_match_seconds', 'Time to apply a match result')
+    def report_match_results(self, winner: team|Player|list[Player], loser: team|Player|list[Player],
+                             thresholds: RankThresholds = DEFAULT_RANK_THRESHOLDS):
+        '''
+        Apply a result: complete the match, move the ratings and update every participant's record and rank
+
+        returns: MatchResult, the rating change of every participant and what it was computed from
+        '''
         self.match_status = 'completed'
 
         if self.match_type == '3v3 flex':
@@ -538,22 +947,65 @@ class match:
 
         if self.match_type == '1v1':
             print(f'Match results reported. WIN: {winner.player_name}, LOSS: {loser.player_name}')
-            [winner.player_singles_ELO, loser.player_singles_ELO] = ELO_formula(winner.player_singles_ELO, loser.player_singles_ELO, 1)
-            winner.update_player_stats(1, '1v1')
-            loser.update_player_stats(0, '1v1')
+            pairs = [(winner, loser)]
+            probability = win_probability(winner.player_singles_ELO, loser.player_singles_ELO)
         elif self.match_type == '3v3 flex':
             print(f'Match results reported. WIN: {winner[0].player_name, winner[1].player_name, winner[2].player_name}, LOSS: {loser[0].player_name, loser[1].player_name, loser[2].player_name}')
-            for winner_player, loser_player in zip(winner, loser):
-                winner_player.player_teams_ELO, loser_player.player_teams_ELO = ELO_formula(winner_player.player_teams_ELO, loser_player.player_teams_ELO, 1)
-                winner_player.update_player_stats(1, '3v3 flex')
-                loser_player.update_player_stats(0, '3v3 flex')
+            pairs = list(zip(winner, loser))
+            probability = win_probability(sum(player.player_teams_ELO for player in winner) / len(winner),
+                                          sum(player.player_teams_ELO for player in loser) / len(loser))
         else: # match_type == '3v3 reg'
             print(f'Match results reported. WIN: {winner.team_name}, LOSS: {loser.team_name}')
-            [winner.team_ELO, loser.team_ELO] = ELO_formula(winner.team_ELO, loser.team_ELO, 1)
-            print(f'Match results reported. WIN: {winner.team_name}, LOSS: {loser.team_name}')
-            winner.update_team_stats(1)
-            loser.update_team_stats(0)
+            pairs = [(winner, loser)]
+            probability = win_probability(winner.team_ELO, loser.team_ELO)
+
+        name, ELO, rank, _, _, placement = RESULT_FIELDS[self.match_type]
+        winners, losers = [], []
+        for winner_member, loser_member in pairs:
+            winner_exchange, loser_exchange = ELO_exchange(getattr(winner_member, ELO), getattr(loser_member, ELO), 1)
+            for member, opponent, (expected, unclamped, new_ELO), won, changes in (
+                    (winner_member, loser_member, winner_exchange, 1, winners),
+                    (loser_member, winner_member, loser_exchange, 0, losers)):
+                ELO_before, rank_before, placement_match = getattr(member, ELO), getattr(member, rank), getattr(member, placement) < PLACEMENT_MATCHES
+                setattr(member, ELO, new_ELO)
+                if self.match_type == '3v3 reg':
+                    member.update_team_stats(won, thresholds)
+                else:
+                    member.update_player_stats(won, self.match_type, thresholds)
+                changes.append(RatingChange(getattr(member, name), bool(won), getattr(opponent, name), expected, ELO_K,
+                                            ELO_before, new_ELO, round(unclamped) != new_ELO, rank_before, getattr(member, rank),
+                                            placement_match))
+        self.result = MatchResult(self.match_id, self.match_type, probability, winners + losers)
+        return self.result
+
+    def revert_result(self):
+        '''
+        Undo report_match_results with the exact inverse of each rating change, whatever was played since:
+        every rating moves back by its delta, the result leaves every record and placement count,
+        and ranks the result changed are restored unless a later match moved them again
 
+        returns: The reverted MatchResult, raises ValueError if the match has no result this session
+        '''
+        if self.result is None:
+            raise ValueError(f'Match {self.match_id} has no result that can be reverted')
+        name, ELO, rank, wins, losses, placement = RESULT_FIELDS[self.match_type]
+        alpha, beta = self.sides()
+        members = {getattr(member, name): member for member in alpha + beta}
+        for change in self.result.changes:
+            member = members[change.name]
+            setattr(member, ELO, min(max(getattr(member, ELO) - change.delta, ELO_MINIMUM), ELO_MAXIMUM))
+            record = wins if change.won else losses
+            setattr(member, record, getattr(member, record) - 1)
+            if change.placement:
+                setattr(member, placement, getattr(member, placement) - 1)
+            if getattr(member, rank) == change.rank_after:
+                setattr(member, rank, change.rank_before)
+            member.update_WinLoss()
+        reverted, self.result = self.result, None
+        self.match_status, self.match_winner, self.match_loser = 'pending', None, None
+        return reverted
+
+    @timed('ravens_nest_render_seconds', 'Time to render a table', table='match')
     def __str__(self):
         match_table = Table(title=f"Match {self.match_id} Details")
         match_table.add_column("Field", justify="right", style="cyan", no_wrap=True)
@@ -585,23 +1037,50 @@ class match_db:
     Class representing the database of matches
     '''
     matches: list[match]
+    pending_index: PrefixIndex # IDs of matches awaiting a result, for autocomplete
+    rank_thresholds: RankThresholds # applied to every result reported through this database
+    analytics: Optional['MatchAnalytics'] # fed every result reported through this database, see analytics
+    results_reported: int # bumped on every result applied or reverted, see leaderboards
+    lock: asyncio.Lock # held by async writers, see report_match_async
 
     def __init__(self):
         self.matches = []
+        self.pending_index = PrefixIndex()
+        self.rank_thresholds = DEFAULT_RANK_THRESHOLDS
+        self.analytics = None
+        self.results_reported = 0
+        self.lock = asyncio.Lock()
 
     def add_match(self, match_obj: match):
         self.matches.append(match_obj)
+        if match_obj.match_status == 'pending':
+            self.pending_index.add(match_obj.match_id)
+
+    def _apply_result(self, match: match, winner: team|Player|list[Player], loser: team|Player|list[Player]):
+        result = match.report_match_results(winner, loser, self.rank_thresholds)
+        self.pending_index.remove(match.match_id)
+        self.results_reported += 1
+        if self.analytics is not None:
+            self.analytics.record(match, result)
+        return result
+
+    def _revert_result(self, match: match):
+        result = match.revert_result()
+        self.results_reported += 1
+        if self.analytics is not None:
+            self.analytics.retract(match, result)
+        return result
 
     def update_match(self, match_id: int, winner: team|Player, loser: team|Player):
         for match in self.matches:
             if match.match_id == match_id:
-                match.report_match_results(winner, loser)
-                return
+                return self._apply_result(match, winner, loser)
 
     def remove_match(self, match_id: int):
         for match in self.matches:
             if match.match_id == match_id:
                 self.matches.remove(match)
+                self.pending_index.remove(match_id)
                 return
 
     def get_match(self, match_id: int):
@@ -610,6 +1089,148 @@ class match_db:
                 return match
         return None
 
+    async def add_match_async(self, match_obj: match):
+        async with self.lock:
+            self.add_match(match_obj)
+
+    async def remove_match_async(self, match_id: int):
+        async with self.lock:
+            self.remove_match(match_id)
+
+    async def report_match_async(self, match_id: int, winner: team|Player|list[Player], loser: team|Player|list[Player]):
+        '''
+        Report a match result under the database lock, so a result is applied exactly once
+
+        :param match_id: The ID of the match to report
+        :param winner: The winning player, team or flex roster
+        :param loser: The losing player, team or flex roster
+
+        returns: MatchResult, raises ValueError if the match is unknown or already completed
+        '''
+        async with self.lock:
+            match = self.get_match(match_id)
+            if match is None:
+                raise ValueError(f'Match {match_id} is not in the database')
+            if match.match_status == 'completed':
+                raise ValueError(f'Match {match_id} has already been completed')
+            return self._apply_result(match, winner, loser)
+
+    async def submit_report(self, match_id: int, reporter_side: Optional[str], winner_side: str, key: str):
+        '''
+        Record one side's report of who won. The result is applied once both sides agree,
+        or at once for an admin override. Sides that disagree put the match in dispute,
+        reverting a result that was already applied, until they agree or an admin decides.
+
+        :param match_id: The ID of the match being reported
+        :param reporter_side: 'alpha' or 'beta', the side the reporter played on, None for an admin override
+        :param winner_side: 'alpha' or 'beta', the side reported as the winner
+        :param key: Idempotency key of the submission, e.g. match, reporter and claim; a resubmission changes nothing
+
+        returns: (status, MatchResult or None). status is 'duplicate', 'awaiting' (the other side has not reported yet),
+                 'confirmed' (with the result if it was applied by this report) or 'disputed' (with the result
+                 that was reverted, if any). Raises ValueError for an unknown match, a match without players on record,
+                 or a player report on a match an admin decided.
+        '''
+        async with self.lock:
+            match = self.get_match(match_id)
+            if match is None:
+                raise ValueError(f'Match {match_id} is not in the database')
+            if match.side(winner_side) is None:
+                raise ValueError(f'Match {match_id} has no players on record, it can only be cancelled')
+            if reporter_side is None:
+                if match.reports.get('admin') == winner_side and match.match_status == 'completed':
+                    return 'duplicate', None
+                if match.match_status == 'completed':
+                    self._revert_result(match)
+                match.reports = {'admin': winner_side}
+                match.report_keys = {}
+                return 'confirmed', self._apply_result(match, match.side(winner_side), match.side(other_side(winner_side)))
+            if 'admin' in match.reports:
+                raise ValueError(f'Match {match_id} was decided by an admin')
+            if match.report_keys.get(key) == reporter_side and match.reports.get(reporter_side) == winner_side:
+                return 'duplicate', None
+
+            if match.reports.get(reporter_side) != winner_side: # a changed report supersedes the side's earlier keys
+                match.report_keys = {seen: side for seen, side in match.report_keys.items() if side != reporter_side}
+            match.reports[reporter_side] = winner_side
+            match.report_keys[key] = reporter_side
+            other_report = match.reports.get(other_side(reporter_side))
+            if other_report is None:
+                return 'awaiting', None
+            if other_report == winner_side:
+                if match.match_status == 'completed':
+                    return 'confirmed', None
+                return 'confirmed', self._apply_result(match, match.side(winner_side), match.side(other_side(winner_side)))
+            reverted = self._revert_result(match) if match.match_status == 'completed' else None
+            match.match_status = 'disputed'
+            self.pending_index.add(match.match_id)
+            return 'disputed', reverted
+
+    async def cancel_match_async(self, match_id: int):
+        '''
+        Remove a match, first reverting its result if one was applied
+
+        returns: The reverted MatchResult, None if no result was applied or its rating changes could not be
+                 restored from match_reports.json; raises ValueError if the match is unknown
+        '''
+        async with self.lock:
+            match = self.get_match(match_id)
+            if match is None:
+                raise ValueError(f'Match {match_id} is not in the database')
+            reverted = self._revert_result(match) if match.result is not None else None
+            self.remove_match(match_id)
+            return reverted
+
+    def dump_match_reports(self, file_path: str):
+        '''
+        Save what matches.db cannot hold for every match with reports or an applied result: the names on each side,
+        each side's report and the applied rating changes, so disputes and exact reverts survive an eviction or a restart
+        '''
+        records = {}
+        for match in self.matches:
+            if match.reports or match.result is not None:
+                name = RESULT_FIELDS[match.match_type][0]
+                records[match.match_id] = {
+                    'status': match.match_status,
+                    'sides': [[getattr(member, name) for member in side] for side in match.sides()],
+                    'reports': match.reports,
+                    'report_keys': match.report_keys,
+                    'result': match.result, # a MatchResult of RatingChanges dumps as nested lists
+                }
+        with open(file_path, 'w') as file:
+            json.dump(records, file)
+
+    def load_match_reports(self, file_path: str, player_registry: 'players_db', teams_registry: 'teams_db'):
+        '''
+        Restore what dump_match_reports saved onto the matches loaded from matches.db.
+        A match whose players or teams are no longer registered keeps only what matches.db holds.
+        '''
+        with open(file_path, 'r') as file:
+            records = json.load(file)
+        for match in self.matches:
+            record = records.get(str(match.match_id))
+            if record is None:
+                continue
+            lookup = teams_registry.get_team if match.match_type == '3v3 reg' else player_registry.get_player
+            alpha, beta = ([lookup(name) for name in names] for names in record['sides'])
+            if not alpha or not beta or any(member is None for member in alpha + beta):
+                print(f'Match {match.match_id} reports not restored: its players or teams are no longer registered')
+                continue
+            if match.match_type == '1v1':
+                match.player_alpha, match.player_beta = alpha[0], beta[0]
+            elif match.match_type == '3v3 reg':
+                match.team_alpha, match.team_beta = alpha[0], beta[0]
+            else:
+                match.team_alpha, match.team_beta = alpha, beta
+            match.reports, match.report_keys = record['reports'], record['report_keys']
+            if record['result'] is not None:
+                match_id, match_type, probability, changes = record['result']
+                match.result = MatchResult(match_id, match_type, probability, [RatingChange(*change) for change in changes])
+            match.match_status = record['status']
+            if match.match_status in ('pending', 'disputed'):
+                self.pending_index.add(match.match_id)
+
+    @timed('ravens_nest_persistence_seconds', 'Time to dump or load a database', db='matches', op='dump')
     def dump_matches_db(self, file_path: str):
         with open(file_path, 'w') as file:
             for match in self.matches:
@@ -621,6 +1242,7 @@ class match_db:
                     loser = match.match_loser if match.match_loser else "N/A"
                 file.write(f"{match.match_id},{match.match_type},{match.match_map},{winner},{loser}\n")
 
+    @timed('ravens_nest_persistence_seconds', 'Time to dump or load a database', db='matches', op='load')
     def load_matches_db(self, file_path: str):
         with open(file_path, 'r') as file:
             lines = file.readlines()
@@ -628,18 +1250,25 @@ class match_db:
                 data = line.strip().split(',')
                 match_id = int(data[0])
                 match_type = data[1]
-                match_map = data[2]
-                match_winner = str([data[3],data[4],data[5]])
-                match_loser = str([data[6],data[7],data[8]])
+                # map names may contain commas, so the result columns are read from the end
+                num_result_fields = 6 if match_type == '3v3 flex' and data[-1] != 'N/A' else 2
+                match_map = ','.join(data[2:-num_result_fields])
+                if num_result_fields == 6:
+                    match_winner = [name.strip() for name in data[-6:-3]]
+                    match_loser = [name.strip() for name in data[-3:]]
+                else: # 1v1 and 3v3 reg store a single name per side
+                    match_winner = data[-2] if data[-2] != 'N/A' else None
+                    match_loser = data[-1] if data[-1] != 'N/A' else None
 
                 new_match = match(match_type)
                 new_match.match_id = match_id
                 new_match.match_map = match_map
                 new_match.match_winner = match_winner
                 new_match.match_loser = match_loser
-                new_match.match_status = 'completed'
+                new_match.match_status = 'completed' if match_winner else 'not_started'
                 self.add_match(new_match)
 
+    @timed('ravens_nest_render_seconds', 'Time to render a table', table='match_db')
     def __str__(self):
         matches_table = Table(title="Matches Database")
         matches_table.add_column("Match ID", justify="left", style="cyan", no_wrap=True)
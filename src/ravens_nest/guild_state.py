@@ -0,0 +1,351 @@
+'''
+Per-guild state container for the Ravens Nest.
+Designed by Ahasuerus for Armored Scrims Server
+
+Every Discord server (guild) gets its own ladder: its own registries,
+queues and database files. States are created lazily the first time a
+guild interacts with the bot and are dumped to disk and dropped from
+memory once the guild has been idle for a while, so memory scales with
+the number of active guilds rather than the number of guilds the bot is in.
+'''
+import os
+import copy
+import json
+import time
+from typing import Optional
+from ravens_nest.elo_core import *
+from ravens_nest.player_queue import *
+from ravens_nest.seasons import *
+from ravens_nest.map_rotation import *
+from ravens_nest.analytics import MatchAnalytics
+from ravens_nest.leaderboards import LEADERBOARD_INTERVAL
+
+# constants
+DATA_ROOT = os.getenv('RAVENS_NEST_DATA', 'guilds') # directory holding one sub-directory per guild
+GUILD_IDLE_TIMEOUT = 3600 # seconds without interaction before a guild is evicted to disk
+DIRECT_MESSAGE_GUILD = 0 # interactions outside a guild (DMs) share this ladder
+DEFAULT_SETTINGS = {
+    'queue_policy': os.getenv('RAVENS_NEST_QUEUE_POLICY', 'exclusive'), # see QueueMembershipIndex
+    'rank_thresholds': None, # overrides of the default RankThresholds, see RankThresholds.to_settings
+    'season': 1, # the current season, earlier seasons are archived in the seasons directory
+    'map_pools': {}, # season -> {'1v1' or '3v3': [maps]}, see season_map_pools
+    'leaderboard_channel': None, # channel ID of the pinned standings, None to not publish them
+    'leaderboard_message': None, # message ID of the pinned standings, sent on first publish
+    'leaderboard_interval': LEADERBOARD_INTERVAL, # minimum seconds between edits of the pinned standings
+}
+
+
+class GuildState:
+    '''
+    Class holding the registries, queues and persistence paths of one guild
+    '''
+    guild_id: int
+    data_path: str
+    players_path: str
+    teams_path: str
+    matches_path: str
+    reports_path: str
+    settings_path: str
+    analytics_path: str
+    queue_stats_path: str
+    seasons_path: str
+    settings: dict # per-guild configuration changed at runtime by admin commands
+    player_registry: players_db
+    teams_registry: teams_db
+    matches_db: match_db
+    map_rotation: MapRotation
+    queue_membership: QueueMembershipIndex
+    ones_queue: MatchQueue
+    threes_flex_queue: MatchQueue
+    threes_reg_queue: MatchQueue
+    last_active: float
+
+    def __init__(self, guild_id: int, data_root: str = DATA_ROOT):
+        '''
+        Called when a guild interacts with the bot for the first time since startup or eviction
+
+        :param guild_id: The Discord ID of the guild
+        :param data_root: The directory holding all guild sub-directories
+
+        returns: None
+        '''
+        self.guild_id = guild_id
+        self.data_path = os.path.join(data_root, str(guild_id))
+        self.players_path = os.path.join(self.data_path, 'players.db')
+        self.teams_path = os.path.join(self.data_path, 'teams.db')
+        self.matches_path = os.path.join(self.data_path, 'matches.db')
+        self.reports_path = os.path.join(self.data_path, 'match_reports.json')
+        self.settings_path = os.path.join(self.data_path, 'settings.json')
+        self.analytics_path = os.path.join(self.data_path, 'analytics.json')
+        self.queue_stats_path = os.path.join(self.data_path, 'queue_stats.json')
+        self.seasons_path = os.path.join(self.data_path, 'seasons')
+        self.settings = copy.deepcopy(DEFAULT_SETTINGS)
+
+        self.player_registry = players_db()
+        self.teams_registry = teams_db(self.player_registry)
+        self.matches_db = match_db()
+        self.matches_db.analytics = MatchAnalytics()
+        self.map_rotation = MapRotation()
+        self.queue_membership = QueueMembershipIndex(self.settings['queue_policy'])
+        self.ones_queue = MatchQueue('1v1', self.player_registry, self.teams_registry, self.queue_membership)
+        self.threes_flex_queue = MatchQueue('3v3 flex', self.player_registry, self.teams_registry, self.queue_membership)
+        self.threes_reg_queue = MatchQueue('3v3 reg', self.player_registry, self.teams_registry, self.queue_membership)
+        self.last_active = time.monotonic()
+
+    def load(self):
+        '''
+        Load the guild's databases and settings from disk, if they exist
+        '''
+        if os.path.exists(self.settings_path):
+            with open(self.settings_path, 'r') as file:
+                self.settings.update(json.load(file))
+            self.queue_membership.set_policy(self.settings['queue_policy'])
+            self.matches_db.rank_thresholds = RankThresholds.from_settings(self.settings['rank_thresholds'])
+            self.map_rotation.pools = season_map_pools(self.settings['map_pools'], self.settings['season'])
+        if os.path.exists(self.players_path):
+            self.player_registry.load_players_db(self.players_path)
+        if os.path.exists(self.teams_path):
+            self.teams_registry.load_teams_db(self.teams_path)
+        if os.path.exists(self.matches_path):
+            self.matches_db.load_matches_db(self.matches_path)
+        if os.path.exists(self.reports_path):
+            self.matches_db.load_match_reports(self.reports_path, self.player_registry, self.teams_registry)
+        if os.path.exists(self.analytics_path):
+            self.matches_db.analytics = MatchAnalytics.load(self.analytics_path)
+        if os.path.exists(self.queue_stats_path):
+            with open(self.queue_stats_path, 'r') as file:
+                for queue_type, stats in json.load(file).items():
+                    self.get_queue(queue_type).stats = QueueStats.from_dict(stats)
+        print(f'Guild {self.guild_id} state loaded from {self.data_path}')
+
+    def dump(self):
+        '''
+        Dump the guild's databases and settings to disk
+        '''
+        os.makedirs(self.data_path, exist_ok=True)
+        with open(self.settings_path, 'w') as file:
+            json.dump(self.settings, file, indent=2)
+        self.player_registry.dump_players_db(self.players_path)
+        self.teams_registry.dump_teams_db(self.teams_path)
+        self.matches_db.dump_matches_db(self.matches_path)
+        self.matches_db.dump_match_reports(self.reports_path)
+        self.matches_db.analytics.dump(self.analytics_path)
+        with open(self.queue_stats_path, 'w') as file:
+            json.dump({queue.queue_type: queue.stats.to_dict() for queue in (self.ones_queue, self.threes_flex_queue, self.threes_reg_queue)}, file)
+
+    def touch(self):
+        '''
+        Mark the guild as active
+        '''
+        self.last_active = time.monotonic()
+
+    def set_queue_policy(self, policy: str):
+        '''
+        Change whether players may be in several queues at once
+
+        :param policy: 'exclusive' or 'multi', see QueueMembershipIndex
+        '''
+        self.queue_membership.set_policy(policy)
+        self.settings['queue_policy'] = policy
+
+    def set_rank_threshold(self, rank: str, kind: str, ELO: float):
+        '''
+        Change one placement, promotion or demotion ELO and re-rank the whole ladder against the new thresholds
+
+        :param rank: The rank to change, one of RANKS
+        :param kind: 'placement', 'promotion' or 'demotion'
+        :param ELO: The new threshold
+
+        returns: The number of ranks that changed, raises ValueError for an invalid or inconsistent threshold
+        '''
+        if rank not in RANK_ORDINALS:
+            raise ValueError(f"Rank must be one of {', '.join(RANKS)}")
+        if kind not in ('placement', 'promotion', 'demotion'):
+            raise ValueError("Threshold must be 'placement', 'promotion' or 'demotion'")
+        settings = self.matches_db.rank_thresholds.to_settings()
+        settings[rank][kind] = ELO
+        thresholds = RankThresholds.from_settings(settings)
+        self.matches_db.rank_thresholds = thresholds
+        self.settings['rank_thresholds'] = thresholds.to_settings()
+        return rerank_ladder(self.player_registry, self.teams_registry, thresholds)
+
+    def season_archive_path(self, season: int):
+        return os.path.join(self.seasons_path, f'season_{season}.sqlite')
+
+    def archived_seasons(self):
+        '''
+        The numbers of every season archived for this guild, oldest first
+        '''
+        return [season for season in range(1, self.settings['season']) if os.path.exists(self.season_archive_path(season))]
+
+    def season_registries(self, season: Optional[int] = None):
+        '''
+        Where to read players and teams for a season: the live registries for the current season,
+        or a lazily queried SeasonArchive for a past one
+
+        :param season: The season number, None for the current season
+
+        returns: (players source, teams source), raises ValueError for a season that was never archived
+        '''
+        if season is None or season == self.settings['season']:
+            return self.player_registry, self.teams_registry
+        file_path = self.season_archive_path(season)
+        if not os.path.exists(file_path):
+            raise ValueError(f'Season {season} is not archived, the current season is {self.settings["season"]}')
+        archive = SeasonArchive(season, file_path)
+        return archive, archive
+
+    def reset_season(self, compression: float = SEASON_RESET_COMPRESSION):
+        '''
+        Archive the current season and start the next one with soft-reset ratings.
+        The new season is dumped straight away so the archive and the live databases never disagree on disk.
+
+        :param compression: Fraction of each rating's distance from the ladder mean removed, see soft_reset
+
+        returns: The number of the season that was archived
+        '''
+        if not 0 <= compression <= 1:
+            raise ValueError('Compression must be between 0 and 1')
+        season = self.settings['season']
+        os.makedirs(self.seasons_path, exist_ok=True)
+        write_season_archive(self.season_archive_path(season), season, self.player_registry, self.teams_registry, self.matches_db)
+        reset_ladder(self.player_registry, self.teams_registry, self.matches_db, compression, self.matches_db.rank_thresholds)
+        self.settings['season'] = season + 1
+        self.map_rotation.pools = season_map_pools(self.settings['map_pools'], season + 1)
+        self.dump()
+        return season
+
+    def set_map_pool(self, kind: str, maps: list[str], season: Optional[int] = None):
+        '''
+        Change the maps a season draws from. A change to the current season applies from the next match.
+
+        :param kind: '1v1' or '3v3'
+        :param maps: The maps in the pool
+        :param season: The season to change, None for the current one; later seasons without a pool inherit it
+
+        returns: None, raises ValueError for an invalid pool or a season that has already ended
+        '''
+        season = self.settings['season'] if season is None else season
+        if season < self.settings['season']:
+            raise ValueError(f'Season {season} has already ended')
+        validated = MapRotation()
+        validated.set_pool(kind, maps)
+        self.settings['map_pools'].setdefault(str(season), {})[kind] = validated.pools[kind]
+        self.map_rotation.pools = season_map_pools(self.settings['map_pools'], self.settings['season'])
+
+    def set_leaderboard_channel(self, channel_id: Optional[int], interval: Optional[float] = None):
+        '''
+        Change where the standings are published, see LeaderboardPublisher
+
+        :param channel_id: The channel to keep the pinned standings in, None to stop publishing
+        :param interval: Minimum seconds between edits, None to keep the current one
+
+        returns: None, raises ValueError for an interval under a minute
+        '''
+        if interval is not None and interval < 60:
+            raise ValueError('The leaderboard interval must be at least 60 seconds')
+        if channel_id != self.settings['leaderboard_channel']:
+            self.settings['leaderboard_message'] = None # a new channel gets a new message
+        self.settings['leaderboard_channel'] = channel_id
+        if interval is not None:
+            self.settings['leaderboard_interval'] = interval
+
+    def get_queue(self, match_type: str):
+        '''
+        Get the queue serving a given match type
+
+        :param match_type: One of '1v1', '3v3 flex' or '3v3 reg'
+
+        returns: The MatchQueue for that match type
+        '''
+        if match_type == '1v1':
+            return self.ones_queue
+        elif match_type == '3v3 flex':
+            return self.threes_flex_queue
+        elif match_type == '3v3 reg':
+            return self.threes_reg_queue
+        raise ValueError("match_type must be '1v1', '3v3 flex', or '3v3 reg'")
+
+    def is_idle(self, idle_timeout: float = GUILD_IDLE_TIMEOUT, now: Optional[float] = None):
+        '''
+        Whether the guild can be evicted without losing live state.
+        Queued players and pending matches only live in memory, so a guild
+        with either is never considered idle.
+
+        :param idle_timeout: Seconds without interaction before the guild counts as idle
+        :param now: The current monotonic time, mostly for testing
+
+        returns: True if the guild can be evicted
+        '''
+        now = time.monotonic() if now is None else now
+        if now - self.last_active < idle_timeout:
+            return False
+        if len(self.ones_queue) or len(self.threes_flex_queue) or len(self.threes_reg_queue):
+            return False
+        return not len(self.matches_db.pending_index)
+
+
+class GuildStateManager:
+    '''
+    Class creating, caching and evicting GuildState objects
+    '''
+    states: dict[int, GuildState]
+    data_root: str
+    idle_timeout: float
+
+    def __init__(self, data_root: str = DATA_ROOT, idle_timeout: float = GUILD_IDLE_TIMEOUT):
+        self.states = {}
+        self.data_root = data_root
+        self.idle_timeout = idle_timeout
+
+    def get(self, guild_id: Optional[int]):
+        '''
+        Get the state of a guild, loading it from disk on first use
+
+        :param guild_id: The Discord ID of the guild, or None for direct messages
+
+        returns: The GuildState of the guild
+        '''
+        if guild_id is None:
+            guild_id = DIRECT_MESSAGE_GUILD
+        state = self.states.get(guild_id)
+        if state is None:
+            state = GuildState(guild_id, self.data_root)
+            state.load()
+            self.states[guild_id] = state
+        state.touch()
+        return state
+
+    def evict(self, guild_id: int):
+        '''
+        Dump a guild to disk and drop it from memory
+        '''
+        state = self.states.pop(guild_id, None)
+        if state is not None:
+            state.dump()
+            print(f'Guild {guild_id} evicted to {state.data_path}')
+
+    def evict_idle(self):
+        '''
+        Evict every guild that has been idle for longer than the idle timeout
+
+        returns: The list of evicted guild IDs
+        '''
+        now = time.monotonic()
+        idle = [guild_id for guild_id, state in self.states.items() if state.is_idle(self.idle_timeout, now)]
+        for guild_id in idle:
+            self.evict(guild_id)
+        return idle
+
+    def dump_all(self):
+        '''
+        Dump every loaded guild to disk
+        '''
+        for state in self.states.values():
+            state.dump()
+
+    def __contains__(self, guild_id: int):
+        return guild_id in self.states
+
+    def __len__(self):
+        return len(self.states)
@@ -0,0 +1,336 @@
+'''
+Leaderboard rendering and publishing for the Ravens Nest.
+Designed by Ahasuerus for Armored Scrims Server
+
+The three leaderboards are rendered here, both for the slash commands and
+for the LeaderboardPublisher. A guild can choose a standings channel; the
+publisher keeps one pinned message there and edits it in place when the
+standings change, at most once per the guild's interval. Whether standings
+changed is read from version counters the registries and the match
+database bump on every write, so an unchanged guild costs a tuple compare
+per tick and nothing is sorted or rendered. The rendered boards are cached
+per guild, so the slash commands answer from the same snapshot until the
+next change. The three boards together can outgrow the 2000 characters of
+a message's content, so the pinned message carries one embed per board.
+
+/leaderboard pages through a whole ladder instead, filtered by rank and
+team. Pages are addressed by cursors, the (ELO, name) of the entry a page
+ends or starts at, over a LadderIndex: the ladder sorted once per standings
+change and split into one sorted list per filter. A page is a bisect and a
+slice, O(page size + log n), and a cursor stays valid when the standings
+move between clicks. Archived seasons answer the same pages with keyset
+queries, see SeasonArchive.ladder_page.
+'''
+import math
+import time
+import asyncio
+from bisect import bisect_left, bisect_right
+from typing import Awaitable, Callable, NamedTuple, Optional
+from rich.table import Table
+from rich.console import Console
+from ravens_nest.elo_core import *
+from ravens_nest.metrics import METRICS, MetricsRegistry
+
+# constants
+LEADERBOARD_INTERVAL = 300 # default seconds between edits of a guild's pinned standings
+PUBLISH_TICK = 15 # seconds between checks for changed standings
+LEADERBOARDS = { # command name -> (title, rows, column header, top entries, row name, row ELO)
+    'solo_leaderboard': ('1v1 Leaderboard', 10, 'Player Name',
+                         lambda players, teams, n: players.get_top_singles_players(n),
+                         lambda player: player.player_name, lambda player: player.player_singles_ELO),
+    'reg_teams_leaderboard': ('3v3 Leaderboard', 5, 'Team Name',
+                              lambda players, teams, n: teams.get_top_teams(n),
+                              lambda team: f'{team.team_name} {roster_names(team)}',
+                              lambda team: team.team_ELO),
+    'flex_teams_leaderboard': ('3v3 Flex Leaderboard', 10, 'Player Name',
+                               lambda players, teams, n: players.get_top_teams_players(n),
+                               lambda player: player.player_name, lambda player: player.player_teams_ELO),
+}
+MEDALS = {1: '🥇', 2: '🥈', 3: '🥉'}
+PAGE_SIZE = 10
+LADDERS = { # match type -> (registry attribute, ELO attribute, rank attribute, name attribute, team attribute)
+    '1v1': ('players', 'player_singles_ELO', 'player_singles_rank', 'player_name', 'player_team'),
+    '3v3 flex': ('players', 'player_teams_ELO', 'player_teams_rank', 'player_name', 'player_team'),
+    '3v3 reg': ('teams', 'team_ELO', 'team_rank', 'team_name', None),
+}
+
+
+class LadderPage(NamedTuple):
+    '''
+    One page of a ladder, with the cursors to the pages around it
+    '''
+    entries: list[tuple[int, object]] # (position within the filtered ladder, Player or team)
+    total: int # entries matching the filters
+    has_previous: bool
+    has_next: bool
+
+    @property
+    def first(self):
+        return self.entries[0][1] if self.entries else None
+
+    @property
+    def last(self):
+        return self.entries[-1][1] if self.entries else None
+
+def check_ladder_filters(ladder: str, rank: Optional[str] = None, team_name: Optional[str] = None):
+    '''
+    returns: None, raises ValueError for an unknown ladder or rank, or a team filter on the 3v3 reg ladder
+    '''
+    if ladder not in LADDERS:
+        raise ValueError(f"Invalid ladder {ladder}, use '1v1', '3v3 flex' or '3v3 reg'")
+    if rank is not None and rank not in RANKS:
+        raise ValueError(f"Invalid rank {rank}, use one of {', '.join(RANKS)}")
+    if team_name is not None and LADDERS[ladder][4] is None:
+        raise ValueError('The 3v3 reg ladder ranks teams, it cannot be filtered by team')
+
+def ladder_cursor(ladder: str, entry):
+    '''
+    returns: The (ELO, name) a page can start after or end before
+    '''
+    _, ELO, _, name, _ = LADDERS[ladder]
+    return (getattr(entry, ELO), getattr(entry, name))
+
+
+class LadderIndex:
+    '''
+    Class holding one ladder sorted by ELO, highest first and ties by name,
+    with one sorted view per rank, per team and per rank and team
+    '''
+    ladder: str
+    views: dict[tuple, tuple[list[tuple[int, str]], list]] # (rank, team) -> (sorted (-ELO, name) keys, entries)
+    keys: dict[str, tuple[int, str]] # name -> key, for jumping to an entry
+
+    def __init__(self, ladder: str, player_registry, teams_registry):
+        self.ladder = ladder
+        registry, ELO, rank, name, team_attribute = LADDERS[ladder]
+        entries = getattr(player_registry if registry == 'players' else teams_registry, registry)
+        keyed = sorted(((-getattr(entry, ELO), getattr(entry, name)), entry) for entry in entries)
+        self.views = {}
+        self.keys = {}
+        for key, entry in keyed:
+            self.keys[key[1]] = key
+            entry_rank = RANKS[rank_ordinal(getattr(entry, rank))] # SS ranks are stored with their ELO, e.g. 'SS_1800'
+            entry_team = getattr(entry, team_attribute) if team_attribute else None
+            for view in {(None, None), (entry_rank, None), (None, entry_team), (entry_rank, entry_team)}:
+                keys, view_entries = self.views.setdefault(view, ([], []))
+                keys.append(key)
+                view_entries.append(entry)
+
+    def page(self, size: int = PAGE_SIZE, after: Optional[tuple] = None, before: Optional[tuple] = None,
+             rank: Optional[str] = None, team_name: Optional[str] = None, at: Optional[str] = None):
+        '''
+        One page of the ladder
+
+        :param after: Cursor the page starts after, see ladder_cursor
+        :param before: Cursor the page ends before
+        :param rank: Only entries of this rank
+        :param team_name: Only players of this team
+        :param at: Name of the entry the page starts at, for searches
+
+        returns: LadderPage, empty if at is not on the filtered ladder
+        '''
+        keys, entries = self.views.get((rank, team_name), ([], []))
+        if at is not None:
+            key = self.keys.get(at)
+            start = bisect_left(keys, key) if key is not None else len(keys)
+            if start == len(keys) or keys[start] != key:
+                return LadderPage([], len(keys), False, False)
+        elif after is not None:
+            start = bisect_right(keys, (-after[0], after[1]))
+        elif before is not None:
+            stop = bisect_left(keys, (-before[0], before[1]))
+            return self._slice(keys, entries, max(stop - size, 0), stop)
+        else:
+            start = 0
+        return self._slice(keys, entries, start, min(start + size, len(keys)))
+
+    @staticmethod
+    def _slice(keys: list, entries: list, start: int, stop: int):
+        return LadderPage([(i + 1, entries[i]) for i in range(start, stop)], len(keys), start > 0, stop < len(keys))
+
+
+def render_ladder_page(ladder: str, page: LadderPage, title_suffix: str = ''):
+    '''
+    Render one page of a ladder as a code block
+    '''
+    _, ELO, rank, name, _ = LADDERS[ladder]
+    console = Console(force_terminal=False)
+    positions = f" ({page.entries[0][0]}-{page.entries[-1][0]} of {page.total})" if page.entries else ''
+    table = Table(title=f"{ladder} Ladder{title_suffix}{positions}")
+
+    table.add_column("Position", justify="center")
+    table.add_column("Team Name" if ladder == '3v3 reg' else "Player Name", justify="center")
+    table.add_column("Rank", justify="center")
+    table.add_column("ELO", justify="center")
+
+    for position, entry in page.entries:
+        table.add_row(MEDALS.get(position, f"{position}"), getattr(entry, name), getattr(entry, rank), str(getattr(entry, ELO)))
+
+    with console.capture() as capture:
+        console.print(table)
+    return f"```{capture.get()}```"
+
+
+def render_leaderboard(leaderboard: str, player_registry, teams_registry, title_suffix: str = ''):
+    '''
+    Render one leaderboard as a code block
+
+    :param leaderboard: A key of LEADERBOARDS
+    :param player_registry: The live players_db, or a SeasonArchive
+    :param teams_registry: The live teams_db, or a SeasonArchive
+    :param title_suffix: Appended to the table title, e.g. ' (Season 2)'
+
+    returns: The message text
+    '''
+    title, rows, header, top, name, ELO = LEADERBOARDS[leaderboard]
+    console = Console(force_terminal=False)
+    table = Table(title=f"{title}{title_suffix}")
+
+    table.add_column("Position", justify="center")
+    table.add_column(header, justify="center")
+    table.add_column("ELO", justify="center")
+
+    for position, entry in enumerate(top(player_registry, teams_registry, rows), start=1):
+        table.add_row(MEDALS.get(position, f"{position}"), name(entry), str(ELO(entry)))
+
+    with console.capture() as capture:
+        console.print(table)
+    return f"```{capture.get()}```"
+
+def standings_version(state):
+    '''
+    A key that changes whenever anything the current season's leaderboards show may have changed
+    '''
+    return (state.player_registry.version, state.teams_registry.version,
+            state.matches_db.results_reported, state.settings['season'])
+
+
+class LeaderboardPublisher:
+    '''
+    Class caching rendered leaderboards per guild and keeping each guild's pinned standings message current
+    '''
+    cache: dict[int, tuple[tuple, dict[str, object]]] # guild ID -> (standings version, leaderboard -> text or ladder -> LadderIndex)
+    last_published: dict[int, float] # guild ID -> time.monotonic() of the last edit
+    published_version: dict[int, tuple] # guild ID -> standings version of the last edit
+
+    def __init__(self, embed: Callable[[str], object] = str, tick: float = PUBLISH_TICK,
+                 registry: Optional[MetricsRegistry] = None):
+        '''
+        :param embed: Wraps one rendered leaderboard for the pinned message, e.g. in a discord.Embed
+        :param tick: Seconds between checks for due guilds
+        '''
+        registry = registry or METRICS
+        self.embed = embed
+        self.tick = tick
+        self.cache = {}
+        self.last_published = {}
+        self.published_version = {}
+        self.renders = registry.counter('ravens_nest_leaderboard_renders_total', 'Leaderboards rendered')
+        self.edits = registry.counter('ravens_nest_leaderboard_edits_total', 'Pinned standings messages sent or edited')
+
+    def _cached(self, state, key: str, build: Callable[[], object]):
+        version = standings_version(state)
+        cached = self.cache.get(state.guild_id)
+        if cached is None or cached[0] != version:
+            cached = self.cache[state.guild_id] = (version, {})
+        value = cached[1].get(key)
+        if value is None:
+            value = cached[1][key] = build()
+        return value
+
+    def leaderboard(self, state, leaderboard: str):
+        '''
+        The current season's leaderboard for a guild, rendered at most once per standings change
+        '''
+        def build():
+            self.renders.inc()
+            return render_leaderboard(leaderboard, state.player_registry, state.teams_registry)
+        return self._cached(state, leaderboard, build)
+
+    def ladder_index(self, state, ladder: str):
+        '''
+        The current season's LadderIndex for a guild, sorted at most once per standings change
+        '''
+        return self._cached(state, ladder, lambda: LadderIndex(ladder, state.player_registry, state.teams_registry))
+
+    def standings(self, state):
+        '''
+        The pinned message: one embed per leaderboard
+        '''
+        return [self.embed(self.leaderboard(state, leaderboard)) for leaderboard in LEADERBOARDS]
+
+    def due(self, state, now: Optional[float] = None):
+        '''
+        Whether a guild's pinned standings need an edit: a channel is set, the standings changed
+        since the last edit, and the guild's interval has passed
+        '''
+        if state.settings.get('leaderboard_channel') is None:
+            return False
+        now = time.monotonic() if now is None else now
+        if now - self.last_published.get(state.guild_id, -math.inf) < state.settings['leaderboard_interval']:
+            return False
+        return self.published_version.get(state.guild_id) != standings_version(state)
+
+    async def publish(self, state, channel):
+        '''
+        Edit the guild's pinned standings message, or send and pin a new one if there is none yet
+
+        :param channel: The standings channel, anything with send() and get_partial_message()
+        '''
+        version = standings_version(state)
+        embeds = self.standings(state)
+        message_id = state.settings.get('leaderboard_message')
+        message = None
+        if message_id is not None:
+            try:
+                message = await channel.get_partial_message(message_id).edit(embeds=embeds)
+            except Exception as error:
+                if getattr(error, 'status', None) != 404: # a deleted message is replaced below, anything else retried next tick
+                    raise
+                message = None
+        if message is None:
+            message = await channel.send(embeds=embeds)
+            state.settings['leaderboard_message'] = message.id
+            try:
+                await message.pin()
+            except Exception as error:
+                print(f'Standings message in guild {state.guild_id} could not be pinned: {error}')
+        self.edits.inc()
+        self.last_published[state.guild_id] = time.monotonic()
+        self.published_version[state.guild_id] = version
+
+    async def publish_due(self, guild_states, resolve_channel: Callable[[int], Awaitable]):
+        '''
+        Publish every loaded guild whose standings are due
+
+        :param guild_states: The GuildStateManager
+        :param resolve_channel: Async callable returning the channel for an ID
+
+        returns: The number of guilds published
+        '''
+        published = 0
+        now = time.monotonic()
+        for state in list(guild_states.states.values()):
+            if not self.due(state, now):
+                continue
+            try:
+                channel = await resolve_channel(state.settings['leaderboard_channel'])
+                await self.publish(state, channel)
+                published += 1
+            except Exception as error:
+                print(f'Standings for guild {state.guild_id} could not be published: {error}')
+        return published
+
+    async def run(self, guild_states, resolve_channel: Callable[[int], Awaitable]):
+        '''
+        Publish due standings every tick, forever
+        '''
+        while True:
+            await asyncio.sleep(self.tick)
+            await self.publish_due(guild_states, resolve_channel)
+
+    def forget(self, guild_id: int):
+        '''
+        Drop the cache of a guild, e.g. when it is evicted
+        '''
+        self.cache.pop(guild_id, None)
@@ -0,0 +1,273 @@
+'''
+Offline load generator for the Ravens Nest frontend.
+Designed by Ahasuerus for Armored Scrims Server
+
+Drives the real slash command handlers in discord_frontend with fake
+interactions, so no bot token or gateway connection is needed. A ladder is
+onboarded through /onboard_player, then simulated users fire a mix of
+/solo_queue, /party_queue, /report_match_results and leaderboard commands
+concurrently. Reports throughput plus p50/p99 latency per command, both
+to the first response (the acknowledgement Discord waits 3 seconds for)
+and to the end of the handler.
+
+usage: python -m ravens_nest.loadtest [--guilds 2] [--players 500] [--commands 5000] [--concurrency 200]
+'''
+import io
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import contextlib
+from datetime import datetime, timezone
+from typing import Optional
+import discord
+import ravens_nest.discord_frontend as frontend
+from ravens_nest.guild_state import GuildStateManager
+from ravens_nest.match_workers import MatchmakingPool
+from ravens_nest.notifications import NotificationQueue
+from ravens_nest.benchmarks import percentile
+
+# constants
+COMMAND_MIX = {
+    'solo_queue': 0.3,
+    'party_queue': 0.15,
+    'report_match_results': 0.25,
+    'solo_leaderboard': 0.1,
+    'flex_teams_leaderboard': 0.1,
+    'reg_teams_leaderboard': 0.05,
+    'leaderboard': 0.05,
+    'queue_status': 0.05,
+}
+USER_ID_BASE = 10 ** 12 # fake Discord user IDs start here, one block per guild
+
+
+# fake Discord interaction layer
+class FakeUser:
+    def __init__(self, user_id: int, name: str):
+        self.id = user_id
+        self.name = name
+        self.display_name = name
+
+class FakeGuild:
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+        self.name = f'Load test guild {guild_id}'
+
+class FakeChannel:
+    '''
+    A channel or DM channel that keeps what was sent to it
+    '''
+    def __init__(self, channel_id: int):
+        self.id = channel_id
+        self.messages = []
+
+    async def send(self, content: Optional[str] = None, **kwargs):
+        self.messages.append(content)
+
+class FakeResponse:
+    '''
+    Stands in for discord.InteractionResponse, enforcing the single-response rule
+    '''
+    def __init__(self, interaction: 'FakeInteraction', latency: float = 0.0):
+        self._interaction = interaction
+        self._latency = latency
+        self._done = False
+
+    def is_done(self):
+        return self._done
+
+    async def _acknowledge(self, content: Optional[str]):
+        if self._done:
+            raise discord.InteractionResponded(self._interaction)
+        self._done = True
+        await asyncio.sleep(self._latency) # the HTTP round trip to Discord, always a yield to the loop
+        self._interaction.acknowledged_at = time.perf_counter()
+        self._interaction.messages.append(content)
+
+    async def send_message(self, content: Optional[str] = None, **kwargs):
+        await self._acknowledge(content)
+
+    async def defer(self, **kwargs):
+        await self._acknowledge(None)
+
+class FakeFollowup:
+    def __init__(self, interaction: 'FakeInteraction'):
+        self._interaction = interaction
+
+    async def send(self, content: Optional[str] = None, **kwargs):
+        if not self._interaction.response.is_done():
+            raise discord.NotFound(FakeHTTPResponse(404), 'Unknown Webhook') # followups need an acknowledgement first
+        self._interaction.messages.append(content)
+
+class FakeHTTPResponse:
+    def __init__(self, status: int):
+        self.status = status
+        self.reason = 'Fake'
+
+class FakeInteraction:
+    '''
+    Stands in for discord.Interaction with the attributes the handlers use
+    '''
+    def __init__(self, guild: FakeGuild, user: FakeUser, channel: FakeChannel, latency: float = 0.0):
+        self.guild = guild
+        self.guild_id = guild.id
+        self.user = user
+        self.channel = channel
+        self.created_at = datetime.now(timezone.utc)
+        self.created = time.perf_counter()
+        self.acknowledged_at = None
+        self.messages = []
+        self.response = FakeResponse(self, latency)
+        self.followup = FakeFollowup(self)
+
+
+# load generation
+class LoadTest:
+    '''
+    Class holding the fake guilds and the latency samples of one run
+    '''
+    def __init__(self, num_guilds: int, num_players: int, seed: int = 0, latency: float = 0.0):
+        self.rng = random.Random(seed)
+        self.latency = latency
+        self.guilds = [FakeGuild(guild_id) for guild_id in range(1, num_guilds + 1)]
+        self.channels = {guild.id: FakeChannel(guild.id) for guild in self.guilds}
+        self.users = {guild.id: [FakeUser(USER_ID_BASE * guild.id + i, f'pilot_{i}') for i in range(num_players)] for guild in self.guilds}
+        self.dm_channels = {}
+        self.handler_seconds = {} # command -> list of seconds from creation to handler return
+        self.ack_seconds = {} # command -> list of seconds from creation to first response
+        self.unacknowledged = 0
+        self.errors = {}
+
+    def interaction(self, guild: FakeGuild, user: Optional[FakeUser] = None):
+        user = user or self.rng.choice(self.users[guild.id])
+        return FakeInteraction(guild, user, self.channels[guild.id], self.latency)
+
+    async def resolve_user(self, user_id: int):
+        return self.dm_channels.setdefault(user_id, FakeChannel(user_id))
+
+    async def call(self, name: str, interaction: FakeInteraction, **kwargs):
+        '''
+        Run one command through its real handler and record its latencies
+        '''
+        command = getattr(frontend, name)
+        try:
+            await command.callback(interaction, **kwargs)
+        except Exception as error:
+            self.errors[f'{name}: {type(error).__name__}'] = self.errors.get(f'{name}: {type(error).__name__}', 0) + 1
+        finished = time.perf_counter()
+        self.handler_seconds.setdefault(name, []).append(finished - interaction.created)
+        if interaction.acknowledged_at is None:
+            self.unacknowledged += 1
+        else:
+            self.ack_seconds.setdefault(name, []).append(interaction.acknowledged_at - interaction.created)
+
+    async def onboard(self):
+        for guild in self.guilds:
+            for user in self.users[guild.id]:
+                await getattr(frontend, 'onboard_player').callback(self.interaction(guild, user), player_name=user.name)
+
+    def pick_command(self, guild: FakeGuild):
+        '''
+        Choose a command and its arguments following COMMAND_MIX
+
+        returns: (command name, arguments, the user sending it or None for any user)
+        '''
+        name = self.rng.choices(list(COMMAND_MIX), list(COMMAND_MIX.values()))[0]
+        names = [user.name for user in self.users[guild.id]]
+        if name == 'report_match_results':
+            pending = [m for m in frontend.guild_states.get(guild.id).matches_db.matches if m.match_status == 'pending']
+            if pending:
+                reported = self.rng.choice(pending)
+                alpha, beta = frontend.match_sides(reported)
+                if self.rng.random() < 0.5:
+                    alpha, beta = beta, alpha
+                kwargs = {'match_id': reported.match_id, 'win': alpha[0].player_name, 'lose': beta[0].player_name}
+                if reported.match_type == '3v3 flex':
+                    kwargs.update(win_2=alpha[1].player_name, win_3=alpha[2].player_name,
+                                  lose_2=beta[1].player_name, lose_3=beta[2].player_name)
+                reporter = self.rng.choice(alpha + beta) # a result is recorded once both sides report it
+                return name, kwargs, FakeUser(reporter.player_id, reporter.player_name)
+            name = 'solo_queue' # nothing to report yet
+        if name == 'solo_queue':
+            return name, {'player_name': self.rng.choice(names), 'match_type': self.rng.choice(['1v1', '3v3 flex'])}, None
+        if name == 'queue_status':
+            return name, {'player_name': self.rng.choice(names)}, None
+        if name == 'party_queue':
+            party = self.rng.sample(names, self.rng.choice([2, 3]))
+            return name, {f'player_{i + 1}': player for i, player in enumerate(party)}, None
+        return name, {}, None
+
+    async def run(self, num_commands: int, concurrency: int):
+        '''
+        Fire num_commands commands from concurrency simulated users at once
+
+        returns: wall clock seconds
+        '''
+        remaining = iter(range(num_commands))
+
+        async def simulated_user():
+            for _ in remaining:
+                guild = self.rng.choice(self.guilds)
+                name, kwargs, user = self.pick_command(guild)
+                await self.call(name, self.interaction(guild, user), **kwargs)
+
+        start = time.perf_counter()
+        await asyncio.gather(*[simulated_user() for _ in range(concurrency)])
+        return time.perf_counter() - start
+
+    def report(self, wall_seconds: float):
+        total = sum(len(samples) for samples in self.handler_seconds.values())
+        print(f'{total} commands in {wall_seconds:.2f}s, {total / wall_seconds:.0f} commands/s')
+        print(f"{'command':<25} {'n':>6} {'ack p50':>10} {'ack p99':>10} {'end p50':>10} {'end p99':>10} {'end max':>10}")
+        for name in sorted(self.handler_seconds):
+            ends = self.handler_seconds[name]
+            acks = self.ack_seconds.get(name) or [float('nan')]
+            print(f'{name:<25} {len(ends):>6} {percentile(acks, 50) * 1000:>8.2f}ms {percentile(acks, 99) * 1000:>8.2f}ms '
+                  f'{percentile(ends, 50) * 1000:>8.2f}ms {percentile(ends, 99) * 1000:>8.2f}ms {max(ends) * 1000:>8.2f}ms')
+        pops = sum(len(channel.messages) for channel in self.channels.values())
+        print(f'{self.unacknowledged} interaction(s) never acknowledged, {pops} announcement message(s) delivered, '
+              f'{frontend.notifier.pending()} notification(s) still queued')
+        for error, count in sorted(self.errors.items()):
+            print(f'ERROR {error} x{count}')
+
+
+async def run_load_test(num_guilds: int, num_players: int, num_commands: int, concurrency: int,
+                        inline: bool = True, latency: float = 0.0, seed: int = 0):
+    '''
+    Onboard a ladder per guild and run the command mix against it, in a throwaway data directory
+
+    returns: (LoadTest, wall clock seconds of the command phase)
+    '''
+    frontend.guild_states = GuildStateManager(tempfile.mkdtemp())
+    load_test = LoadTest(num_guilds, num_players, seed, latency)
+    frontend.resolve_user = load_test.resolve_user
+    frontend.notifier = NotificationQueue()
+    pool = frontend.matchmaking_pool = MatchmakingPool(inline=inline)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()): # every handler and match logs with print
+            await load_test.onboard()
+            wall_seconds = await load_test.run(num_commands, concurrency)
+    finally:
+        pool.shutdown()
+    return load_test, wall_seconds
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(description='Load test the Ravens Nest command handlers offline.')
+    parser.add_argument('--guilds', type=int, default=1, help='number of simulated guilds')
+    parser.add_argument('--players', type=int, default=500, help='players onboarded per guild')
+    parser.add_argument('--commands', type=int, default=5000, help='total commands to send')
+    parser.add_argument('--concurrency', type=int, default=200, help='simulated users sending at once')
+    parser.add_argument('--processes', action='store_true', help='search in worker processes instead of in-process')
+    parser.add_argument('--api-latency', type=float, default=0.0, help='seconds each fake response takes, to mimic Discord')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    load_test, wall_seconds = asyncio.run(run_load_test(args.guilds, args.players, args.commands, args.concurrency,
+                                                        inline=not args.processes, latency=args.api_latency, seed=args.seed))
+    load_test.report(wall_seconds)
+    return 1 if load_test.errors or load_test.unacknowledged else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
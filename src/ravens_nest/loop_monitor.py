@@ -0,0 +1,92 @@
+'''
+Event loop lag monitor for the Ravens Nest.
+Designed by Ahasuerus for Armored Scrims Server
+
+A heartbeat task sleeps for a fixed interval and records how late it wakes
+up, which is how long other callbacks held the loop. A watchdog thread
+watches the heartbeat, and when it stops beating for longer than the
+threshold it dumps the stack of the loop thread, showing exactly which
+handler or elo_core/MatchQueue path is blocking. Stalls are counted and
+their stacks kept for the log.
+'''
+import os
+import sys
+import time
+import asyncio
+import threading
+import traceback
+from collections import deque
+from typing import Optional
+from ravens_nest.metrics import METRICS, MetricsRegistry
+
+# constants
+LOOP_LAG_THRESHOLD = float(os.getenv('RAVENS_NEST_LOOP_LAG_THRESHOLD', '0.5')) # seconds the loop may be held before a stack dump
+HEARTBEAT_INTERVAL = 0.1 # seconds between heartbeats
+MAX_KEPT_STALLS = 20
+
+
+class LoopLagMonitor:
+    '''
+    Class measuring event loop lag and dumping the loop's stack when it stalls
+    '''
+    threshold: float
+    interval: float
+    stalls: deque # (time.time() of the dump, formatted loop stack), newest last
+    loop_thread_id: Optional[int]
+    last_beat: float
+
+    def __init__(self, threshold: float = LOOP_LAG_THRESHOLD, interval: float = HEARTBEAT_INTERVAL,
+                 registry: Optional[MetricsRegistry] = None):
+        '''
+        :param threshold: Seconds the loop may be held before the watchdog dumps its stack
+        :param interval: Seconds between heartbeats
+        '''
+        registry = registry or METRICS
+        self.threshold = threshold
+        self.interval = interval
+        self.stalls = deque(maxlen=MAX_KEPT_STALLS)
+        self.loop_thread_id = None
+        self.last_beat = time.monotonic()
+        self.lag_seconds = registry.histogram('ravens_nest_loop_lag_seconds', 'How late the event loop heartbeat woke up')
+        self.stall_count = registry.counter('ravens_nest_loop_stalls_total', 'Times the event loop was held past the lag threshold')
+        self._beats = 0
+        self._stop = threading.Event()
+        self._heartbeat_task = None
+        self._watchdog = threading.Thread(target=self._watch, name='ravens-nest-watchdog', daemon=True)
+
+    async def _heartbeat(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lag_seconds.observe(max(0.0, loop.time() - start - self.interval))
+            self.last_beat = time.monotonic()
+            self._beats += 1
+
+    def _watch(self):
+        dumped_beat = -1 # one dump per stall, keyed by the last heartbeat seen
+        while not self._stop.wait(self.threshold / 4):
+            held = time.monotonic() - self.last_beat - self.interval
+            if held > self.threshold and self._beats != dumped_beat:
+                dumped_beat = self._beats
+                frame = sys._current_frames().get(self.loop_thread_id)
+                stack = ''.join(traceback.format_stack(frame)) if frame is not None else '<loop thread not found>\n'
+                del frame
+                self.stall_count.inc()
+                self.stalls.append((time.time(), stack))
+                print(f'Event loop held for over {self.threshold:g}s, loop thread stack:\n{stack}', end='')
+
+    def start(self):
+        '''
+        Start the heartbeat on the running loop and the watchdog thread.
+        Must be called from the event loop thread.
+        '''
+        self.loop_thread_id = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self._heartbeat_task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._watchdog.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
@@ -0,0 +1,119 @@
+'''
+Map rotation for the Ravens Nest.
+Designed by Ahasuerus for Armored Scrims Server
+
+Every player and team remembers the last few maps they played in a bounded
+ring buffer. When a match pops, each map in the pool is weighted down once
+for every time it appears in the buffers of the pilots and teams involved,
+and the map is drawn from those weights, so the same pilots rarely get the
+same map twice in a row while every map stays possible. Picking a map reads
+one short buffer per participant and does one pass over the pool; match
+history is never scanned.
+
+Map pools are kept per season in the guild settings. A season without its
+own pool inherits the pool of the latest earlier season that has one, and
+admins can swap a pool while the bot is running.
+'''
+import random
+from collections import Counter, deque
+from typing import Iterable, Optional
+from ravens_nest.elo_core import APPROVED_1S_MAPS, APPROVED_3S_MAPS
+
+# constants
+MAP_HISTORY = 5 # maps remembered per player and per team
+REPEAT_PENALTY = 0.35 # weight multiplier for each recent play of a map by a participant
+MAP_POOL_TYPES = ('1v1', '3v3') # flex and reg matches share the 3v3 pool
+DEFAULT_MAP_POOLS = {'1v1': list(APPROVED_1S_MAPS), '3v3': list(APPROVED_3S_MAPS)}
+
+
+def pool_type(match_type: str):
+    '''
+    The map pool a match type draws from
+    '''
+    if match_type == '1v1':
+        return '1v1'
+    elif match_type in ('3v3 flex', '3v3 reg'):
+        return '3v3'
+    raise ValueError('Invalid match type, please use either 1v1, 3v3 flex, or 3v3 reg')
+
+def season_map_pools(season_pools: dict, season: int):
+    '''
+    The pools in force during a season, from the per-season pools stored in a guild's settings
+
+    :param season_pools: {season (as a string, it round-trips through JSON): {pool type: [maps]}}
+    :param season: The season to resolve
+
+    returns: {pool type: [maps]}, seasons without a pool inherit the latest earlier one, then the defaults
+    '''
+    pools = {kind: list(maps) for kind, maps in DEFAULT_MAP_POOLS.items()}
+    for configured in sorted(int(key) for key in season_pools if int(key) <= season):
+        pools.update({kind: list(maps) for kind, maps in season_pools[str(configured)].items()})
+    return pools
+
+
+class MapRotation:
+    '''
+    Class choosing maps for matches, weighted against the recent maps of the participants
+    '''
+    pools: dict[str, list[str]] # pool type -> maps
+    recent: dict[tuple[str, str], deque] # ('player' or 'team', name) -> last MAP_HISTORY maps
+    history: int
+
+    def __init__(self, pools: Optional[dict] = None, history: int = MAP_HISTORY, rng: Optional[random.Random] = None):
+        self.pools = {kind: list(maps) for kind, maps in (pools or DEFAULT_MAP_POOLS).items()}
+        self.recent = {}
+        self.history = history
+        self.rng = rng or random.Random()
+
+    def set_pool(self, kind: str, maps: list[str]):
+        '''
+        Replace a map pool, effective from the next match
+
+        :param kind: '1v1' or '3v3'
+        :param maps: The maps in the pool, at least one and without duplicates
+        '''
+        if kind not in MAP_POOL_TYPES:
+            raise ValueError(f"Map pool must be one of {', '.join(MAP_POOL_TYPES)}")
+        maps = [name.strip() for name in maps if name.strip()]
+        if not maps:
+            raise ValueError('A map pool needs at least one map')
+        if len(set(maps)) != len(maps):
+            raise ValueError('A map pool cannot list the same map twice')
+        self.pools[kind] = maps
+
+    def weights(self, match_type: str, keys: Iterable[tuple[str, str]]):
+        '''
+        The weight of every map in the pool for a match between the given participants
+
+        returns: (maps, weights), in pool order
+        '''
+        maps = self.pools[pool_type(match_type)]
+        played = Counter()
+        for key in keys:
+            played.update(self.recent.get(key, ()))
+        return maps, [REPEAT_PENALTY ** played[name] for name in maps]
+
+    def choose(self, match_type: str, keys: Iterable[tuple[str, str]]):
+        '''
+        Draw a map for a match and remember it for every participant
+
+        :param match_type: One of '1v1', '3v3 flex' or '3v3 reg'
+        :param keys: ('player', name) or ('team', name) for everyone in the match
+
+        returns: The map name
+        '''
+        keys = list(keys)
+        maps, weights = self.weights(match_type, keys)
+        chosen = self.rng.choices(maps, weights)[0]
+        for key in keys:
+            recent = self.recent.get(key)
+            if recent is None:
+                recent = self.recent[key] = deque(maxlen=self.history)
+            recent.append(chosen)
+        return chosen
+
+    def forget(self, key: tuple[str, str]):
+        '''
+        Drop the history of a player or team, e.g. when they are removed from the database
+        '''
+        self.recent.pop(key, None)
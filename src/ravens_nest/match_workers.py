@@ -0,0 +1,86 @@
+'''
+Matchmaking worker tier for the Ravens Nest.
+Designed by Ahasuerus for Armored Scrims Server
+
+The Discord gateway process only does I/O. Matchmaking searches are shipped
+to a pool of worker processes as compact queue snapshots and come back as
+match decisions, which are applied to the live queue on the event loop.
+'''
+import os
+import time
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+from ravens_nest.matchmaking import *
+
+
+def available_cores():
+    '''
+    Number of CPU cores this process may run on (respects container/affinity limits)
+    '''
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+class MatchmakingPool:
+    '''
+    Class running matchmaking searches off the event loop
+    '''
+    max_workers: int
+    inline: bool
+    executor: Optional[ProcessPoolExecutor]
+
+    def __init__(self, max_workers: Optional[int] = None, inline: bool = False):
+        '''
+        Create the matchmaking worker pool. Worker processes are started lazily on the first search.
+
+        :param max_workers: Number of worker processes, defaults to the number of available cores
+        :param inline: Run searches in-process instead, for tests and single-core hosts
+
+        returns: None
+        '''
+        self.max_workers = max_workers or available_cores()
+        self.inline = inline
+        self.executor = None
+
+    def _get_executor(self):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self.executor
+
+    async def search(self, queue_type: str, entries: tuple[QueueEntrySnapshot, ...], max_ELO_diff: int = MAX_ELO_DIFF):
+        '''
+        Run a matchmaking search over a queue snapshot
+
+        returns: A MatchDecision, or None if no valid match is possible
+        '''
+        now = time.monotonic() # waits are measured when the search is asked for, not when a worker picks it up
+        if self.inline:
+            return search_queue_snapshot(queue_type, entries, max_ELO_diff, now)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), search_queue_snapshot,
+                                          queue_type, entries, max_ELO_diff, now)
+
+    async def find_match(self, queue, max_ELO_diff: int = MAX_ELO_DIFF):
+        '''
+        Snapshot a MatchQueue, search it in a worker and apply the decision to the live queue.
+        The search runs without the queue lock; only applying the decision takes it.
+
+        :param queue: The MatchQueue to search
+
+        returns: The new match, or None
+        '''
+        if len(queue) < 2:
+            return None
+        with queue.matchmaking_seconds.time():
+            decision = await self.search(queue.queue_type, queue.snapshot(), max_ELO_diff)
+        return await queue.apply_match_decision_async(decision)
+
+    def shutdown(self):
+        '''
+        Stop the worker processes
+        '''
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
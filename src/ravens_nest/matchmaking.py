@@ -0,0 +1,323 @@
+'''
+Pure matchmaking search for the Ravens Nest.
+Designed by Ahasuerus for Armored Scrims Server
+
+The functions here only see compact, picklable snapshots of a queue and
+return the names of the entries that should be matched. They never touch
+Player/team objects, so they can run in a worker process as well as inline.
+
+Every valid pairing inside the ELO window is a candidate, and candidates are
+scored by match quality: how close the predicted win probability is to a
+coin flip, discounted by the ELO spread inside each team, plus a bonus for
+the longest wait among the entries involved. The search keeps the best
+candidate found before its time budget runs out, so a deep queue costs
+a bounded amount of CPU and still pops its longest waiters first. Flex
+teams are packed from whole parties, so a party is never split.
+'''
+import time
+import math
+from functools import lru_cache
+from itertools import product
+from bisect import bisect_left, bisect_right
+from typing import NamedTuple, Optional
+
+# constants
+MATCH_SEARCH_BUDGET = 0.05 # seconds a search may spend scoring candidates once it has one
+WAIT_HORIZON = 300.0 # seconds of waiting that earn the full wait bonus
+WAIT_WEIGHT = 0.25 # wait bonus at WAIT_HORIZON, relative to a perfect quality of 1
+SPREAD_SCALE = 400.0 # ELO range inside a team that halves the quality of a match
+MAX_ELO_DIFF = 250 # widest ELO gap a queue search matches across by default
+FLEX_TEAM_SIZE = 3 # players per side in 3v3 flex, and the largest party
+FILL_CANDIDATES = 4 # nearest-rated parties tried for each open slot when packing parties into flex teams
+ROLE_COVERAGE = 2 # distinct roles a packed flex team must be able to field
+FILL_SCAN = 32 # most parties looked at for one open slot while searching for role coverage
+ROLE_WAIT_LIMIT = WAIT_HORIZON # seconds after which an entry is teamed without regard to roles
+
+
+class QueueEntrySnapshot(NamedTuple):
+    '''
+    Immutable view of one queue entry, as shipped to matchmaking workers
+    '''
+    name: str # player name, or team name in the 3v3 reg queue
+    ELO: float # singles ELO, teams ELO or team ELO depending on the queue
+    rank: int # rank ordinal, see elo_core.RANKS
+    rank_restriction: bool # only play entries of the same rank or higher
+    party_id: Optional[int|str]
+    enqueued_at: float = 0.0 # time.monotonic() when the entry joined the queue
+    roles: tuple[str, ...] = () # preferred roles in 3v3 flex, empty to play any
+
+# a match decision is the names on each side: ([alpha names], [beta names])
+MatchDecision = tuple[list[str], list[str]]
+
+
+def win_probability(alpha_ELO: float, beta_ELO: float):
+    '''
+    The probability that alpha beats beta, from the same logistic curve as elo_core.ELO_formula
+    '''
+    return 1.0 / (1 + 10 ** ((beta_ELO - alpha_ELO) / 400.0))
+
+def match_quality(probability: float, spread: float = 0.0):
+    '''
+    How fair a match is, 1 for a coin flip between two evenly rated sides
+
+    :param probability: The predicted win probability of one side
+    :param spread: The ELO range inside the teams, summed over both sides
+
+    returns: A quality between 0 and 1
+    '''
+    return (1 - abs(2 * probability - 1)) / (1 + spread / SPREAD_SCALE)
+
+def wait_bonus(wait: float):
+    '''
+    The bonus for a candidate whose longest-waiting entry has been in queue for wait seconds
+    '''
+    return WAIT_WEIGHT * min(wait / WAIT_HORIZON, 1.0)
+
+def score_candidates(alpha_ELOs: list[float], beta_ELOs: list[float], spreads: list[float], waits: list[float]):
+    '''
+    Score candidate matches given as columns, one position per candidate
+
+    :param alpha_ELOs: The rating of side alpha (mean rating for teams of players)
+    :param beta_ELOs: The rating of side beta
+    :param spreads: The ELO range inside the teams, summed over both sides, 0 for head to head
+    :param waits: Seconds the longest-waiting entry of each candidate has been in queue
+
+    returns: list of scores, higher is better: match_quality(win_probability(alpha, beta), spread) plus the wait_bonus
+    '''
+    return [match_quality(win_probability(alpha, beta), spread) + wait_bonus(wait)
+            for alpha, beta, spread, wait in zip(alpha_ELOs, beta_ELOs, spreads, waits)]
+
+def _rank_buckets(ranks: list[int], ELOs: list[float]):
+    '''
+    Partition positions by rank ordinal, each bucket sorted by ELO
+
+    returns: rank -> (sorted ELOs, positions in the same order); rank None holds every position
+    '''
+    buckets = {None: ([], [])}
+    for position in sorted(range(len(ranks)), key=ELOs.__getitem__):
+        for rank in (None, ranks[position]):
+            bucket_ELOs, positions = buckets.setdefault(rank, ([], []))
+            bucket_ELOs.append(ELOs[position])
+            positions.append(position)
+    return buckets
+
+def _rank_window(buckets: dict, floor: int, ELO: float, max_ELO_diff: int):
+    '''
+    Positions within max_ELO_diff of ELO in the buckets of rank floor and above, in queue order.
+    Buckets below the floor are never looked at; a floor every rank meets reads the whole queue in one bisect.
+    '''
+    ranks = [rank for rank in buckets if rank is not None]
+    if not ranks or floor <= min(ranks):
+        ranks = [None]
+    return sorted(position for rank in ranks if rank is None or rank >= floor
+                  for position in buckets[rank][1][bisect_left(buckets[rank][0], ELO - max_ELO_diff):bisect_right(buckets[rank][0], ELO + max_ELO_diff)])
+
+def find_head_to_head(entries: tuple[QueueEntrySnapshot, ...], max_ELO_diff: int,
+                      now: Optional[float] = None, budget: float = MATCH_SEARCH_BUDGET):
+    '''
+    Find two entries to play each other, used by the 1v1 and 3v3 reg queues.
+    Entries are taken in queue order as anchors; every later entry within max_ELO_diff whose
+    rank restrictions allow it is scored, and the best candidate seen is returned once every
+    anchor was tried or the budget ran out. A rank restricted entry only plays its own rank or higher,
+    and only searches the rank buckets of its own rank and above.
+
+    :param entries: The queue snapshot, in queue order
+    :param max_ELO_diff: The widest ELO gap allowed
+    :param now: The current time.monotonic(), for the wait bonus
+    :param budget: Seconds to keep improving on the best candidate
+
+    returns: A MatchDecision, or None if no valid match is possible
+    '''
+    now = time.monotonic() if now is None else now
+    deadline = time.perf_counter() + budget
+    buckets = _rank_buckets([entry.rank for entry in entries], [entry.ELO for entry in entries])
+    best, best_score = None, -math.inf
+    for i, entry1 in enumerate(entries):
+        window = _rank_window(buckets, entry1.rank if entry1.rank_restriction else -1, entry1.ELO, max_ELO_diff)
+        # the buckets already meet entry1's restriction, a restricted partner still needs entry1 at its rank or higher
+        partners = [entries[j] for j in window if j > i and (not entries[j].rank_restriction or entry1.rank >= entries[j].rank)]
+        if partners:
+            scores = score_candidates([entry1.ELO] * len(partners), [entry2.ELO for entry2 in partners], [0.0] * len(partners),
+                                      [now - min(entry1.enqueued_at, entry2.enqueued_at) for entry2 in partners])
+            top = max(range(len(partners)), key=scores.__getitem__) # earliest partner on ties
+            if scores[top] > best_score:
+                best, best_score = ([entry1.name], [partners[top].name]), scores[top]
+        if best is not None and time.perf_counter() > deadline:
+            break
+    return best
+
+def _team_lowest(team: tuple[QueueEntrySnapshot, ...]):
+    return min(e.rank for e in team)
+
+def _team_floor(team: tuple[QueueEntrySnapshot, ...]):
+    '''
+    The lowest rank every player alongside or against this team must have, set by its restricted members
+    '''
+    return max((e.rank for e in team if e.rank_restriction), default=-1)
+
+def _flex_team(team: tuple[QueueEntrySnapshot, ...]):
+    '''
+    A candidate flex team: (names, mean ELO, ELO range, lowest rank, rank floor, earliest enqueue time)
+    '''
+    ELOs = [e.ELO for e in team]
+    return ([e.name for e in team], sum(ELOs) / len(ELOs), max(ELOs) - min(ELOs), _team_lowest(team), _team_floor(team),
+            min(e.enqueued_at for e in team))
+
+def _party_bins(entries: tuple[QueueEntrySnapshot, ...]):
+    '''
+    Group a flex snapshot into parties in queue order, solo players as parties of one.
+    Parties larger than a team can never be placed and are left out.
+    '''
+    bins = {}
+    for entry in entries:
+        bins.setdefault(('solo', entry.name) if entry.party_id is None else ('party', entry.party_id), []).append(entry)
+    return [tuple(members) for members in bins.values() if len(members) <= FLEX_TEAM_SIZE]
+
+def _bin_ELO(members: tuple[QueueEntrySnapshot, ...]):
+    return sum(e.ELO for e in members) / len(members)
+
+def _outward(sorted_ELOs: list[float], ELO: float):
+    '''
+    Positions in a sorted list of ratings, nearest to ELO first
+    '''
+    low = high = bisect_left(sorted_ELOs, ELO)
+    while low > 0 or high < len(sorted_ELOs):
+        if high < len(sorted_ELOs) and (low == 0 or sorted_ELOs[high] - ELO <= ELO - sorted_ELOs[low - 1]):
+            yield high
+            high += 1
+        else:
+            low -= 1
+            yield low
+
+@lru_cache(maxsize=4096)
+def _role_coverage(roles: tuple[tuple[str, ...], ...]):
+    chosen = max((len(set(assignment)) for assignment in product(*[options for options in roles if options])), default=0)
+    return chosen + sum(1 for options in roles if not options)
+
+def role_coverage(team: tuple[QueueEntrySnapshot, ...]):
+    '''
+    The most distinct roles the members can field, each playing one of their preferred roles.
+    A member without preferred roles fills any role.
+    '''
+    return _role_coverage(tuple(sorted(e.roles for e in team)))
+
+def pack_flex_teams(entries: tuple[QueueEntrySnapshot, ...], now: float = 0.0, deadline: float = math.inf,
+                    coverage: int = ROLE_COVERAGE):
+    '''
+    Pack whole parties into candidate flex teams: a full party, a duo with a solo player, or three solo players.
+    Every party anchors teams in queue order and fills its open slots with the nearest-rated parties that let
+    the team field coverage distinct roles, keeping up to FILL_CANDIDATES fills. A fill that leaves too few
+    open slots to reach the coverage is pruned without being completed, and no slot scans more than FILL_SCAN
+    parties, so n parties give O(n) candidate teams. Parties are never split, teams putting a rank restricted
+    player alongside a lower rank are left out, and full parties and anchors that waited past ROLE_WAIT_LIMIT
+    are teamed regardless of roles. Packing stops at the deadline once two teams were found.
+
+    :param entries: The queue snapshot, in queue order
+    :param now: The time.monotonic() the waits are measured at
+    :param deadline: time.perf_counter() to stop packing at
+    :param coverage: The distinct roles a team must be able to field
+
+    returns: list of candidate teams, see _flex_team
+    '''
+    bins = _party_bins(entries)
+    fillers = {size: sorted((members for members in bins if len(members) == size), key=_bin_ELO) for size in (1, 2)}
+    filler_ELOs = {size: [_bin_ELO(members) for members in fillers[size]] for size in fillers}
+    teams, seen = [], set()
+
+    def add(team: tuple[QueueEntrySnapshot, ...]):
+        names = frozenset(e.name for e in team)
+        if names not in seen and _team_floor(team) <= _team_lowest(team):
+            seen.add(names)
+            teams.append(_flex_team(team))
+
+    def fills(anchor: tuple[QueueEntrySnapshot, ...], size: int, needed: int):
+        '''
+        Up to FILL_CANDIDATES parties of a size, nearest the anchor's rating first, that can still reach the coverage
+        '''
+        found = []
+        for scanned, position in enumerate(_outward(filler_ELOs[size], _bin_ELO(anchor))):
+            if scanned == FILL_SCAN or len(found) == FILL_CANDIDATES:
+                break
+            members = fillers[size][position]
+            if members is not anchor and role_coverage(anchor + members) + FLEX_TEAM_SIZE - len(anchor) - size >= needed:
+                found.append(members)
+        return found
+
+    for members in bins:
+        if len(teams) > 1 and time.perf_counter() > deadline:
+            break
+        needed = 0 if now - min(e.enqueued_at for e in members) >= ROLE_WAIT_LIMIT else coverage
+        if len(members) == FLEX_TEAM_SIZE:
+            add(members)
+        elif len(members) == 2:
+            for solo in fills(members, 1, needed):
+                add(members + solo)
+        else:
+            for duo in fills(members, 2, needed):
+                add(members + duo)
+            seconds = fills(members, 1, needed)
+            for i, second in enumerate(seconds):
+                for third in seconds[i+1:]:
+                    if role_coverage(members + second + third) >= needed:
+                        add(members + second + third)
+    return teams
+
+def find_3v3_flex(entries: tuple[QueueEntrySnapshot, ...], max_ELO_diff: int,
+                  now: Optional[float] = None, budget: float = MATCH_SEARCH_BUDGET):
+    '''
+    Find two three-player teams to play each other from the flex queue.
+    Teams are packed from whole parties of one to three players by pack_flex_teams, and must be able to field
+    ROLE_COVERAGE distinct roles unless they are a full party or have waited past ROLE_WAIT_LIMIT.
+    A rank restricted player is only teamed with and against players of their rank or higher.
+    Team pairings within max_ELO_diff of each other's mean rating are scored, longest waiting teams first.
+
+    :param entries: The queue snapshot, in queue order
+    :param max_ELO_diff: The widest gap between team mean ratings allowed
+    :param now: The current time.monotonic(), for the wait bonus
+    :param budget: Seconds to keep improving on the best candidate
+
+    returns: A MatchDecision, or None if no valid match is possible
+    '''
+    if len(entries) < 2 * FLEX_TEAM_SIZE:
+        return None
+    now = time.monotonic() if now is None else now
+    deadline = time.perf_counter() + budget
+
+    # Longest waiting teams are paired first, so they are scored before the budget runs out
+    possible_teams = sorted(pack_flex_teams(entries, now, deadline), key=lambda x: x[5])
+    buckets = _rank_buckets([team[3] for team in possible_teams], [team[1] for team in possible_teams]) # by lowest member rank
+
+    best, best_score = None, -math.inf
+    for i, (team1, mean_ELO1, range_ELO1, lowest1, floor1, enqueued_at1) in enumerate(possible_teams):
+        members1 = set(team1)
+        # Only teams whose lowest rank meets team1's floor are searched; ensure no overlapping players,
+        # and no restricted player of the opponents facing a lower rank
+        opponents = [possible_teams[j] for j in _rank_window(buckets, floor1, mean_ELO1, max_ELO_diff)
+                     if j > i and possible_teams[j][4] <= lowest1 and members1.isdisjoint(possible_teams[j][0])]
+        if opponents:
+            scores = score_candidates([mean_ELO1] * len(opponents), [team2[1] for team2 in opponents],
+                                      [range_ELO1 + team2[2] for team2 in opponents],
+                                      [now - min(enqueued_at1, team2[5]) for team2 in opponents])
+            top = max(range(len(opponents)), key=scores.__getitem__)
+            if scores[top] > best_score:
+                best, best_score = (team1, opponents[top][0]), scores[top]
+        if best is not None and time.perf_counter() > deadline:
+            break
+    return best
+
+def search_queue_snapshot(queue_type: str, entries: tuple[QueueEntrySnapshot, ...], max_ELO_diff: int,
+                          now: Optional[float] = None, budget: float = MATCH_SEARCH_BUDGET):
+    '''
+    Entry point for matchmaking workers: dispatch a snapshot to the right search
+
+    :param queue_type: One of '1v1', '3v3 flex' or '3v3 reg'
+    :param entries: The queue snapshot, in queue order
+    :param now: The time.monotonic() the snapshot was taken at, so waits are measured by the caller's clock
+
+    returns: A MatchDecision, or None if no valid match is possible
+    '''
+    if queue_type in ('1v1', '3v3 reg'):
+        return find_head_to_head(entries, max_ELO_diff, now, budget)
+    elif queue_type == '3v3 flex':
+        return find_3v3_flex(entries, max_ELO_diff, now, budget)
+    raise ValueError("Invalid match type: must be '1v1', '3v3 flex', or '3v3 reg'")
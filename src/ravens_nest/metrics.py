@@ -0,0 +1,297 @@
+'''
+Lightweight metrics for the Ravens Nest.
+Designed by Ahasuerus for Armored Scrims Server
+
+Counters, gauges and fixed-bucket latency histograms cheap enough to leave
+on in production (a few microseconds per observation), rendered in the
+Prometheus text format. The bot serves them on a local HTTP endpoint and/or
+logs a periodic summary, see serve_metrics and log_metrics_periodically.
+'''
+import time
+import asyncio
+import inspect
+import functools
+from datetime import datetime, timezone
+from bisect import bisect_left
+from typing import Callable, Iterable, Optional
+
+# constants
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0) # seconds, upper bounds
+INTERACTION_ACK_DEADLINE = 3.0 # seconds Discord allows before an interaction must be acknowledged
+UNKNOWN_INTERACTION = 10062 # Discord error code for an interaction that expired before the response
+
+
+def _format_labels(labels: tuple[tuple[str, str], ...], extra: str = ''):
+    parts = [f'{key}="{value}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+class Counter:
+    '''
+    Monotonically increasing count
+    '''
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+
+class Gauge:
+    '''
+    Value that can go up and down
+    '''
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Histogram:
+    '''
+    Fixed-bucket histogram, an observation is one bisect and two additions
+    '''
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds: tuple[float, ...] = LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1) # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self):
+        '''
+        Context manager observing the duration of its block
+        '''
+        return _Timer(self)
+
+    def quantile(self, q: float):
+        '''
+        Estimate a quantile as the upper bound of the bucket it falls in
+        '''
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        running = 0
+        for bound, bucket_count in zip(self.bounds, self.counts):
+            running += bucket_count
+            if running >= target:
+                return bound
+        return float('inf')
+
+
+class _Timer:
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+class MetricsRegistry:
+    '''
+    Class holding every metric by name and labels, and rendering them
+    '''
+    metrics: dict[str, tuple[str, str, dict]] # name -> (type, help, {labels: metric})
+    collectors: list[Callable[[], Iterable[tuple[str, dict, float]]]]
+
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = []
+
+    def _get(self, kind: str, factory, name: str, description: str, labels: dict):
+        family = self.metrics.get(name)
+        if family is None:
+            family = self.metrics[name] = (kind, description, {})
+        elif family[0] != kind:
+            raise ValueError(f'Metric {name} is already registered as a {family[0]}')
+        key = tuple(sorted((key, str(value)) for key, value in labels.items()))
+        metric = family[2].get(key)
+        if metric is None:
+            metric = family[2][key] = factory()
+        return metric
+
+    def counter(self, name: str, description: str = '', **labels):
+        return self._get('counter', Counter, name, description, labels)
+
+    def gauge(self, name: str, description: str = '', **labels):
+        return self._get('gauge', Gauge, name, description, labels)
+
+    def histogram(self, name: str, description: str = '', **labels):
+        return self._get('histogram', Histogram, name, description, labels)
+
+    def add_collector(self, collector: Callable[[], Iterable[tuple[str, dict, float]]]):
+        '''
+        Register a callback producing (gauge name, labels, value) samples at render time,
+        for values such as queue depth that are cheaper to read than to track
+        '''
+        self.collectors.append(collector)
+
+    def render(self):
+        '''
+        Render every metric in the Prometheus text exposition format
+        '''
+        lines = []
+        for name, (kind, description, family) in sorted(self.metrics.items()):
+            if description:
+                lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, metric in family.items():
+                if kind == 'histogram':
+                    running = 0
+                    for bound, bucket_count in zip(metric.bounds, metric.counts):
+                        running += bucket_count
+                        bucket_labels = _format_labels(labels, 'le="%s"' % bound)
+                        lines.append(f'{name}_bucket{bucket_labels} {running}')
+                    bucket_labels = _format_labels(labels, 'le="+Inf"')
+                    lines.append(f'{name}_bucket{bucket_labels} {metric.count}')
+                    lines.append(f'{name}_sum{_format_labels(labels)} {metric.sum}')
+                    lines.append(f'{name}_count{_format_labels(labels)} {metric.count}')
+                else:
+                    lines.append(f'{name}{_format_labels(labels)} {metric.value}')
+        collected = {}
+        for collector in self.collectors:
+            for name, labels, value in collector():
+                collected.setdefault(name, []).append((tuple(sorted((k, str(v)) for k, v in labels.items())), value))
+        for name, samples in sorted(collected.items()):
+            lines.append(f'# TYPE {name} gauge')
+            for labels, value in samples:
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        '''
+        One line per histogram with count, estimated p50/p99 and mean, for the log
+        '''
+        lines = []
+        for name, (kind, _, family) in sorted(self.metrics.items()):
+            if kind != 'histogram':
+                continue
+            for labels, metric in family.items():
+                if metric.count:
+                    lines.append(f'{name}{_format_labels(labels)} n={metric.count} '
+                                 f'p50<={metric.quantile(0.5) * 1000:g}ms p99<={metric.quantile(0.99) * 1000:g}ms '
+                                 f'mean={metric.sum / metric.count * 1000:.3f}ms')
+        return '\n'.join(lines)
+
+# the registry used by the bot
+METRICS = MetricsRegistry()
+
+
+def timed(name: str, description: str = '', registry: Optional[MetricsRegistry] = None, **labels):
+    '''
+    Decorator recording the duration of every call of a function or coroutine in a histogram.
+    The histogram is looked up once, at decoration time.
+
+    :param name: The histogram name
+    :param labels: Fixed labels for this function, e.g. command='solo_queue'
+    '''
+    def decorator(func):
+        histogram = (registry or METRICS).histogram(name, description, **labels)
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - start)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+def instrument_command(func):
+    '''
+    Decorator for slash command handlers: records latency per command and counts failures.
+    Also counts interactions answered late, either because the handler started past the
+    acknowledgement deadline or because Discord rejected the response as an unknown interaction.
+    Goes between @tree.command and the handler so discord.py sees the wrapped signature.
+    '''
+    histogram = METRICS.histogram('ravens_nest_command_seconds', 'Slash command handler latency', command=func.__name__)
+    errors = METRICS.counter('ravens_nest_command_errors_total', 'Slash command handlers that raised', command=func.__name__)
+    age = METRICS.histogram('ravens_nest_interaction_age_seconds', 'Time from interaction creation to handler start', command=func.__name__)
+    late = METRICS.counter('ravens_nest_late_interactions_total', 'Interactions not acknowledged within the deadline', command=func.__name__)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        created_at = getattr(args[0], 'created_at', None) if args else None
+        if created_at is not None:
+            waited = (datetime.now(timezone.utc) - created_at).total_seconds()
+            age.observe(max(0.0, waited))
+            if waited > INTERACTION_ACK_DEADLINE:
+                late.inc()
+        try:
+            return await func(*args, **kwargs)
+        except Exception as error:
+            errors.inc()
+            if getattr(error, 'code', None) == UNKNOWN_INTERACTION and (created_at is None or waited <= INTERACTION_ACK_DEADLINE):
+                late.inc() # Discord dropped the interaction before the handler responded
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - start)
+    return wrapper
+
+
+async def serve_metrics(port: int, host: str = '127.0.0.1', registry: Optional[MetricsRegistry] = None):
+    '''
+    Serve the Prometheus text format on a local HTTP endpoint (any path)
+
+    returns: The asyncio server
+    '''
+    registry = registry or METRICS
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout=5)
+            body = registry.render().encode()
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n'
+                         b'Content-Length: %d\r\nConnection: close\r\n\r\n' % len(body) + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    print(f'Metrics served on http://{host}:{port}/metrics')
+    return server
+
+async def log_metrics_periodically(interval: float, registry: Optional[MetricsRegistry] = None):
+    '''
+    Print a latency summary every interval seconds
+    '''
+    registry = registry or METRICS
+    while True:
+        await asyncio.sleep(interval)
+        summary = registry.summary()
+        if summary:
+            print(f'Metrics snapshot:\n{summary}')
@@ -0,0 +1,70 @@
+'''
+Prefix index for autocomplete in the Ravens Nest.
+Designed by Ahasuerus for Armored Scrims Server
+
+Names are kept in a sorted array of (casefolded key, value) pairs, so a
+prefix query is one bisect plus a walk over the matches it returns, and an
+insert or removal is one bisect plus a memmove. At 50k names a query takes
+microseconds, well inside the time Discord allows an autocomplete answer.
+'''
+from bisect import bisect_left, insort
+from typing import Iterable
+
+# constants
+MAX_CHOICES = 25 # Discord shows at most 25 autocomplete choices
+
+
+class PrefixIndex:
+    '''
+    Class answering case-insensitive prefix queries over a set of names
+    '''
+    entries: list[tuple[str, object]] # sorted (casefolded key, value)
+
+    def __init__(self, values: Iterable = ()):
+        self.entries = sorted((str(value).casefold(), value) for value in values)
+
+    def add(self, value):
+        entry = (str(value).casefold(), value)
+        index = bisect_left(self.entries, entry)
+        if index == len(self.entries) or self.entries[index] != entry:
+            self.entries.insert(index, entry)
+
+    def extend(self, values: Iterable):
+        '''
+        Add many values at once, re-sorting once instead of inserting one by one
+        '''
+        self.entries.extend((str(value).casefold(), value) for value in values)
+        self.entries.sort()
+        self.entries = [entry for i, entry in enumerate(self.entries) if i == 0 or entry != self.entries[i - 1]]
+
+    def remove(self, value):
+        entry = (str(value).casefold(), value)
+        index = bisect_left(self.entries, entry)
+        if index < len(self.entries) and self.entries[index] == entry:
+            del self.entries[index]
+
+    def complete(self, prefix: str, limit: int = MAX_CHOICES):
+        '''
+        The first values, in key order, whose key starts with a prefix
+
+        :param prefix: What the user has typed so far, matched case-insensitively
+        :param limit: The maximum number of values returned
+
+        returns: list of values
+        '''
+        prefix = prefix.casefold()
+        index = bisect_left(self.entries, (prefix,))
+        completions = []
+        for key, value in self.entries[index:index + limit]:
+            if not key.startswith(prefix):
+                break
+            completions.append(value)
+        return completions
+
+    def __contains__(self, value):
+        entry = (str(value).casefold(), value)
+        index = bisect_left(self.entries, entry)
+        return index < len(self.entries) and self.entries[index] == entry
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,234 @@
+'''
+Outbound notification pipeline for the Ravens Nest.
+Designed by Ahasuerus for Armored Scrims Server
+
+Command handlers acknowledge their interaction straight away and hand
+match announcements, pings and DMs to a NotificationQueue instead of
+sending them inline. Every destination (a channel, or a player's DMs) has
+its own outbox and delivery task: messages posted within a short window
+are batched into as few Discord messages as fit, sends are paced per
+destination to stay under Discord's per-channel limit, and a 429 pauses
+the destination for the Retry-After the API asked for before retrying.
+Transient failures are retried with backoff; a player with closed DMs is
+skipped. A burst of pops therefore never delays an acknowledgement.
+'''
+import time
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable, Optional
+from ravens_nest.metrics import METRICS, MetricsRegistry
+
+# constants
+MESSAGE_LIMIT = 2000 # characters in one Discord message
+BATCH_WINDOW = 0.25 # seconds an outbox waits for more messages before sending
+DESTINATION_RATE = 5 # messages per DESTINATION_PERIOD to one channel or user
+DESTINATION_PERIOD = 5.0
+MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 1.0 # seconds, doubled on each transient failure
+
+
+def batch_messages(contents: list[str], limit: int = MESSAGE_LIMIT):
+    '''
+    Join messages into as few as possible, one per line, each at most limit characters.
+    A single message longer than the limit is split.
+
+    returns: list of message strings
+    '''
+    batches = []
+    current = ''
+    for content in contents:
+        while len(content) > limit:
+            if current:
+                batches.append(current)
+                current = ''
+            batches.append(content[:limit])
+            content = content[limit:]
+        if current and len(current) + 1 + len(content) > limit:
+            batches.append(current)
+            current = ''
+        current = f'{current}\n{content}' if current else content
+    if current:
+        batches.append(current)
+    return batches
+
+def retry_after(error: Exception):
+    '''
+    Seconds to wait before retrying a rate-limited send, read from the exception
+    (discord.RateLimited) or the response headers (discord.HTTPException with status 429)
+    '''
+    if getattr(error, 'retry_after', None) is not None:
+        return float(error.retry_after)
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    for header in ('Retry-After', 'X-RateLimit-Reset-After'):
+        if header in headers:
+            return float(headers[header])
+    return RETRY_BASE_DELAY
+
+
+class RateLimiter:
+    '''
+    Class pacing sends to one destination with a sliding window
+    '''
+    rate: int
+    period: float
+    sent: deque # monotonic times of the recent sends
+    paused_until: float
+
+    def __init__(self, rate: int = DESTINATION_RATE, period: float = DESTINATION_PERIOD):
+        self.rate = rate
+        self.period = period
+        self.sent = deque()
+        self.paused_until = 0.0
+
+    def pause(self, seconds: float):
+        '''
+        Hold every send to this destination for a number of seconds, e.g. after a 429
+        '''
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def busy(self):
+        '''
+        Whether a send or pause is still inside the current window
+        '''
+        now = time.monotonic()
+        return now < self.paused_until or bool(self.sent and now - self.sent[-1] < self.period)
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            while self.sent and now - self.sent[0] >= self.period:
+                self.sent.popleft()
+            wait = self.paused_until - now
+            if len(self.sent) >= self.rate:
+                wait = max(wait, self.sent[0] + self.period - now)
+            if wait <= 0:
+                self.sent.append(now)
+                return
+            await asyncio.sleep(wait)
+
+
+class Outbox:
+    '''
+    Class holding the pending messages and delivery task of one destination
+    '''
+    __slots__ = ('key', 'destination', 'pending', 'in_flight', 'limiter', 'task')
+
+    def __init__(self, key, destination):
+        self.key = key
+        self.destination = destination # a Messageable, or an async callable resolving to one
+        self.pending = deque() # (content, monotonic time posted)
+        self.in_flight = 0 # messages taken from pending but not yet sent or dropped
+        self.limiter = RateLimiter()
+        self.task = None
+
+
+class NotificationQueue:
+    '''
+    Class delivering outbound messages through per-destination outboxes
+    '''
+    outboxes: dict
+    batch_window: float
+
+    def __init__(self, batch_window: float = BATCH_WINDOW, registry: Optional[MetricsRegistry] = None):
+        registry = registry or METRICS
+        self.outboxes = {}
+        self.batch_window = batch_window
+        self.sent = registry.counter('ravens_nest_notifications_sent_total', 'Discord messages delivered by the notification queue')
+        self.failed = registry.counter('ravens_nest_notifications_failed_total', 'Notifications dropped after failing to send')
+        self.rate_limited = registry.counter('ravens_nest_notifications_rate_limited_total', 'Sends answered with a 429')
+        self.delay = registry.histogram('ravens_nest_notification_delay_seconds', 'Time from posting a notification to delivering it')
+
+    def post(self, destination, content: str, key=None):
+        '''
+        Queue a message for a channel. Never blocks.
+
+        :param destination: Anything with an async send(content), e.g. a discord channel or interaction.followup
+        :param content: The message text
+        :param key: Identifies the destination, defaults to destination.id
+        '''
+        self._post(key if key is not None else ('channel', getattr(destination, 'id', id(destination))), destination, content)
+
+    def post_dm(self, user_id: int, resolve_user: Callable[[int], Awaitable], content: str):
+        '''
+        Queue a direct message for a user. The user is resolved in the delivery task, not here.
+
+        :param user_id: The Discord ID of the user
+        :param resolve_user: Async callable returning the user for an ID, e.g. client.fetch_user
+        :param content: The message text
+        '''
+        async def resolve():
+            return await resolve_user(user_id)
+        self._post(('user', user_id), resolve, content)
+
+    def _post(self, key, destination, content: str):
+        outbox = self.outboxes.get(key)
+        if outbox is None:
+            outbox = self.outboxes[key] = Outbox(key, destination)
+        outbox.pending.append((content, time.monotonic()))
+        if outbox.task is None or outbox.task.done():
+            outbox.task = asyncio.get_running_loop().create_task(self._deliver_outbox(outbox))
+
+    def pending(self):
+        '''
+        The number of messages waiting to be delivered
+        '''
+        return sum(len(outbox.pending) for outbox in self.outboxes.values())
+
+    async def join(self):
+        '''
+        Wait until every posted message has been delivered or dropped
+        '''
+        while any(outbox.pending or outbox.in_flight for outbox in self.outboxes.values()):
+            await asyncio.sleep(self.batch_window)
+
+    async def _deliver_outbox(self, outbox: Outbox):
+        while True:
+            if not outbox.pending:
+                if outbox.limiter.busy():
+                    await asyncio.sleep(self.batch_window) # keep the send history until its window passes
+                    continue
+                break
+            await asyncio.sleep(self.batch_window) # let the rest of a burst arrive
+            posted = list(outbox.pending)
+            outbox.pending.clear()
+            outbox.in_flight = len(posted)
+            if callable(outbox.destination) and not hasattr(outbox.destination, 'send'):
+                try:
+                    outbox.destination = await outbox.destination()
+                except Exception as error:
+                    print(f'Notification destination {outbox.key} could not be resolved: {error}')
+                    self.failed.inc(len(posted) + len(outbox.pending))
+                    outbox.pending.clear()
+                    outbox.in_flight = 0
+                    break
+            for content in batch_messages([content for content, _ in posted]):
+                await self._send(outbox, content)
+            now = time.monotonic()
+            for _, posted_at in posted:
+                self.delay.observe(now - posted_at)
+            outbox.in_flight = 0
+        if self.outboxes.get(outbox.key) is outbox:
+            del self.outboxes[outbox.key] # idle destinations do not keep an outbox
+
+    async def _send(self, outbox: Outbox, content: str):
+        for attempt in range(MAX_ATTEMPTS):
+            await outbox.limiter.acquire()
+            try:
+                await outbox.destination.send(content)
+                self.sent.inc()
+                return True
+            except Exception as error:
+                status = getattr(error, 'status', None)
+                if status == 429 or getattr(error, 'retry_after', None) is not None:
+                    self.rate_limited.inc()
+                    outbox.limiter.pause(retry_after(error))
+                elif status == 403:
+                    print(f'Notification to {outbox.key} forbidden, dropping it: {error}')
+                    break
+                elif (status is not None and status >= 500) or isinstance(error, (OSError, asyncio.TimeoutError)):
+                    await asyncio.sleep(RETRY_BASE_DELAY * 2 ** attempt)
+                else:
+                    print(f'Notification to {outbox.key} failed, dropping it: {error}')
+                    break
+        self.failed.inc()
+        return False
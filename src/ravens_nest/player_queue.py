@@ -2,51 +2,279 @@
 ELO match queue system for the Ravens Nest.
 Designed by Ahasuerus for Armored Scrims Server
 
+Every queue keeps exponentially decayed counts of the entries it popped per
+ELO band, so the recent pop rate around any rating is known without keeping
+match history. A queue entry's expected wait is the number of entries ahead
+of it inside its ELO window divided by that rate.
 '''
 from ravens_nest.elo_core import *
+from ravens_nest.matchmaking import *
+from ravens_nest.metrics import METRICS
 from rich.table import Table
 from rich.console import Console
 import random
+import asyncio
+import math
+import time
+from bisect import bisect_left, bisect_right
+
+QUEUE_POLICIES = ['exclusive', 'multi'] # see QueueMembershipIndex
+ETA_BAND_WIDTH = 100 # ELO covered by one band of pop statistics
+ETA_HALF_LIFE = 1800.0 # seconds after which a pop counts half as much toward the pop rate
+
+class QueueMembershipIndex:
+    '''
+    Index of the queues every player is currently in, shared by all MatchQueues of a guild.
+
+    With the 'exclusive' policy a player may only be in one queue at a time.
+    With the 'multi' policy a player may queue for several match types at once
+    and is withdrawn from every other queue as soon as one of their matches pops.
+    '''
+    policy: str
+    memberships: dict[str, dict[str, 'MatchQueue']] # player name -> {queue_type: queue}
+
+    def __init__(self, policy: str = 'exclusive'):
+        self.memberships = {}
+        self.set_policy(policy)
+
+    def set_policy(self, policy: str):
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(f"queue policy must be one of {QUEUE_POLICIES}")
+        self.policy = policy
+
+    def queues_for(self, player_name: str):
+        '''
+        The queue types a player is currently in
+        '''
+        return list(self.memberships.get(player_name, ()))
+
+    def check(self, player_name: str, queue: 'MatchQueue'):
+        '''
+        Raise ValueError if the player may not join the given queue
+        '''
+        queues = self.memberships.get(player_name)
+        if not queues:
+            return
+        if queue.queue_type in queues:
+            raise ValueError(f"Player {player_name} is already in the {queue.queue_type} queue")
+        if self.policy == 'exclusive':
+            raise ValueError(f"Player {player_name} is already in the {next(iter(queues))} queue")
+
+    def add(self, player_name: str, queue: 'MatchQueue'):
+        self.memberships.setdefault(player_name, {})[queue.queue_type] = queue
+
+    def remove(self, player_name: str, queue: 'MatchQueue'):
+        queues = self.memberships.get(player_name)
+        if queues is not None:
+            queues.pop(queue.queue_type, None)
+            if not queues:
+                del self.memberships[player_name]
+
+    def withdraw(self, player_names: list[str]):
+        '''
+        Remove players from every queue they are in, used when one of their matches pops
+        '''
+        for player_name in player_names:
+            for queue in list(self.memberships.get(player_name, {}).values()):
+                queue._withdraw_player(player_name)
+
+    def __contains__(self, player_name: str):
+        return player_name in self.memberships
+
+    def __len__(self):
+        return len(self.memberships)
+
+
+class QueueStats:
+    '''
+    Exponentially decayed counts of the entries a queue popped, by ELO band.
+    Counts are decayed lazily when a band is touched, so recording a pop and
+    reading the rate around a rating both take time proportional to the bands
+    covered. Times are wall-clock time.time() so the statistics survive a restart.
+    '''
+    half_life: float
+    band_width: int
+    started: float # time.time() the statistics began, a young queue's rate is not diluted by time it did not exist
+    counts: dict[int, list[float]] # band -> [decayed count of popped entries, time.time() of the last decay]
+
+    def __init__(self, half_life: float = ETA_HALF_LIFE, band_width: int = ETA_BAND_WIDTH, started: Optional[float] = None):
+        self.half_life = half_life
+        self.band_width = band_width
+        self.started = time.time() if started is None else started
+        self.counts = {}
+
+    def _decayed(self, band: int, now: float):
+        count, updated = self.counts[band]
+        return count * 0.5 ** (max(now - updated, 0.0) / self.half_life)
+
+    def record_pop(self, ELO: float, now: Optional[float] = None):
+        '''
+        Count one entry popped at the given rating
+        '''
+        now = time.time() if now is None else now
+        band = int(ELO // self.band_width)
+        self.counts[band] = [(self._decayed(band, now) if band in self.counts else 0.0) + 1.0, now]
+
+    def rate(self, low: float, high: float, now: Optional[float] = None):
+        '''
+        Entries popped per second, recently, with a rating between low and high
+
+        returns: The pop rate, 0.0 before anything popped in the range
+        '''
+        now = time.time() if now is None else now
+        # a decayed count of a steady rate r converges to r * half_life / ln 2, sooner if the statistics are young
+        window = self.half_life / math.log(2) * (1 - 0.5 ** (max(now - self.started, 0.0) / self.half_life))
+        if window <= 0:
+            return 0.0
+        count = sum(self._decayed(band, now) for band in range(int(low // self.band_width), int(high // self.band_width) + 1)
+                    if band in self.counts)
+        return count / window
+
+    def to_dict(self):
+        return {'half_life': self.half_life, 'band_width': self.band_width, 'started': self.started,
+                'counts': {str(band): count for band, count in self.counts.items()}}
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        stats = cls(data['half_life'], data['band_width'], data['started'])
+        stats.counts = {int(band): count for band, count in data['counts'].items()}
+        return stats
+
+
+class QueueStatus(NamedTuple):
+    '''
+    Where one entry stands in its queue
+    '''
+    name: str # the entry, a team name in the 3v3 reg queue
+    position: int # 1 for the longest-waiting entry
+    queue_length: int
+    ELO: float
+    ELO_low: float # the window of ratings the entry can be matched against
+    ELO_high: float
+    ahead: int # entries ahead of it in queue order inside its ELO window
+    waited: float # seconds in queue so far
+    eta: Optional[float] # expected seconds until it pops, None before anything popped inside its window
+
+
+class Party:
+    '''
+    A group of one to FLEX_TEAM_SIZE players who queue, match and leave the flex queue together.
+    The flex search packs whole parties into teams, so a party is never split.
+    '''
+    __slots__ = ('party_id', 'members')
+    party_id: int|str
+    members: list[Player]
+
+    def __init__(self, members: list[Player], party_id: Optional[int|str] = None):
+        names = [player.player_name for player in members]
+        if not 1 <= len(members) <= FLEX_TEAM_SIZE:
+            raise ValueError(f"A party must have between 1 and {FLEX_TEAM_SIZE} players")
+        if len(set(names)) != len(names):
+            raise ValueError("A player can only be in a party once")
+        self.members = list(members)
+        self.party_id = random.randint(100000000000, 999999999999) if party_id is None else party_id
+
+    @property
+    def names(self):
+        return [player.player_name for player in self.members]
+
+    @property
+    def ELO(self):
+        '''
+        The mean teams ELO of the members, the rating the flex search packs the party at
+        '''
+        return sum(player.player_teams_ELO for player in self.members) / len(self.members)
+
+    def __len__(self):
+        return len(self.members)
+
+    def __repr__(self):
+        return f'Party({self.names!r}, party_id={self.party_id})'
+
+
+class QueueEntry:
+    '''
+    Handle for one entry in a MatchQueue: a player, or a team in the 3v3 reg queue.
+    The queue keeps handles by name, so removing one never scans the queue.
+    '''
+    __slots__ = ('member', 'name', 'rank_restriction', 'party_id', 'enqueued_at')
+    member: Player|team
+    name: str
+    rank_restriction: bool
+    party_id: Optional[int|str]
+    enqueued_at: float # time.monotonic() when the entry joined the queue
+
+    def __init__(self, member: Player|team, name: str, rank_restriction: bool = False, party_id: Optional[int|str] = None):
+        self.member = member
+        self.name = name
+        self.rank_restriction = rank_restriction
+        self.party_id = party_id
+        self.enqueued_at = time.monotonic()
+
+    def __repr__(self):
+        return f'QueueEntry({self.name!r}, rank_restriction={self.rank_restriction}, party_id={self.party_id})'
+
 
 class MatchQueue:
     queue_type = str # '1v1', '3v3 flex', '3v3 registered'
     player_pool = players_db # initialize the database for individual players
     teams_pool = teams_db # initialize the database for registered teams
-    queued_players = list[(Player, bool, int)] # list of tuples containing player, rank restriction, party ID
-    queued_teams = list[(team, bool, int)] # list of tuples containing team, rank restriction, party ID
+    queued_players = dict[str, QueueEntry] # player name -> entry, in queue order
+    queued_teams = dict[str, QueueEntry] # team name -> entry, in queue order
+    parties = dict[int|str, Party] # party ID -> the queued party, 3v3 flex only
+    team_of_player = dict[str, str] # roster player name -> queued team name, 3v3 reg only
+    membership = QueueMembershipIndex # which queues every player is in, shared across the guild's queues
+    lock = asyncio.Lock # serializes writers; readers use snapshot() and never take it
 
-    def __init__(self, queue_type, player_pool, teams_pool):
+    def __init__(self, queue_type, player_pool, teams_pool, membership: Optional[QueueMembershipIndex] = None):
         '''
         Initialize a MatchQueue object. Should only be called once
         to create a queue for a specific queue type.
+        Queues that share a membership index enforce its cross-queue policy.
         '''
         if queue_type not in ['1v1', '3v3 flex', '3v3 reg']: # TODO: make this a button once I figure out how discord does it
             raise ValueError("queue_type must be '1v1', '3v3 flex', or '3v3 reg'")
         self.queue_type = queue_type
         self.player_pool = player_pool
         self.teams_pool = teams_pool
-        self.queued_players = []
-        self.queued_teams = []
+        self.queued_players = {}
+        self.queued_teams = {}
+        self.parties = {}
+        self.team_of_player = {}
+        self.membership = membership if membership is not None else QueueMembershipIndex()
+        self.lock = asyncio.Lock()
+        self._snapshot = None # cached result of snapshot(), cleared on every mutation
+        self._positions = (None, {}) # (snapshot, name -> (position, entries ahead in window)), rebuilt on a new snapshot
+        self.stats = QueueStats()
+        self.matchmaking_seconds = METRICS.histogram('ravens_nest_matchmaking_seconds', 'Time to search a queue for a match', queue=queue_type)
+        self.wait_seconds = METRICS.histogram('ravens_nest_queue_wait_seconds', 'Time entries spent in queue before their match popped', queue=queue_type)
 
     def enqueue_player(self, player: Player, rank_restriction: bool = False, party_id: Optional[int] = None):
-        if player in [p[0] for p in self.queued_players]:
-            raise ValueError("Player already in queue")
-        else:
-            if self.queue_type in ['1v1', '3v3 flex']:
-                self.queued_players.append((player, rank_restriction, party_id))
-            else:
-                raise ValueError("queue_type must be '1v1' or '3v3 flex' to queue solo")
+        if self.queue_type not in ['1v1', '3v3 flex']:
+            raise ValueError("queue_type must be '1v1' or '3v3 flex' to queue solo")
+        self.membership.check(player.player_name, self)
+        self.queued_players[player.player_name] = QueueEntry(player, player.player_name, rank_restriction, party_id)
+        self.membership.add(player.player_name, self)
+        self._snapshot = None
 
-    def enqueue_party(self, party: list[Player], rank_restriction: bool = False):
+    def enqueue_party(self, party: Party|list[Player], rank_restriction: bool = False):
         '''
-        Enqueue a party of players. This ensures all party members will queue together.
+        Enqueue a party of players. Either every member is queued or none is.
+
+        returns: The queued Party
         '''
-        if self.queue_type == '3v3 reg':
-            raise ValueError("Cannot enqueue parties in 3v3 registered queue")
-        else:
-            party_id = random.randint(100000000000, 999999999999)
-            for player in party:
-                self.enqueue_player(player, rank_restriction, party_id)
+        if self.queue_type != '3v3 flex':
+            raise ValueError("Can only enqueue parties in 3v3 flex format")
+        if not isinstance(party, Party):
+            party = Party(party)
+        if party.party_id in self.parties:
+            raise ValueError(f"Party {party.party_id} already in queue")
+        for player_name in party.names: # check everyone first so a party is never half-queued
+            self.membership.check(player_name, self)
+        for player in party.members:
+            self.enqueue_player(player, rank_restriction, party.party_id)
+        self.parties[party.party_id] = party
+        return party
 
     def enqueue_team(self, team: team, rank_restriction: bool = False):
         '''
@@ -54,149 +282,285 @@ class MatchQueue:
         '''
         if self.queue_type != '3v3 reg':
             raise ValueError("Can only enqueue teams in 3v3 reg format")
-        else:
-            party_id = team.team_name
-            self.queued_teams.append((team, rank_restriction, party_id))
+        if team.team_name in self.queued_teams:
+            raise ValueError(f"Team {team.team_name} already in queue")
+        for player_name in roster_names(team):
+            self.membership.check(player_name, self)
+        party_id = team.team_name
+        self.queued_teams[team.team_name] = QueueEntry(team, team.team_name, rank_restriction, party_id)
+        for player_name in roster_names(team):
+            self.team_of_player[player_name] = team.team_name
+            self.membership.add(player_name, self)
+        self._snapshot = None
+
+    def _remove_player_entry(self, player_name: str):
+        '''
+        Remove a player's handle in O(1), returns the removed entry or None
+        '''
+        entry = self.queued_players.pop(player_name, None)
+        if entry is None:
+            return None
+        party = self.parties.get(entry.party_id)
+        if party is not None and not any(name in self.queued_players for name in party.names):
+            del self.parties[entry.party_id]
+        self.membership.remove(player_name, self)
+        self._snapshot = None
+        return entry
 
     def dequeue_player(self, player: Player):
-        for queued_player in self.queued_players:
-            if queued_player[0] == player:
-                self.queued_players.remove(queued_player)
-                return
-        raise ValueError(f"Player {player.player_name} not found in queue")
+        '''
+        Remove a player, and the rest of their party since a party never queues incomplete
+        '''
+        entry = self.queued_players.get(player.player_name)
+        if entry is None:
+            raise ValueError(f"Player {player.player_name} not found in queue")
+        if entry.party_id in self.parties:
+            self.dequeue_party(entry.party_id)
+        else:
+            self._remove_player_entry(player.player_name)
+
+    def dequeue_party(self, party_id: int|str):
+        '''
+        Remove every member of a party, in time proportional to the party size
+
+        returns: The dequeued Party
+        '''
+        party = self.parties.get(party_id)
+        if party is None:
+            raise ValueError(f"Party {party_id} not found in queue")
+        for player_name in party.names:
+            self._remove_player_entry(player_name)
+        return party
+
+    def dequeue_players(self, player_names: list[str]):
+        '''
+        Remove a group of players, e.g. the six players of a popped flex match.
+        Names that are not queued are ignored.
+        '''
+        for player_name in player_names:
+            self._remove_player_entry(player_name)
 
     def dequeue_team(self, team: team, rank_restriction: bool = False):
-        for queued_team in self.queued_teams:
-            if queued_team[0] == team:
-                self.queued_teams.remove(queued_team)
-                return
-        raise ValueError(f"Team {team.team_name} not found in queue")
+        if self.queued_teams.pop(team.team_name, None) is None:
+            raise ValueError(f"Team {team.team_name} not found in queue")
+        for player_name in roster_names(team):
+            self.team_of_player.pop(player_name, None)
+            self.membership.remove(player_name, self)
+        self._snapshot = None
+
+    def _withdraw_player(self, player_name: str):
+        '''
+        Remove a player, or the party or registered team they queued with, called by the membership index
+        '''
+        if self.queue_type == '3v3 reg':
+            team_name = self.team_of_player.get(player_name)
+            if team_name is not None:
+                self.dequeue_team(self.queued_teams[team_name].member)
+        elif player_name in self.queued_players:
+            self.dequeue_player(self.queued_players[player_name].member)
+
+    def leave(self, player_name: str):
+        '''
+        Take a player out of this queue at their own request. Parties and
+        registered teams leave together, since they were queued together.
+
+        returns: The names of the entries that left
+        '''
+        if self.queue_type == '3v3 reg':
+            team_name = self.team_of_player.get(player_name)
+            if team_name is None:
+                raise ValueError(f"Player {player_name} not found in queue")
+            self.dequeue_team(self.queued_teams[team_name].member)
+            return [team_name]
+        entry = self.queued_players.get(player_name)
+        if entry is None:
+            raise ValueError(f"Player {player_name} not found in queue")
+        if entry.party_id in self.parties:
+            return self.dequeue_party(entry.party_id).names
+        self.dequeue_player(entry.member)
+        return [player_name]
+
+    # async-safe API: every writer holds the queue lock for the whole mutation
+    async def enqueue_player_async(self, player: Player, rank_restriction: bool = False, party_id: Optional[int] = None):
+        async with self.lock:
+            self.enqueue_player(player, rank_restriction, party_id)
+
+    async def enqueue_party_async(self, party: Party|list[Player], rank_restriction: bool = False):
+        async with self.lock:
+            return self.enqueue_party(party, rank_restriction)
+
+    async def enqueue_team_async(self, team: team, rank_restriction: bool = False):
+        async with self.lock:
+            self.enqueue_team(team, rank_restriction)
+
+    async def dequeue_player_async(self, player: Player):
+        async with self.lock:
+            self.dequeue_player(player)
+
+    async def leave_async(self, player_name: str):
+        async with self.lock:
+            return self.leave(player_name)
+
+    async def dequeue_party_async(self, party_id: int|str):
+        async with self.lock:
+            return self.dequeue_party(party_id)
+
+    async def dequeue_team_async(self, team: team):
+        async with self.lock:
+            self.dequeue_team(team)
+
+    async def apply_match_decision_async(self, decision: Optional[MatchDecision]):
+        '''
+        Apply a match decision under the queue lock. Two searches racing on the
+        same snapshot cannot both pop a player: the second decision is stale.
+        '''
+        async with self.lock:
+            return self.apply_match_decision(decision)
 
     def get_queue(self):
         if self.queue_type == '3v3 reg':
-            return self.queued_teams
+            return list(self.queued_teams.values())
         else:
-            return self.queued_players
-
-    def _find_1v1_match(self, base_ELO_diff: int, max_ELO_diff: int):
-        # until there aren't enough players to make a match
-        while len(self.queued_players) >= 2:
-            # initialize ELO_diff to the base value
-            ELO_diff = base_ELO_diff
-            ELO_diff_increment = base_ELO_diff
-
-            # iterate through the queue
-            for i, (player1, rank_restriction1, _) in enumerate(self.queued_players):
-                while ELO_diff <= max_ELO_diff:
-                    # iterate through the remaining players in the queue
-                    for j, (player2, rank_restriction2, _) in enumerate(self.queued_players[i+1:], start=i+1):
-                        # check if the ELO difference between the two players is within the given range
-                        if abs(player1.player_singles_ELO - player2.player_singles_ELO) <= ELO_diff:
-                            # check if the rank restrictions are met
-                            if (not rank_restriction1 or (rank_restriction1 and player2.player_singles_rank <= player1.player_singles_rank)) and \
-                               (not rank_restriction2 or (rank_restriction2 and player1.player_singles_rank <= player2.player_singles_rank)):
-                                # if so, queue up a match between the two players
-                                print(f"Match found: {player1.player_name} ({player1.player_singles_ELO}) and {player2.player_name} ({player2.player_singles_ELO})")
-                                queued_match = match(player_alpha=player1, player_beta=player2, match_type='1v1')
-                                # pop the combatants players from the queue
-                                self.queued_players.pop(j)
-                                self.queued_players.pop(i)
-                                return queued_match
-                    # if no match is found, increment the ELO difference and try again
-                    ELO_diff += ELO_diff_increment
-                ELO_diff = base_ELO_diff  # Reset ELO_diff for the next player
-        print("No valid matches currently possible")
-        return None
-
-    def _find_3v3_reg_match(self, base_ELO_diff: int, max_ELO_diff: int):
-        while len(self.queued_teams) >= 2:
-            ELO_diff = base_ELO_diff
-            ELO_diff_increment = base_ELO_diff
-
-            for i, (team1, rank_restriction1, _) in enumerate(self.queued_teams):
-                while ELO_diff <= max_ELO_diff:
-                    for j, (team2, rank_restriction2, _) in enumerate(self.queued_teams[i+1:], start=i+1):
-                        if abs(team1.team_ELO - team2.team_ELO) <= ELO_diff:
-                            if (not rank_restriction1 or (rank_restriction1 and team2.team_rank <= team1.team_rank)) and \
-                               (not rank_restriction2 or (rank_restriction2 and team1.team_rank <= team2.team_rank)):
-                                print(f"Match found: {team1.team_name} ({team1.team_ELO}) and {team2.team_name} ({team2.team_ELO})")
-                                queued_match = match(team_alpha=team1, team_beta=team2, match_type='3v3 reg')
-                                self.queued_teams.pop(j)
-                                self.queued_teams.pop(i)
-                                return queued_match
-                    ELO_diff += ELO_diff_increment
-                ELO_diff = base_ELO_diff
-        print("No valid matches currently possible")
-        return None
-
-    def _find_3v3_flex_match(self, base_ELO_diff: int, max_ELO_diff: int):
-        while len(self.queued_players) >= 6:
-            ELO_diff = base_ELO_diff
-            possible_teams = []
-            used_players = set()
-
-            # Create all valid 3-player teams
-            for i, (player1, _, party_id1) in enumerate(self.queued_players):
-                if player1 in used_players:
-                    continue
-
-                # Party members should stay together
-                if party_id1 is not None:
-                    party_members = [p for p, _, party_id in self.queued_players if party_id == party_id1]
-                    if len(party_members) == 3:
-                        team_mean_ELO = sum(p.player_teams_ELO for p in party_members) / 3
-                        possible_teams.append((party_members, team_mean_ELO, 0))
-                        used_players.update(party_members)
-                else:
-                    for j, (player2, _, party_id2) in enumerate(self.queued_players[i+1:], start=i+1):
-                        if player2 in used_players:
-                            continue
-                        for k, (player3, _, party_id3) in enumerate(self.queued_players[j+1:], start=j+1):
-                            if player3 in used_players:
-                                continue
-
-                            if party_id1 == party_id2 == party_id3 or (party_id1 is None and party_id2 is None and party_id3 is None):
-                                team = [player1, player2, player3]
-                                team_mean_ELO = sum(p.player_teams_ELO for p in team) / 3
-                                team_range_ELO = max(p.player_teams_ELO for p in team) - min(p.player_teams_ELO for p in team)
-                                possible_teams.append((team, team_mean_ELO, team_range_ELO))
-
-            # Sort teams by ELO range
-            possible_teams.sort(key=lambda x: x[2], reverse=True)
-
-            # Try finding a valid match within ELO_diff
-            while ELO_diff <= max_ELO_diff:
-                for i, (team1, mean_ELO1, _) in enumerate(possible_teams):
-                    for j, (team2, mean_ELO2, _) in enumerate(possible_teams[i+1:], start=i+1):
-                        # Ensure no overlapping players
-                        if not any(player in team1 for player in team2):
-                            if abs(mean_ELO1 - mean_ELO2) <= ELO_diff:
-                                team1_names = [p.player_name for p in team1]
-                                team2_names = [p.player_name for p in team2]
-                                print(f"Match found: {team1_names} and {team2_names}")
-                                queued_match = match(team_alpha=team1, team_beta=team2, match_type='3v3 flex')
-
-                                # Remove the players from the queue
-                                self.queued_players = [p for p in self.queued_players if p[0] not in team1 + team2]
-                                return queued_match
-                ELO_diff += base_ELO_diff
-
-            print("No valid matches found within current ELO range.")
-            return None
-
+            return list(self.queued_players.values())
 
-    def get_valid_match_from_queue(self, base_ELO_diff: int = 10, max_ELO_diff: int = 250):
+    def snapshot(self):
         '''
-        Returns a valid match from the queue based on the queue type
+        Returns an immutable, picklable view of the queue for matchmaking and display.
+        The view is cached until the next mutation, so reads never need the write lock.
         '''
+        if self._snapshot is not None:
+            return self._snapshot
         if self.queue_type == '1v1':
-            return self._find_1v1_match(base_ELO_diff, max_ELO_diff)
+            self._snapshot = tuple(QueueEntrySnapshot(e.name, e.member.player_singles_ELO, rank_ordinal(e.member.player_singles_rank), e.rank_restriction, e.party_id, e.enqueued_at)
+                                   for e in self.queued_players.values())
         elif self.queue_type == '3v3 flex':
-            return self._find_3v3_flex_match(base_ELO_diff, max_ELO_diff)
+            self._snapshot = tuple(QueueEntrySnapshot(e.name, e.member.player_teams_ELO, rank_ordinal(e.member.player_teams_rank), e.rank_restriction, e.party_id, e.enqueued_at, e.member.player_roles)
+                                   for e in self.queued_players.values())
+        else:
+            self._snapshot = tuple(QueueEntrySnapshot(e.name, e.member.team_ELO, rank_ordinal(e.member.team_rank), e.rank_restriction, e.party_id, e.enqueued_at)
+                                   for e in self.queued_teams.values())
+        return self._snapshot
+
+    def apply_match_decision(self, decision: Optional[MatchDecision]):
+        '''
+        Turn a match decision from the matchmaking search into a match,
+        removing the matched entries from the queue. A decision made on an
+        older snapshot is dropped if any of its entries has since left the queue.
+        The matched players are also withdrawn from every other queue they are in.
+
+        :param decision: The names on each side, or None if no match was found
+
+        returns: The new match, or None
+        '''
+        if decision is None:
+            print("No valid matches currently possible")
+            return None
+        alpha_names, beta_names = decision
+        entries = self.queued_teams if self.queue_type == '3v3 reg' else self.queued_players
+        if any(name not in entries for name in alpha_names + beta_names):
+            print("Match decision is stale, entries have left the queue")
+            return None
+        alpha = [entries[name].member for name in alpha_names]
+        beta = [entries[name].member for name in beta_names]
+        now = time.monotonic()
+        for name in alpha_names + beta_names:
+            self.wait_seconds.observe(now - entries[name].enqueued_at)
+            self.stats.record_pop(self._ELO(entries[name].member))
+
+        if self.queue_type == '1v1':
+            print(f"Match found: {alpha[0].player_name} ({alpha[0].player_singles_ELO}) and {beta[0].player_name} ({beta[0].player_singles_ELO})")
+            queued_match = match(player_alpha=alpha[0], player_beta=beta[0], match_type='1v1')
+            self.dequeue_players(alpha_names + beta_names)
+            self.membership.withdraw(alpha_names + beta_names) # other queues, under the 'multi' policy
         elif self.queue_type == '3v3 reg':
-            return self._find_3v3_reg_match(base_ELO_diff, max_ELO_diff)
+            print(f"Match found: {alpha[0].team_name} ({alpha[0].team_ELO}) and {beta[0].team_name} ({beta[0].team_ELO})")
+            queued_match = match(team_alpha=alpha[0], team_beta=beta[0], match_type='3v3 reg')
+            for matched_team in alpha + beta:
+                self.dequeue_team(matched_team)
+                self.membership.withdraw(roster_names(matched_team)) # other queues, under the 'multi' policy
         else:
-            raise ValueError("Invalid match type: must be '1v1', '3v3 flex', or '3v3 reg'")
+            print(f"Match found: {alpha_names} and {beta_names}")
+            queued_match = match(team_alpha=alpha, team_beta=beta, match_type='3v3 flex')
+            self.dequeue_players(alpha_names + beta_names)
+            self.membership.withdraw(alpha_names + beta_names) # other queues, under the 'multi' policy
+        self._snapshot = None
+        return queued_match
+
+    def get_valid_match_from_queue(self, max_ELO_diff: int = MAX_ELO_DIFF):
+        '''
+        Returns a valid match from the queue based on the queue type.
+        Runs the matchmaking search inline, see match_workers for the off-loop version.
+        '''
+        with self.matchmaking_seconds.time():
+            decision = search_queue_snapshot(self.queue_type, self.snapshot(), max_ELO_diff, time.monotonic())
+        return self.apply_match_decision(decision)
+
+    def _ELO(self, member: Player|team):
+        if self.queue_type == '1v1':
+            return member.player_singles_ELO
+        elif self.queue_type == '3v3 flex':
+            return member.player_teams_ELO
+        return member.team_ELO
+
+    def status(self, name: str, now: Optional[float] = None):
+        '''
+        Position, ELO window and expected wait of a queued player, or of the
+        registered team a player plays for. Positions are indexed once per
+        change to the queue, so asking for any entry after that is O(1).
+
+        :param name: A queued player or team name
+        :param now: time.time() to read the pop rate at
+
+        returns: A QueueStatus, or None if the name is not in this queue
+        '''
+        snapshot = self.snapshot()
+        if self._positions[0] is not snapshot:
+            self._positions = (snapshot, self._index_positions(snapshot))
+        name = self.team_of_player.get(name, name)
+        if name not in self._positions[1]:
+            return None
+        position, ahead = self._positions[1][name]
+        entry = snapshot[position - 1]
+        low, high = entry.ELO - MAX_ELO_DIFF, entry.ELO + MAX_ELO_DIFF
+        rate = self.stats.rate(low, high, now)
+        return QueueStatus(name, position, len(snapshot), entry.ELO, low, high, ahead,
+                           time.monotonic() - entry.enqueued_at, (ahead + 1) / rate if rate else None)
+
+    @staticmethod
+    def _index_positions(snapshot: tuple[QueueEntrySnapshot, ...]):
+        '''
+        One sort of the ratings, then a Fenwick tree over them counts the earlier entries inside each window, O(n log n)
+
+        returns: name -> (position, entries ahead in queue order within MAX_ELO_DIFF)
+        '''
+        ELOs = sorted(entry.ELO for entry in snapshot)
+        tree = [0] * (len(ELOs) + 1)
+
+        def counted_below(index: int): # entries counted so far among the lowest index ratings
+            total = 0
+            while index > 0:
+                total += tree[index]
+                index -= index & -index
+            return total
+
+        positions = {}
+        for position, entry in enumerate(snapshot, start=1):
+            ahead = counted_below(bisect_right(ELOs, entry.ELO + MAX_ELO_DIFF)) - counted_below(bisect_left(ELOs, entry.ELO - MAX_ELO_DIFF))
+            positions[entry.name] = (position, ahead)
+            index = bisect_left(ELOs, entry.ELO) + 1
+            while index <= len(ELOs):
+                tree[index] += 1
+                index += index & -index
+        return positions
+
+    def oldest_wait(self, now: Optional[float] = None):
+        '''
+        Seconds the longest-waiting entry has been in queue, O(1) since entries are kept in queue order
+        '''
+        entries = self.queued_teams if self.queue_type == '3v3 reg' else self.queued_players
+        if not entries:
+            return 0.0
+        return (time.monotonic() if now is None else now) - next(iter(entries.values())).enqueued_at
 
     def __len__(self):
         if self.queue_type == '3v3 reg':
@@ -215,7 +579,8 @@ class MatchQueue:
             table.add_column("Player Name", justify="left")
             table.add_column("ELO", justify="right")
             table.add_column("Rank Restriction", justify="left")
-            for player, rank_restriction, _ in self.queued_players:
+            for entry in self.queued_players.values():
+                player, rank_restriction = entry.member, entry.rank_restriction
                 table.add_row(
                     player.player_name,
                     str(player.player_singles_ELO),
@@ -228,7 +593,8 @@ class MatchQueue:
             table.add_column("Rank Restriction", justify="left")
             table.add_column("Team", justify="left")
             table.add_column("Party ID", justify="right")
-            for player, rank_restriction, party_id in self.queued_players:
+            for entry in self.queued_players.values():
+                player, rank_restriction, party_id = entry.member, entry.rank_restriction, entry.party_id
                 table.add_row(
                     player.player_name,
                     str(player.player_teams_ELO),
@@ -241,11 +607,12 @@ class MatchQueue:
             table.add_column("Team Name", justify="left")
             table.add_column("Team ELO", justify="right")
             table.add_column("Rank Restriction", justify="left")
-            for team, rank_restriction, party_id in self.queued_teams:
+            for entry in self.queued_teams.values():
+                team, rank_restriction = entry.member, entry.rank_restriction
                 table.add_row(
                     team.team_name,
                     str(team.team_ELO),
-                    str(rank_restriction) if rank_restriction else "None",
+                    f"{team.team_rank}+" if rank_restriction else "None",
                 )
 
         with console.capture() as capture:
@@ -0,0 +1,167 @@
+'''
+Sampling profiler for the Ravens Nest.
+Designed by Ahasuerus for Armored Scrims Server
+
+When the event loop runs on the main thread (as it does under client.run)
+a SIGPROF interval timer interrupts it every few milliseconds of CPU time
+and the signal handler records the interrupted stack, so samples land on
+whatever Python code is actually running. Elsewhere a background thread
+samples the loop thread instead; that fallback can only observe the loop
+where it releases the GIL, so it over-reports I/O waits. Either way no
+profiling code runs between samples. Results are written as collapsed
+stacks (one "frame;frame;frame count" line per stack, readable by
+speedscope and flamegraph.pl) and summarised as the functions with the
+most samples.
+'''
+import os
+import sys
+import signal
+import time
+import asyncio
+import threading
+from collections import Counter
+from typing import Optional
+
+# constants
+PROFILE_DIR = os.getenv('RAVENS_NEST_PROFILE_DIR', 'profiles')
+DEFAULT_SAMPLE_INTERVAL = 0.005 # seconds between samples
+MAX_PROFILE_SECONDS = 300
+
+_profile_lock = threading.Lock() # only one profile may run at a time
+
+
+def frame_label(frame):
+    code = frame.f_code
+    return f'{os.path.basename(code.co_filename)}:{code.co_name}:{code.co_firstlineno}'
+
+def collapse_stack(frame, max_depth: int = 128):
+    '''
+    Turn a frame into a root-first list of frame labels
+    '''
+    labels = []
+    while frame is not None and len(labels) < max_depth:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+
+class StackSampler:
+    '''
+    Class sampling one thread's stack, from a SIGPROF handler or a background thread
+    '''
+    thread_id: int
+    interval: float
+    stacks: Counter # collapsed stack string -> sample count
+    samples: int
+    use_signal: bool
+
+    def __init__(self, thread_id: Optional[int] = None, interval: float = DEFAULT_SAMPLE_INTERVAL):
+        '''
+        :param thread_id: The thread to sample, defaults to the calling thread (the event loop)
+        :param interval: Seconds between samples
+        '''
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        # signal handlers only run on the main thread, and only where setitimer exists
+        self.use_signal = (hasattr(signal, 'setitimer') and self.thread_id == threading.main_thread().ident
+                           and threading.get_ident() == self.thread_id)
+        self._previous_handler = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='ravens-nest-profiler', daemon=True)
+
+    def _record(self, frame):
+        self.stacks[';'.join(collapse_stack(frame))] += 1
+        self.samples += 1
+
+    def _on_signal(self, signum, frame):
+        if frame is not None:
+            self._record(frame)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self._record(frame)
+            del frame
+
+    def start(self):
+        if self.use_signal:
+            self._previous_handler = signal.signal(signal.SIGPROF, self._on_signal)
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        else:
+            self._thread.start()
+
+    def stop(self):
+        if self.use_signal:
+            signal.setitimer(signal.ITIMER_PROF, 0)
+            signal.signal(signal.SIGPROF, self._previous_handler or signal.SIG_DFL)
+        else:
+            self._stop.set()
+            self._thread.join()
+
+    def top_functions(self, num_functions: int = 15):
+        '''
+        The functions with the most samples
+
+        returns: list of (label, self samples, total samples), sorted by self samples then total samples.
+                 Event loop frames sit under every sample, so sorting by self samples puts the work first
+        '''
+        self_samples = Counter()
+        total_samples = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(';')
+            self_samples[frames[-1]] += count
+            for label in set(frames): # recursion counts once per sample
+                total_samples[label] += count
+        ranked = sorted(total_samples, key=lambda label: (self_samples[label], total_samples[label]), reverse=True)
+        return [(label, self_samples[label], total_samples[label]) for label in ranked[:num_functions]]
+
+    def write_collapsed(self, file_path: str):
+        '''
+        Write the samples as collapsed stacks
+        '''
+        os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+        with open(file_path, 'w') as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f'{stack} {count}\n')
+
+    def summary(self, num_functions: int = 15):
+        '''
+        Text summary of the top functions, sized to fit a Discord message
+        '''
+        lines = [f'{self.samples} samples every {self.interval * 1000:g} ms', f'{"total":>6} {"self":>6}  function']
+        for label, own, total in self.top_functions(num_functions):
+            lines.append(f'{total / max(self.samples, 1):6.1%} {own / max(self.samples, 1):6.1%}  {label[:80]}')
+        return '\n'.join(lines)
+
+
+async def profile_event_loop(seconds: float, interval: float = DEFAULT_SAMPLE_INTERVAL, profile_dir: str = PROFILE_DIR):
+    '''
+    Sample the running event loop for a number of seconds and write the result to disk.
+    Must be awaited from the loop being profiled; raises ValueError if a profile is already running.
+
+    :param seconds: How long to sample, capped at MAX_PROFILE_SECONDS
+    :param interval: Seconds between samples
+    :param profile_dir: Directory for the collapsed-stack files
+
+    returns: (sampler, path of the collapsed-stack file)
+    '''
+    if not _profile_lock.acquire(blocking=False):
+        raise ValueError('A profile is already running')
+    try:
+        sampler = StackSampler(threading.get_ident(), interval)
+        sampler.start()
+        try:
+            await asyncio.sleep(min(seconds, MAX_PROFILE_SECONDS))
+        finally:
+            # also when the profile is cancelled, so neither the itimer and SIGPROF handler nor the sampler thread
+            # outlive it. The signal sampler must stop on the main thread; the thread sampler wakes from its wait at once
+            sampler.stop()
+        file_path = os.path.join(profile_dir, f'profile_{time.strftime("%Y%m%d_%H%M%S")}.collapsed')
+        await asyncio.to_thread(sampler.write_collapsed, file_path)
+        return sampler, file_path
+    finally:
+        _profile_lock.release()
@@ -0,0 +1,206 @@
+'''
+Seasons and ladder resets for the Ravens Nest.
+Designed by Ahasuerus for Armored Scrims Server
+
+Resetting the ladder (elo_schema.txt, "function for ladder reset") closes the
+current season: every player, team and completed match is frozen into one
+SQLite file per season, then ratings are soft-reset toward the ladder mean
+and records start over. Past seasons are never loaded back into memory. A
+SeasonArchive opens its file read-only for each query and answers it with
+an indexed lookup or an ORDER BY ... LIMIT, and hands back the same Player
+and team objects the live registries do, so /playerstats and the
+leaderboards render past seasons with the code they use for the current one.
+'''
+import os
+import sqlite3
+import contextlib
+from datetime import datetime
+from typing import Optional
+from ravens_nest.elo_core import *
+from ravens_nest.leaderboards import LadderPage, PAGE_SIZE, ladder_cursor
+
+# constants
+SEASON_RESET_COMPRESSION = 0.5 # fraction of each rating's distance from the ladder mean removed on reset
+ARCHIVE_SCHEMA = '''
+CREATE TABLE season (season INTEGER, archived TEXT);
+CREATE TABLE players (player_name TEXT PRIMARY KEY, player_id TEXT, player_team TEXT,
+                      singles_ELO INTEGER, teams_ELO INTEGER, singles_rank TEXT, teams_rank TEXT,
+                      singles_wins INTEGER, singles_losses INTEGER, teams_wins INTEGER, teams_losses INTEGER,
+                      singles_placement_played INTEGER, teams_placement_played INTEGER);
+CREATE TABLE teams (team_name TEXT PRIMARY KEY, roster TEXT, team_ELO INTEGER, team_rank TEXT,
+                    wins INTEGER, losses INTEGER, placement_played INTEGER);
+CREATE TABLE matches (match_id INTEGER, match_type TEXT, match_date TEXT, match_map TEXT, winner TEXT, loser TEXT);
+CREATE INDEX players_singles ON players (singles_ELO DESC, player_name);
+CREATE INDEX players_teams ON players (teams_ELO DESC, player_name);
+CREATE INDEX teams_ELO ON teams (team_ELO DESC, team_name);
+'''
+ARCHIVE_LADDERS = { # match type -> (table, ELO column, rank column, name column, team column), see LADDERS
+    '1v1': ('players', 'singles_ELO', 'singles_rank', 'player_name', 'player_team'),
+    '3v3 flex': ('players', 'teams_ELO', 'teams_rank', 'player_name', 'player_team'),
+    '3v3 reg': ('teams', 'team_ELO', 'team_rank', 'team_name', None),
+}
+
+
+def soft_reset(ELOs: list[int], compression: float = SEASON_RESET_COMPRESSION):
+    '''
+    Compress a ladder's ratings toward their mean
+
+    :param ELOs: The ratings of one ladder
+    :param compression: 0 keeps every rating, 1 sets every rating to the mean
+
+    returns: list of new ratings, same order, within ELO_MINIMUM and ELO_MAXIMUM
+    '''
+    if not 0 <= compression <= 1:
+        raise ValueError('Compression must be between 0 and 1')
+    if not ELOs:
+        return []
+    mean = sum(ELOs) / len(ELOs)
+    return [min(max(round(mean + (ELO - mean) * (1 - compression)), ELO_MINIMUM), ELO_MAXIMUM) for ELO in ELOs]
+
+def write_season_archive(file_path: str, season: int, player_registry: players_db, teams_registry: teams_db, matches_db: match_db):
+    '''
+    Freeze a season's players, teams and completed matches into a SQLite file.
+    The file is written next to its final path and renamed into place, so a crash never leaves half an archive.
+    '''
+    temp_path = f'{file_path}.tmp'
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    with contextlib.closing(sqlite3.connect(temp_path)) as connection:
+        connection.executescript(ARCHIVE_SCHEMA)
+        connection.execute('INSERT INTO season VALUES (?, ?)', (season, datetime.now().isoformat()))
+        connection.executemany('INSERT INTO players VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', [
+            (player.player_name, player.player_id, player.player_team, player.player_singles_ELO, player.player_teams_ELO,
+             player.player_singles_rank, player.player_teams_rank, player.singles_wins, player.singles_losses,
+             player.teams_wins, player.teams_losses, player.singles_placement_played, player.teams_placement_played)
+            for player in player_registry.players])
+        connection.executemany('INSERT INTO teams VALUES (?, ?, ?, ?, ?, ?, ?)', [
+            (team.team_name, ','.join(roster_names(team, empty='')),
+             team.team_ELO, team.team_rank,
+             team.wins, team.losses, team.placement_played)
+            for team in teams_registry.teams])
+        connection.executemany('INSERT INTO matches VALUES (?, ?, ?, ?, ?, ?)', [
+            (match.match_id, match.match_type, str(match.match_date), match.match_map,
+             ', '.join(match.match_winner) if isinstance(match.match_winner, list) else match.match_winner,
+             ', '.join(match.match_loser) if isinstance(match.match_loser, list) else match.match_loser)
+            for match in matches_db.matches if match.match_status == 'completed'])
+        connection.commit()
+    os.replace(temp_path, file_path)
+
+
+class SeasonArchive:
+    '''
+    Class answering stats and leaderboard queries against one archived season.
+    Mirrors the read methods of players_db and teams_db, returning detached Player and team objects.
+    '''
+    season: int
+    file_path: str
+
+    def __init__(self, season: int, file_path: str):
+        self.season = season
+        self.file_path = file_path
+
+    def _query(self, sql: str, parameters: tuple = ()):
+        # opened read-only per query: nothing of a past season stays in memory between commands
+        with contextlib.closing(sqlite3.connect(f'file:{self.file_path}?mode=ro', uri=True)) as connection:
+            return connection.execute(sql, parameters).fetchall()
+
+    @staticmethod
+    def _player(row: tuple):
+        player = Player(row[0], row[2], row[1])
+        (player.player_singles_ELO, player.player_teams_ELO, player.player_singles_rank, player.player_teams_rank,
+         player.singles_wins, player.singles_losses, player.teams_wins, player.teams_losses,
+         player.singles_placement_played, player.teams_placement_played) = row[3:]
+        player.update_WinLoss()
+        return player
+
+    @staticmethod
+    def _team(row: tuple):
+        archived_team = team(row[0], [Player(name) if name else None for name in row[1].split(',')])
+        (archived_team.team_ELO, archived_team.team_rank, archived_team.wins, archived_team.losses,
+         archived_team.placement_played) = row[2:]
+        archived_team.update_WinLoss()
+        return archived_team
+
+    def get_player(self, player_name: str):
+        rows = self._query('SELECT * FROM players WHERE player_name = ?', (player_name,))
+        return self._player(rows[0]) if rows else None
+
+    def get_team(self, team_name: str):
+        rows = self._query('SELECT * FROM teams WHERE team_name = ?', (team_name,))
+        return self._team(rows[0]) if rows else None
+
+    def get_top_singles_players(self, num_players: int):
+        return [self._player(row) for row in self._query('SELECT * FROM players ORDER BY singles_ELO DESC LIMIT ?', (num_players,))]
+
+    def get_top_teams_players(self, num_players: int):
+        return [self._player(row) for row in self._query('SELECT * FROM players ORDER BY teams_ELO DESC LIMIT ?', (num_players,))]
+
+    def get_top_teams(self, num_teams: int):
+        return [self._team(row) for row in self._query('SELECT * FROM teams ORDER BY team_ELO DESC LIMIT ?', (num_teams,))]
+
+    def ladder_page(self, ladder: str, size: int = PAGE_SIZE, after: Optional[tuple] = None, before: Optional[tuple] = None,
+                    rank: Optional[str] = None, team_name: Optional[str] = None, at: Optional[str] = None):
+        '''
+        One page of an archived ladder, answered with keyset queries on the ELO indexes.
+        Same parameters and result as LadderIndex.page.
+        '''
+        table, ELO, rank_column, name, team_column = ARCHIVE_LADDERS[ladder]
+        entry = self._player if table == 'players' else self._team
+        where, parameters = '1', ()
+        if rank is not None:
+            # SS ranks are stored with their ELO, e.g. 'SS_1800'
+            where, parameters = f"{where} AND ({rank_column} = ? OR {rank_column} LIKE ? ESCAPE '\\')", (*parameters, rank, f'{rank}\\_%')
+        if team_name is not None:
+            where, parameters = f'{where} AND {team_column} = ?', (*parameters, team_name)
+        ahead = f'({ELO} > ? OR ({ELO} = ? AND {name} < ?))' # sorts before a cursor
+
+        total = self._query(f'SELECT COUNT(*) FROM {table} WHERE {where}', parameters)[0][0]
+        if at is not None:
+            rows = self._query(f'SELECT {ELO}, {name} FROM {table} WHERE {where} AND {name} = ?', (*parameters, at))
+            if not rows:
+                return LadderPage([], total, False, False)
+            cursor = rows[0]
+            rows = self._query(f'SELECT * FROM {table} WHERE {where} AND NOT {ahead} ORDER BY {ELO} DESC, {name} LIMIT ?',
+                               (*parameters, cursor[0], cursor[0], cursor[1], size))
+        elif after is not None:
+            rows = self._query(f'SELECT * FROM {table} WHERE {where} AND ({ELO} < ? OR ({ELO} = ? AND {name} > ?)) '
+                               f'ORDER BY {ELO} DESC, {name} LIMIT ?', (*parameters, after[0], after[0], after[1], size))
+        elif before is not None:
+            rows = self._query(f'SELECT * FROM {table} WHERE {where} AND {ahead} ORDER BY {ELO} ASC, {name} DESC LIMIT ?',
+                               (*parameters, before[0], before[0], before[1], size))[::-1]
+        else:
+            rows = self._query(f'SELECT * FROM {table} WHERE {where} ORDER BY {ELO} DESC, {name} LIMIT ?', (*parameters, size))
+        if not rows:
+            return LadderPage([], total, False, False)
+
+        entries = [entry(row) for row in rows]
+        first_ELO, first_name = ladder_cursor(ladder, entries[0])
+        position = self._query(f'SELECT COUNT(*) FROM {table} WHERE {where} AND {ahead}',
+                               (*parameters, first_ELO, first_ELO, first_name))[0][0] + 1
+        return LadderPage(list(enumerate(entries, start=position)), total, position > 1, position + len(entries) <= total)
+
+    def count_matches(self):
+        return self._query('SELECT COUNT(*) FROM matches')[0][0]
+
+
+def reset_ladder(player_registry: players_db, teams_registry: teams_db, matches_db: match_db,
+                 compression: float = SEASON_RESET_COMPRESSION, thresholds: RankThresholds = DEFAULT_RANK_THRESHOLDS):
+    '''
+    Start a new season in place: soft-reset every ladder toward its mean, clear records and completed matches,
+    and re-place every placed pilot from their new rating. Unresolved matches, pending or disputed, carry over
+    into the new season with their reports.
+    '''
+    players, teams = player_registry.players, teams_registry.teams
+    singles = soft_reset([player.player_singles_ELO for player in players], compression)
+    flex = soft_reset([player.player_teams_ELO for player in players], compression)
+    for player, singles_ELO, teams_ELO in zip(players, singles, flex):
+        player.player_singles_ELO, player.player_teams_ELO = singles_ELO, teams_ELO
+        player.singles_wins = player.singles_losses = player.teams_wins = player.teams_losses = 0
+        player.singles_wl_ratio = player.teams_wl_ratio = 0.0
+    for reset_team, team_ELO in zip(teams, soft_reset([team.team_ELO for team in teams], compression)):
+        reset_team.team_ELO = team_ELO
+        reset_team.wins = reset_team.losses = 0
+        reset_team.wl_ratio = 0.0
+    matches_db.matches = [match for match in matches_db.matches if match.match_status in ('pending', 'disputed')]
+    matches_db.pending_index = PrefixIndex(match.match_id for match in matches_db.matches)
+    rerank_ladder(player_registry, teams_registry, thresholds, reset=True)
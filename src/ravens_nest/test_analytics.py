@@ -0,0 +1,87 @@
+# test functions #
+import io
+import math
+import random
+import tempfile
+import contextlib
+from ravens_nest.elo_core import *
+from ravens_nest.analytics import *
+from ravens_nest.guild_state import *
+
+# results reported through a guild's match database feed its analytics
+state = GuildStateManager(tempfile.mkdtemp()).get(1)
+hooli, kraydle = Player('Hooli'), Player('Kraydle')
+hooli.player_singles_ELO, hooli.player_singles_rank = 1300, 'A'
+state.player_registry.add_players([hooli, kraydle])
+
+def play(winner, loser, map_name='Grid 086 A'):
+    played = match('1v1', hooli, kraydle)
+    played.setup_match_parameters()
+    played.match_map = map_name
+    state.matches_db.add_match(played)
+    state.matches_db.update_match(played.match_id, winner, loser)
+
+with contextlib.redirect_stdout(io.StringIO()):
+    play(hooli, kraydle)
+    play(hooli, kraydle)
+    play(kraydle, hooli, 'Watchpoint Delta A')
+analytics = state.matches_db.analytics
+assert analytics.record_between('1v1', 'Hooli', 'Kraydle') == (2, 1)
+assert analytics.record_between('1v1', 'Kraydle', 'Hooli') == (1, 2)
+assert analytics.streak('1v1', 'Hooli') == (-1, 2) and analytics.streak('1v1', 'Kraydle') == (1, 1)
+rates = dict(analytics.map_win_rates('1v1'))
+assert rates['Grid 086 A'] == {'A': (1.0, 2), 'C': (0.0, 2)} and rates['Watchpoint Delta A']['C'] == (1.0, 1)
+
+# the first prediction is taken before the result moves any rating: 1300 against 700 is a lopsided favourite
+curve = analytics.calibration_curve('1v1')
+assert sum(count for _, _, count, _, _ in curve) == 6 and curve[-1][0] == 0.9 and curve[0][1] == 0.1
+
+# the totals survive an eviction round trip
+state.dump()
+reloaded = MatchAnalytics.load(state.analytics_path)
+assert reloaded.to_dict() == analytics.to_dict()
+
+# flex results count for every pairing across the two sides
+flex_analytics = MatchAnalytics()
+alpha = [Player(name) for name in ('A1', 'A2', 'A3')]
+beta = [Player(name) for name in ('B1', 'B2', 'B3')]
+flex_match = match('3v3 flex', team_alpha=alpha, team_beta=beta)
+flex_match.match_map = 'Bona Dea Dunes A'
+with contextlib.redirect_stdout(io.StringIO()):
+    flex_analytics.record(flex_match, flex_match.report_match_results(beta, alpha))
+assert flex_analytics.record_between('3v3 flex', 'B2', 'A3') == (1, 0)
+assert flex_analytics.map_win_rates('3v3 flex') == [('Bona Dea Dunes A', {'C': (0.5, 6)})]
+
+# calibration recovers a well-calibrated ladder, and flags results that favour the favourite less than predicted
+def simulated(winner, loser, probability):
+    return MatchResult(0, '1v1', probability, [RatingChange(winner, True, loser, probability, ELO_K, 1000, 1000, False, 'C', 'C', False),
+                                               RatingChange(loser, False, winner, 1 - probability, ELO_K, 1000, 1000, False, 'C', 'C', False)])
+
+rng = random.Random(7)
+calibrated, overconfident = MatchAnalytics(), MatchAnalytics()
+for _ in range(4000):
+    alpha_ELO, beta_ELO = rng.randint(700, 1700), rng.randint(700, 1700)
+    probability = win_probability(alpha_ELO, beta_ELO)
+    for analytics, truth in ((calibrated, probability), (overconfident, 0.5 + (probability - 0.5) / 2)):
+        alpha_won = rng.random() < truth
+        sim = match('1v1', Player('alpha'), Player('beta'))
+        sim.match_map = 'Grid 086 A'
+        analytics.record(sim, simulated('alpha', 'beta', probability) if alpha_won else simulated('beta', 'alpha', 1 - probability))
+assert abs(calibrated.calibration_slope() - 1) < 0.15 and abs(overconfident.calibration_slope() - 0.5) < 0.15
+for analytics in (calibrated, overconfident):
+    for _, _, count, predicted, actual in analytics.calibration_curve():
+        assert 0 <= predicted <= 1 and 0 <= actual <= 1
+assert MatchAnalytics().calibration_slope() is None
+
+# the offline report renders every section
+report_text = report(calibrated)
+assert 'Map Win Rates' in report_text and 'Rating Calibration' in report_text and 'Longest Win Streaks' in report_text
+with contextlib.redirect_stdout(io.StringIO()):
+    assert main([state.data_path, '--match-type', '1v1']) == 0
+    assert main([tempfile.mkdtemp()]) == 1
+
+# a reverted result is taken back out of every total except the streaks
+retracted = MatchAnalytics()
+retracted.record(sim, simulated('alpha', 'beta', 0.7))
+retracted.retract(sim, simulated('alpha', 'beta', 0.7))
+assert retracted.record_between('1v1', 'alpha', 'beta') == (0, 0) and retracted.map_win_rates('1v1') == [] and retracted.calibration_curve() == []
@@ -62,3 +62,148 @@ test_1v1_match = match('1v1', hooli, ramenrook)
 test_1v1_match.setup_match_parameters()
 test_1v1_match.report_match_results(hooli, ramenrook)
 matches_db.add_match(test_1v1_match)
+
+# new pilots keep the starting rank until their placement matches are played #
+rookie = Player('Rookie')
+veteran = Player('Veteran')
+for _ in range(PLACEMENT_MATCHES - 1):
+    rookie.player_singles_ELO = 1300
+    rookie.update_player_stats(1, '1v1')
+assert rookie.player_singles_rank == 'C' and rookie.singles_placement_played == PLACEMENT_MATCHES - 1
+rookie.update_player_stats(1, '1v1')
+assert rookie.player_singles_rank == 'A' # placed from their ELO
+
+# placed pilots are promoted at the promotion ELO and only demoted below the demotion ELO #
+thresholds = RankThresholds()
+assert thresholds.transition(RANK_ORDINALS['B'], 949) == RANK_ORDINALS['B'] # hysteresis: still B just under the B minimum
+assert thresholds.transition(RANK_ORDINALS['B'], 899) == RANK_ORDINALS['C']
+assert thresholds.transition(RANK_ORDINALS['C'], 1260) == RANK_ORDINALS['A'] # big swings cross several ranks
+try:
+    RankThresholds(promotion=[700, 880, 1250, 1500, 1700, None]) # C would promote below the B demotion ELO
+    assert False, 'inconsistent thresholds should be refused'
+except ValueError:
+    pass
+
+# rerank_ladder re-ranks every pilot on every ladder, a reset places everyone from ELO alone #
+veteran.singles_placement_played = PLACEMENT_MATCHES
+veteran.player_singles_rank, veteran.player_singles_ELO = 'B', 930
+ladder, team_ladder = players_db(), teams_db(players_db())
+ladder.add_players([veteran, Player('Unplaced')])
+assert rerank_ladder(ladder, team_ladder) == 0 # 930 is above the B demotion ELO
+assert rerank_ladder(ladder, team_ladder, reset=True) == 1 and veteran.player_singles_rank == 'C'
+assert RankThresholds.from_settings(thresholds.to_settings()).demotion == thresholds.demotion
+
+# a reported result explains itself: expected scores, K, before and after, clamping and rank changes #
+favourite, underdog = Player('Favourite'), Player('Underdog')
+favourite.player_singles_ELO, underdog.player_singles_ELO = 1400, 1000
+upset = match('1v1', favourite, underdog)
+result = upset.report_match_results(underdog, favourite)
+gain, loss = result.change('Underdog'), result.change('Favourite')
+assert result.win_probability == gain.expected < 0.1 and gain.expected + loss.expected == 1
+assert (gain.won, gain.opponent, gain.K, gain.ELO_before) == (True, 'Favourite', ELO_K, 1000)
+assert gain.delta == round(ELO_K * (1 - gain.expected)) and gain.ELO_after == underdog.player_singles_ELO
+assert (underdog.player_singles_ELO, favourite.player_singles_ELO) == ELO_formula(1000, 1400, 1)
+assert 'Underdog: 1000 -> 1027 (+27), 9% chance to win against Favourite' in result.explain()
+ceiling, ceiling_rival, floor, floor_rival = Player('Ceiling'), Player('Ceiling Rival'), Player('Floor'), Player('Floor Rival')
+ceiling.player_singles_ELO, ceiling_rival.player_singles_ELO = ELO_MAXIMUM, ELO_MAXIMUM
+floor.player_singles_ELO, floor_rival.player_singles_ELO = ELO_MINIMUM, ELO_MINIMUM
+top = match('1v1', ceiling, ceiling_rival).report_match_results(ceiling, ceiling_rival).change('Ceiling')
+bottom = match('1v1', floor, floor_rival).report_match_results(floor_rival, floor).change('Floor')
+assert top.clamped and top.delta == 0 and 'held at the maximum ELO' in top.explain()
+assert bottom.clamped and bottom.delta == 0 and 'held at the minimum ELO' in bottom.explain()
+flex_result = match('3v3 flex', team_alpha=team_alpha, team_beta=team_beta).report_match_results(team_beta, team_alpha)
+assert [change.name for change in flex_result.winners] == [player.player_name for player in team_beta] and len(flex_result.changes) == 6
+
+# results need agreeing reports from both sides or an admin, and a disputed or cancelled result is reverted exactly #
+import io
+import os
+import math
+import tempfile
+import contextlib
+def snapshot(*players):
+    return [(p.player_singles_ELO, p.player_singles_rank, p.singles_wins, p.singles_losses, p.singles_placement_played) for p in players]
+
+async def reporting():
+    reports = match_db()
+    alpha, beta, bystander = Player('Alpha', player_id=1), Player('Beta', player_id=2), Player('Bystander', player_id=3)
+    alpha.player_singles_ELO, beta.player_singles_ELO, bystander.player_singles_ELO = 1000, 1000, 1100
+    before = snapshot(alpha, beta)
+    disputed = match('1v1', alpha, beta)
+    disputed.setup_match_parameters()
+    reports.add_match(disputed)
+
+    assert await reports.submit_report(disputed.match_id, 'alpha', 'alpha', 'a1') == ('awaiting', None)
+    assert await reports.submit_report(disputed.match_id, 'alpha', 'alpha', 'a1') == ('duplicate', None)
+    assert snapshot(alpha, beta) == before
+    status, result = await reports.submit_report(disputed.match_id, 'beta', 'alpha', 'b1')
+    assert status == 'confirmed' and result.change('Alpha').delta == 15 and alpha.player_singles_ELO == 1015
+    assert await reports.submit_report(disputed.match_id, 'beta', 'alpha', 'b1') == ('duplicate', None)
+    assert reports.results_reported == 1
+
+    # a later match moves Alpha again; the dispute takes back only the disputed match's deltas
+    later = match('1v1', alpha, bystander)
+    later.setup_match_parameters()
+    reports.add_match(later)
+    await reports.submit_report(later.match_id, None, 'alpha', 'admin')
+    after_later = alpha.player_singles_ELO
+    status, reverted = await reports.submit_report(disputed.match_id, 'beta', 'beta', 'b2')
+    assert status == 'disputed' and reverted is result and disputed.match_status == 'disputed'
+    assert alpha.player_singles_ELO == after_later - 15 and snapshot(beta) == before[1:]
+    assert alpha.singles_wins == 1 and disputed.match_id in reports.pending_index
+
+    # an admin decides the dispute, after which players cannot reopen it
+    status, decided = await reports.submit_report(disputed.match_id, None, 'beta', 'admin')
+    assert status == 'confirmed' and decided.change('Beta').won and beta.singles_wins == 1
+    try:
+        await reports.submit_report(disputed.match_id, 'alpha', 'alpha', 'a2')
+        raise AssertionError('a player reopened a match an admin decided')
+    except ValueError:
+        pass
+
+    # cancelling both completed matches leaves every record as it was before either
+    await reports.cancel_match_async(disputed.match_id)
+    await reports.cancel_match_async(later.match_id)
+    assert snapshot(alpha, beta) == before and bystander.player_singles_ELO == 1100 and reports.matches == []
+
+with contextlib.redirect_stdout(io.StringIO()):
+    asyncio.run(reporting())
+
+# Discord IDs and preferred roles survive a dump, so players can still report their matches after a restart #
+with tempfile.TemporaryDirectory() as directory:
+    ids = players_db()
+    ids.add_players([Player('Linked', player_id=1234), Player('Unlinked')])
+    ids.get_player('Linked').set_roles(['Tank', ' artillery', 'tank', ''])
+    ids.dump_players_db(os.path.join(directory, 'players.txt'))
+    reloaded = players_db()
+    reloaded.load_players_db(os.path.join(directory, 'players.txt'))
+    assert reloaded.get_player('Linked').player_id == 1234 and reloaded.get_player('Unlinked').player_id is None
+    assert reloaded.get_player('Linked').player_roles == ('tank', 'artillery') and reloaded.get_player('Unlinked').player_roles == ()
+try:
+    Player('Unroled').set_roles(['healer'])
+    raise AssertionError('an unknown role was accepted')
+except ValueError:
+    pass
+
+# a member missing when the teams database is loaded leaves an empty slot, which rosters skip #
+missing_path = os.path.join(tempfile.mkdtemp(), 'teams.db')
+with open(missing_path, 'w') as file:
+    file.write('Shorthanded,Hooli,Departed,,1000,C,0,0,0.0,5\n')
+shorthanded_registry = teams_db(player_registry)
+shorthanded_registry.load_teams_db(missing_path)
+shorthanded = shorthanded_registry.get_team('Shorthanded')
+assert shorthanded.roster == [hooli, None, None]
+assert roster_names(shorthanded) == ['Hooli'] and roster_names(shorthanded, empty='') == ['Hooli', '', '']
+assert 'Hooli' in str(shorthanded)
+full_side = next(team_obj for team_obj in teams_registry.teams if None not in team_obj.roster)
+reg_match = match('3v3 reg', team_alpha=shorthanded, team_beta=full_side)
+assert reg_match.map_history_keys()[2:] == [('player', 'Hooli')] + [('player', name) for name in roster_names(full_side)]
+
+# ranks compare by tier, not alphabetically, and SS ranks carrying their ELO still count as SS
+assert get_rank_from_ELO(1800) == 'SS_1800' and rank_ordinal('SS_1800') > rank_ordinal('S') > rank_ordinal('A')
+assert [get_rank_from_ELO(ELO) for ELO in (100, 700, 950, 1250, 1500)] == ['D', 'C', 'B', 'A', 'S']
+
+# popped matches carry their predicted odds
+favourite, underdog = Player('Favourite'), Player('Underdog')
+favourite.player_singles_ELO, underdog.player_singles_ELO = 1100, 900
+odds, quality = match('1v1', favourite, underdog).predicted_odds()
+assert 0.75 < odds < 0.77 and math.isclose(quality, 1 - abs(2 * odds - 1))
@@ -0,0 +1,125 @@
+# test functions #
+import time
+import asyncio
+import tempfile
+from ravens_nest.elo_core import *
+from ravens_nest.guild_state import *
+
+data_root = tempfile.mkdtemp()
+guild_states = GuildStateManager(data_root, idle_timeout=0)
+
+# two guilds get independent ladders
+alpha_guild = guild_states.get(1)
+beta_guild = guild_states.get(2)
+alpha_guild.player_registry.add_players([Player('Hooli'), Player('Kraydle')])
+beta_guild.player_registry.add_player(Player('Prism'))
+assert len(alpha_guild.player_registry) == 2
+assert len(beta_guild.player_registry) == 1
+assert guild_states.get(1) is alpha_guild
+
+# a guild with players in queue is never evicted
+alpha_guild.ones_queue.enqueue_player(alpha_guild.player_registry.get_player('Hooli'))
+assert guild_states.evict_idle() == [2]
+assert 1 in guild_states and 2 not in guild_states
+
+# evicted guilds come back from disk on their next interaction
+beta_guild = guild_states.get(2)
+assert beta_guild.player_registry.get_player('Prism') is not None
+
+# completed 1v1 matches survive an eviction round trip
+alpha_guild.ones_queue.dequeue_player(alpha_guild.player_registry.get_player('Hooli'))
+test_match = match('1v1', *alpha_guild.player_registry.get_players(['Hooli', 'Kraydle']))
+test_match.setup_match_parameters()
+test_match.report_match_results(test_match.player_alpha, test_match.player_beta)
+alpha_guild.matches_db.add_match(test_match)
+guild_states.evict(1)
+alpha_guild = guild_states.get(1)
+assert alpha_guild.matches_db.get_match(test_match.match_id).match_winner == 'Hooli'
+
+# reports, disputes and applied rating changes survive a restart, so a dispute resumes and a result reverts exactly
+restart_guild = guild_states.get(7)
+ayre, walter, carla = Player('Ayre'), Player('Walter'), Player('Carla')
+restart_guild.player_registry.add_players([ayre, walter, carla])
+carla_start = carla.player_singles_ELO
+disputed, confirmed = match('1v1', ayre, walter), match('1v1', walter, carla)
+for played in (disputed, confirmed):
+    played.setup_match_parameters()
+    restart_guild.matches_db.add_match(played)
+async def report(matches_db):
+    await matches_db.submit_report(disputed.match_id, 'alpha', 'alpha', 'a1')
+    await matches_db.submit_report(disputed.match_id, 'beta', 'beta', 'b1')
+    await matches_db.submit_report(confirmed.match_id, 'alpha', 'alpha', 'a1')
+    return (await matches_db.submit_report(confirmed.match_id, 'beta', 'alpha', 'b1'))[1]
+applied = asyncio.run(report(restart_guild.matches_db))
+guild_states.dump_all()
+restarted = GuildStateManager(data_root).get(7)
+reloaded = restarted.matches_db.get_match(disputed.match_id)
+assert reloaded.match_status == 'disputed' and reloaded.reports == {'alpha': 'alpha', 'beta': 'beta'}
+assert reloaded.player_alpha is restarted.player_registry.get_player('Ayre')
+assert disputed.match_id in restarted.matches_db.pending_index and confirmed.match_id not in restarted.matches_db.pending_index
+async def settle(matches_db):
+    assert await matches_db.submit_report(disputed.match_id, 'alpha', 'alpha', 'a1') == ('duplicate', None)
+    status, result = await matches_db.submit_report(disputed.match_id, 'beta', 'alpha', 'b2')
+    assert status == 'confirmed' and result.change('Ayre').won
+    return await matches_db.cancel_match_async(confirmed.match_id)
+assert asyncio.run(settle(restarted.matches_db)) == applied
+restarted_carla = restarted.player_registry.get_player('Carla')
+assert restarted_carla.player_singles_ELO == carla_start and restarted_carla.singles_losses == 0
+
+# the exclusive policy keeps a player in one queue at a time
+hooli = alpha_guild.player_registry.get_player('Hooli')
+kraydle = alpha_guild.player_registry.get_player('Kraydle')
+alpha_guild.ones_queue.enqueue_player(hooli)
+try:
+    alpha_guild.threes_flex_queue.enqueue_player(hooli)
+    raise AssertionError('exclusive policy let a player into two queues')
+except ValueError:
+    pass
+
+# the multi policy withdraws players from their other queues when a match pops
+alpha_guild.set_queue_policy('multi')
+alpha_guild.threes_flex_queue.enqueue_player(hooli)
+assert sorted(alpha_guild.queue_membership.queues_for('Hooli')) == ['1v1', '3v3 flex']
+alpha_guild.ones_queue.enqueue_player(kraydle)
+assert alpha_guild.ones_queue.get_valid_match_from_queue() is not None
+assert 'Hooli' not in alpha_guild.queue_membership
+assert len(alpha_guild.threes_flex_queue) == 0
+
+# decayed pop counts recover a steady pop rate, and only inside the bands that popped
+stats = QueueStats(started=0.0)
+for second in range(0, 3 * 3600, 10):
+    stats.record_pop(1040, now=second)
+assert abs(stats.rate(800, 1300, now=3 * 3600) - 0.1) < 0.01 and stats.rate(1500, 1700, now=3 * 3600) == 0.0
+assert stats.rate(800, 1300, now=10 * 3600) < stats.rate(800, 1300, now=3 * 3600) / 8 # nothing popped for hours
+
+# positions and entries ahead in the ELO window match a scan of the queue, and are indexed once per change
+queue = alpha_guild.threes_flex_queue
+ELOs = [900, 1400, 1000, 1100, 1600, 1200, 1000]
+waiting = [Player(f'Waiting{i}') for i in range(len(ELOs))]
+for player, ELO in zip(waiting, ELOs):
+    player.player_teams_ELO = ELO
+    queue.enqueue_player(player)
+assert queue.status('Waiting0').eta is None # nothing has popped around 900 yet
+for i, ELO in enumerate(ELOs):
+    status = queue.status(f'Waiting{i}')
+    assert status.position == i + 1 and status.queue_length == len(ELOs) and (status.ELO_low, status.ELO_high) == (ELO - MAX_ELO_DIFF, ELO + MAX_ELO_DIFF)
+    assert status.ahead == sum(abs(earlier - ELO) <= MAX_ELO_DIFF for earlier in ELOs[:i])
+index = queue._positions
+queue.status('Waiting3')
+assert queue._positions is index and queue.status('Hooli') is None
+
+deep = tuple(QueueEntrySnapshot(f'Deep{i}', 700 + 50 * (i * 7 % 23), 1, False, None) for i in range(400))
+positions = MatchQueue._index_positions(deep)
+assert all(positions[entry.name] == (i + 1, sum(abs(earlier.ELO - entry.ELO) <= MAX_ELO_DIFF for earlier in deep[:i])) for i, entry in enumerate(deep))
+
+# pops feed the estimate, and the statistics survive an eviction round trip
+queue.stats = QueueStats(started=time.time() - 3600)
+for _ in range(12):
+    queue.stats.record_pop(1000)
+now = time.time()
+status = queue.status('Waiting6', now)
+assert status.eta == (status.ahead + 1) / queue.stats.rate(status.ELO_low, status.ELO_high, now)
+saved = queue.stats.to_dict()
+queue.dequeue_players([player.player_name for player in waiting])
+guild_states.evict(1)
+assert guild_states.get(1).threes_flex_queue.stats.to_dict() == saved
@@ -0,0 +1,223 @@
+# test functions #
+import io
+import time
+import random
+import asyncio
+import tempfile
+import contextlib
+from ravens_nest.elo_core import *
+from ravens_nest.guild_state import *
+from ravens_nest.leaderboards import *
+from ravens_nest.metrics import MetricsRegistry
+
+
+class FakeHTTPError(Exception):
+    def __init__(self, status):
+        super().__init__(f'HTTP {status}')
+        self.status = status
+
+class FakeMessage:
+    def __init__(self, channel, message_id, embeds):
+        self.channel, self.id, self.embeds, self.pinned = channel, message_id, embeds, False
+
+    @property
+    def content(self):
+        return '\n'.join(self.embeds)
+
+    async def edit(self, embeds):
+        if self.channel.fail_with is not None:
+            raise FakeHTTPError(self.channel.fail_with)
+        if self.id not in self.channel.messages:
+            raise FakeHTTPError(404)
+        self.channel.messages[self.id].embeds = embeds
+        self.channel.edits += 1
+        return self.channel.messages[self.id]
+
+    async def pin(self):
+        self.pinned = True
+
+class FakeChannel:
+    def __init__(self):
+        self.messages, self.sends, self.edits, self.fail_with = {}, 0, 0, None
+
+    async def send(self, embeds):
+        message = FakeMessage(self, 100 + self.sends, embeds)
+        self.messages[message.id] = message
+        self.sends += 1
+        return message
+
+    def get_partial_message(self, message_id):
+        return FakeMessage(self, message_id, None)
+
+
+guild_states = GuildStateManager(tempfile.mkdtemp())
+state = guild_states.get(1)
+hooli, kraydle, cicada = Player('Hooli'), Player('Kraydle'), Player('Cicada')
+hooli.player_singles_ELO, kraydle.player_singles_ELO, cicada.player_singles_ELO = 1300, 900, 1100
+state.player_registry.add_players([hooli, kraydle, cicada])
+
+# renders are ordered by ELO with medals, and the top-N selection matches a full sort
+solo = render_leaderboard('solo_leaderboard', state.player_registry, state.teams_registry)
+assert solo.index('🥇') < solo.index('Hooli') < solo.index('🥈') < solo.index('Cicada') < solo.index('🥉') < solo.index('Kraydle')
+assert state.player_registry.get_top_singles_players(2) == [hooli, cicada]
+
+# the cache renders each leaderboard once per change in the standings
+publisher = LeaderboardPublisher(registry=MetricsRegistry())
+for _ in range(5):
+    assert publisher.leaderboard(state, 'solo_leaderboard') == solo
+assert publisher.renders.value == 1
+with contextlib.redirect_stdout(io.StringIO()):
+    played = match('1v1', hooli, kraydle)
+    played.setup_match_parameters()
+    state.matches_db.add_match(played)
+    state.matches_db.update_match(played.match_id, kraydle, hooli)
+assert publisher.leaderboard(state, 'solo_leaderboard') != solo and publisher.renders.value == 2
+
+channel = FakeChannel()
+channels = {42: channel}
+async def resolve(channel_id):
+    return channels[channel_id]
+
+async def scenario():
+    # nothing is published until a channel is set
+    assert await publisher.publish_due(guild_states, resolve) == 0
+    state.set_leaderboard_channel(42)
+
+    # the first publish sends and pins one message, later changes edit it in place
+    assert await publisher.publish_due(guild_states, resolve) == 1
+    message_id = state.settings['leaderboard_message']
+    assert channel.sends == 1 and channel.messages[message_id].pinned
+    assert all(title in channel.messages[message_id].content for title, *_ in LEADERBOARDS.values())
+
+    # unchanged standings are never republished, changed ones wait for the interval
+    publisher.last_published[1] -= state.settings['leaderboard_interval']
+    assert await publisher.publish_due(guild_states, resolve) == 0
+    publisher.last_published[1] = time.monotonic()
+    state.player_registry.add_player(Player('Sabbath'))
+    assert await publisher.publish_due(guild_states, resolve) == 0
+    publisher.last_published[1] -= state.settings['leaderboard_interval']
+    assert await publisher.publish_due(guild_states, resolve) == 1
+    assert channel.sends == 1 and channel.edits == 1 and 'Sabbath' in channel.messages[message_id].content
+
+    # an error is logged and retried on the next tick, a deleted message is replaced
+    state.player_registry.remove_player('Sabbath')
+    publisher.last_published[1] -= state.settings['leaderboard_interval']
+    channel.fail_with = 503
+    with contextlib.redirect_stdout(io.StringIO()) as log:
+        assert await publisher.publish_due(guild_states, resolve) == 0
+    assert 'HTTP 503' in log.getvalue()
+    channel.fail_with = None
+    del channel.messages[message_id]
+    assert await publisher.publish_due(guild_states, resolve) == 1
+    assert channel.sends == 2 and state.settings['leaderboard_message'] != message_id
+    assert 'Sabbath' not in channel.messages[state.settings['leaderboard_message']].content
+
+asyncio.run(scenario())
+
+# every board of a full ladder with long names fits in one embed, and all of them in one message
+crowded = GuildStateManager(tempfile.mkdtemp()).get(2)
+pilots = [Player(f'Pilot_With_A_Long_Name_{i:02d}') for i in range(30)]
+crowded.player_registry.add_players(pilots)
+for i in range(10):
+    crowded.teams_registry.add_team(team(f'Team_With_A_Long_Name_{i}', pilots[3 * i:3 * i + 3]))
+embeds = LeaderboardPublisher(registry=MetricsRegistry()).standings(crowded)
+assert len(embeds) == 3 and max(map(len, embeds)) < 4096 and sum(map(len, embeds)) < 6000
+
+# channel settings are validated and persisted, and a new channel gets a new message
+state.set_leaderboard_channel(43, interval=600)
+assert state.settings['leaderboard_message'] is None and state.settings['leaderboard_interval'] == 600
+try:
+    state.set_leaderboard_channel(43, interval=5)
+    raise AssertionError('an interval under a minute was accepted')
+except ValueError:
+    pass
+state.dump()
+reloaded = GuildStateManager(guild_states.data_root).get(1)
+assert reloaded.settings['leaderboard_channel'] == 43 and reloaded.settings['leaderboard_interval'] == 600
+
+# ladder pages match a full sort under every filter, and cursors page through without gaps or repeats
+ladder_state = GuildStateManager(tempfile.mkdtemp()).get(3)
+rng = random.Random(3)
+roster = [Player(f'P{i:03d}', rng.choice(['Ravens', 'Redguns', None])) for i in range(137)]
+for pilot in roster:
+    pilot.player_singles_ELO = rng.choice([700, 900, 1000, 1200, 1500, 1700])
+    pilot.player_singles_rank = rng.choice(RANKS)
+ladder_state.player_registry.add_players(roster)
+index = LadderIndex('1v1', ladder_state.player_registry, ladder_state.teams_registry)
+for rank, team_name in ((None, None), ('C', None), (None, 'Ravens'), ('C', 'Redguns')):
+    expected = sorted((p for p in roster if (rank is None or p.player_singles_rank == rank) and (team_name is None or p.player_team == team_name)),
+                      key=lambda p: (-p.player_singles_ELO, p.player_name))
+    seen, page = [], index.page(size=7, rank=rank, team_name=team_name)
+    while True:
+        assert page.total == len(expected) and [position for position, _ in page.entries] == list(range(len(seen) + 1, len(seen) + len(page.entries) + 1))
+        seen += [entry for _, entry in page.entries]
+        if not page.has_next:
+            break
+        page = index.page(size=7, after=ladder_cursor('1v1', page.last), rank=rank, team_name=team_name)
+    assert seen == expected
+    while page.has_previous:
+        page = index.page(size=7, before=ladder_cursor('1v1', page.first), rank=rank, team_name=team_name)
+        assert [entry for _, entry in page.entries] == expected[page.entries[0][0] - 1:page.entries[-1][0]]
+    assert page.entries[0][0] == 1 or not expected
+
+# a search starts the page at the entry, and misses outside the filter
+target = index.page(size=200).entries[50][1]
+target_rank = target.player_singles_rank # before the season reset re-ranks the ladder
+assert index.page(at=target.player_name).entries[0] == (51, target)
+assert index.page(at=target.player_name, rank=next(r for r in RANKS if r != target_rank)).entries == []
+
+# archived seasons answer the same pages from their keyset queries
+ladder_state.reset_season(compression=0.0)
+archive, _ = ladder_state.season_registries(1)
+for kwargs in ({}, {'rank': 'C'}, {'team_name': 'Ravens'}, {'at': target.player_name},
+               {'after': ladder_cursor('1v1', target)}, {'before': ladder_cursor('1v1', target), 'rank': target_rank}):
+    live, archived = index.page(**kwargs), archive.ladder_page('1v1', **kwargs)
+    assert [(position, entry.player_name, entry.player_singles_ELO) for position, entry in live.entries] == \
+           [(position, entry.player_name, entry.player_singles_ELO) for position, entry in archived.entries]
+    assert (live.total, live.has_previous, live.has_next) == (archived.total, archived.has_previous, archived.has_next)
+
+# filters are validated, and pages render with their positions
+for ladder, rank, team_name in (('2v2', None, None), ('1v1', 'Z', None), ('3v3 reg', None, 'Ravens')):
+    try:
+        check_ladder_filters(ladder, rank, team_name)
+        raise AssertionError(f'invalid filters {ladder} {rank} {team_name} accepted')
+    except ValueError:
+        pass
+assert '(1-10 of 137)' in render_ladder_page('1v1', index.page())
+
+# SS ranks are stored with their ELO, and still filter as one SS tier, live and archived
+tiers_state = GuildStateManager(tempfile.mkdtemp()).get(4)
+elite = [Player(name) for name in ('Ayre', 'Walter', 'Carla')]
+for pilot, ELO, rank in zip(elite, (1800, 1750, 1600), ('SS_1800', 'SS_1750', 'S')):
+    pilot.player_singles_ELO, pilot.player_singles_rank = ELO, rank
+tiers_state.player_registry.add_players(elite)
+tiers = LadderIndex('1v1', tiers_state.player_registry, tiers_state.teams_registry)
+assert [entry.player_name for _, entry in tiers.page(rank='SS').entries] == ['Ayre', 'Walter']
+assert [entry.player_name for _, entry in tiers.page(rank='S').entries] == ['Carla']
+tiers_state.reset_season(compression=0.0)
+tiers_archive, _ = tiers_state.season_registries(1)
+assert [entry.player_name for _, entry in tiers_archive.ladder_page('1v1', rank='SS').entries] == ['Ayre', 'Walter']
+assert [entry.player_name for _, entry in tiers_archive.ladder_page('1v1', rank='S').entries] == ['Carla']
+
+# a threshold change re-ranks the ladder, and cached rank views and leaderboards follow it
+rerank_state = GuildStateManager(tempfile.mkdtemp()).get(5)
+boundary = Player('Boundary')
+boundary.singles_placement_played, boundary.player_singles_rank, boundary.player_singles_ELO = PLACEMENT_MATCHES, 'B', 930
+rerank_state.player_registry.add_player(boundary)
+rerank_publisher = LeaderboardPublisher(registry=MetricsRegistry())
+assert [entry.player_name for _, entry in rerank_publisher.ladder_index(rerank_state, '1v1').page(rank='B').entries] == ['Boundary']
+rerank_publisher.leaderboard(rerank_state, 'solo_leaderboard')
+assert rerank_publisher.renders.value == 1
+version = standings_version(rerank_state)
+assert rerank_state.set_rank_threshold('B', 'demotion', 940) == 1 and standings_version(rerank_state) != version
+assert rerank_publisher.ladder_index(rerank_state, '1v1').page(rank='B').entries == []
+assert [entry.player_name for _, entry in rerank_publisher.ladder_index(rerank_state, '1v1').page(rank='C').entries] == ['Boundary']
+rerank_publisher.leaderboard(rerank_state, 'solo_leaderboard')
+assert rerank_publisher.renders.value == 2 # the standings key moved on, so the pinned message is refreshed too
+
+# teams with an empty roster slot render on the 3v3 leaderboard
+shorthanded_state = GuildStateManager(tempfile.mkdtemp()).get(6)
+lone = Player('Lone')
+shorthanded_state.player_registry.add_player(lone)
+shorthanded_state.teams_registry.add_team(team('Shorthanded', [lone, None, None]))
+assert "Shorthanded ['Lone']" in render_leaderboard('reg_teams_leaderboard', shorthanded_state.player_registry, shorthanded_state.teams_registry)
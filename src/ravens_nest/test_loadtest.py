@@ -0,0 +1,38 @@
+# test functions #
+import asyncio
+import ravens_nest.discord_frontend as frontend
+from ravens_nest.loadtest import *
+
+# importing the frontend registers the commands without starting the bot
+assert frontend.client.is_closed() is False and frontend.tree.get_command('solo_queue') is not None
+
+# the real handlers run against fake interactions across several guilds
+load_test, wall_seconds = asyncio.run(run_load_test(num_guilds=2, num_players=60, num_commands=400, concurrency=20))
+assert not load_test.errors, load_test.errors
+assert load_test.unacknowledged == 0
+assert sum(len(samples) for samples in load_test.handler_seconds.values()) == 400
+assert len(frontend.guild_states) == 2
+assert all(len(frontend.guild_states.get(guild.id).player_registry.players) == 60 for guild in load_test.guilds)
+assert 'report_match_results' in load_test.handler_seconds # matches popped and were reported
+
+# a second response to the same interaction is refused, as Discord does
+interaction = load_test.interaction(load_test.guilds[0])
+asyncio.run(interaction.response.send_message('first'))
+try:
+    asyncio.run(interaction.response.send_message('second'))
+    assert False, 'second response should have been refused'
+except discord.InteractionResponded:
+    pass
+
+# a 3v3 reg team with an empty roster slot is announced without it
+lone, rivals = frontend.Player('Lone'), [frontend.Player(f'Rival {i}') for i in range(3)]
+reg_match = frontend.match('3v3 reg', team_alpha=frontend.team('Shorthanded', [lone, None, None]), team_beta=frontend.team('Rivals', rivals))
+reg_match.setup_match_parameters()
+assert frontend.match_sides(reg_match) == ([lone], rivals)
+async def announce():
+    frontend.notifier = NotificationQueue()
+    interaction = load_test.interaction(load_test.guilds[0])
+    frontend.announce_match(interaction, reg_match)
+    await frontend.notifier.join()
+    return interaction.channel.messages[-1]
+assert f"`{reg_match.match_id}`" in asyncio.run(announce())
@@ -0,0 +1,38 @@
+# test functions #
+import time
+import asyncio
+from datetime import datetime, timedelta, timezone
+from ravens_nest.metrics import *
+from ravens_nest.loop_monitor import *
+
+def blocking_matchmaking_scan():
+    time.sleep(0.4)
+
+async def run_monitor(monitor):
+    monitor.start()
+    await asyncio.sleep(0.1)
+    blocking_matchmaking_scan() # holds the loop like a synchronous handler would
+    await asyncio.sleep(0.2)
+    monitor.stop()
+
+# a callback holding the loop past the threshold is measured, counted and its stack dumped
+registry = MetricsRegistry()
+monitor = LoopLagMonitor(threshold=0.1, interval=0.02, registry=registry)
+asyncio.run(run_monitor(monitor))
+assert monitor.stall_count.value == 1
+assert 'blocking_matchmaking_scan' in monitor.stalls[-1][1]
+assert monitor.lag_seconds.quantile(1.0) >= 0.25
+
+# interactions reaching the handler after the acknowledgement deadline are counted as late
+class FakeInteraction:
+    def __init__(self, age):
+        self.created_at = datetime.now(timezone.utc) - timedelta(seconds=age)
+
+@instrument_command
+async def late_command(interaction):
+    return True
+
+assert asyncio.run(late_command(FakeInteraction(0.1)))
+assert asyncio.run(late_command(FakeInteraction(5)))
+late = METRICS.counter('ravens_nest_late_interactions_total', command='late_command')
+assert late.value == 1
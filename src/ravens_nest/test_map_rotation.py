@@ -0,0 +1,63 @@
+# test functions #
+import random
+import tempfile
+from collections import Counter
+from ravens_nest.elo_core import *
+from ravens_nest.map_rotation import *
+from ravens_nest.guild_state import *
+
+# a map weighs less for every recent play by anyone in the match, and histories are bounded
+rotation = MapRotation(rng=random.Random(0))
+hooli, kraydle = Player('Hooli'), Player('Kraydle')
+for _ in range(20):
+    ones_match = match('1v1', hooli, kraydle)
+    ones_match.setup_match_parameters(rotation)
+    assert ones_match.match_map in APPROVED_1S_MAPS
+assert len(rotation.recent[('player', 'Hooli')]) == MAP_HISTORY
+maps, weights = rotation.weights('1v1', [('player', 'Hooli'), ('player', 'Kraydle')])
+recent = Counter(rotation.recent[('player', 'Hooli')]) + Counter(rotation.recent[('player', 'Kraydle')])
+assert weights == [REPEAT_PENALTY ** recent[name] for name in maps]
+
+# the same pair replays the map it just played far less often than a uniform draw would
+rotation = MapRotation(rng=random.Random(1))
+repeats = 0
+for _ in range(500):
+    ones_match = match('1v1', hooli, kraydle)
+    previous = rotation.recent.get(('player', 'Hooli'), [None])[-1]
+    ones_match.setup_match_parameters(rotation)
+    repeats += ones_match.match_map == previous
+assert repeats < 0.6 * 500 / len(APPROVED_1S_MAPS) # well under the uniform draw
+
+# 3v3 reg matches remember maps for the teams and their rosters, and draw from the 3v3 pool
+roster_alpha = [Player(name) for name in ('Prism', 'Hai_Yena', 'Cicada')]
+roster_beta = [Player(name) for name in ('Sabbath', 'Neer_do_well', 'Basterisk')]
+reg_match = match('3v3 reg', team_alpha=team('team2', roster_alpha), team_beta=team('team1', roster_beta))
+reg_match.setup_match_parameters(rotation)
+assert reg_match.match_map in APPROVED_3S_MAPS and ('team', 'team2') in rotation.recent and ('player', 'Cicada') in rotation.recent
+
+# pools are validated
+for kind, pool in (('2v2', ['Grid 086 A']), ('1v1', []), ('1v1', ['Grid 086 A', 'Grid 086 A'])):
+    try:
+        rotation.set_pool(kind, pool)
+        raise AssertionError(f'invalid pool {kind} {pool} accepted')
+    except ValueError:
+        pass
+
+# per-season pools are inherited by later seasons and changed at runtime
+assert season_map_pools({'2': {'1v1': ['Grid 086 A']}}, 1) == DEFAULT_MAP_POOLS
+assert season_map_pools({'2': {'1v1': ['Grid 086 A']}}, 3)['1v1'] == ['Grid 086 A']
+state = GuildStateManager(tempfile.mkdtemp()).get(1)
+state.set_map_pool('1v1', ['Grid 086 A', ' Xylem, the Floating City '])
+assert state.map_rotation.pools['1v1'] == ['Grid 086 A', 'Xylem, the Floating City']
+state.set_map_pool('3v3', ['Bona Dea Dunes A'], season=2)
+assert state.map_rotation.pools['3v3'] == APPROVED_3S_MAPS # season 2 has not started yet
+state.reset_season()
+assert state.map_rotation.pools == {'1v1': ['Grid 086 A', 'Xylem, the Floating City'], '3v3': ['Bona Dea Dunes A']}
+try:
+    state.set_map_pool('1v1', ['Grid 086 A'], season=1)
+    raise AssertionError('the pool of an ended season was changed')
+except ValueError:
+    pass
+
+# other guilds keep the default pools
+assert GuildStateManager(tempfile.mkdtemp()).get(2).settings['map_pools'] == {}
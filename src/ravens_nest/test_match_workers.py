@@ -0,0 +1,66 @@
+# test functions #
+import asyncio
+from ravens_nest.elo_core import *
+from ravens_nest.player_queue import *
+from ravens_nest.match_workers import *
+
+# set up databases #
+player_registry = players_db()
+teams_registry = teams_db(player_registry)
+hooli = Player('Hooli')
+kraydle = Player('Kraydle')
+fish = Player('Fish')
+fish.player_singles_ELO = 1500 # too far from everyone else to be matched
+player_registry.add_players([hooli, kraydle, fish])
+
+# a queue with no valid match returns None instead of spinning forever
+ones_queue = MatchQueue('1v1', player_registry, teams_registry)
+ones_queue.enqueue_player(hooli)
+ones_queue.enqueue_player(fish)
+assert ones_queue.get_valid_match_from_queue() is None
+
+# worker processes and the inline fallback make the same decision
+ones_queue.enqueue_player(kraydle)
+inline_pool = MatchmakingPool(inline=True)
+process_pool = MatchmakingPool(max_workers=1)
+snapshot = ones_queue.snapshot()
+inline_decision = asyncio.run(inline_pool.search('1v1', snapshot))
+process_decision = asyncio.run(process_pool.search('1v1', snapshot))
+process_pool.shutdown()
+assert inline_decision == process_decision == (['Hooli'], ['Kraydle'])
+
+# a stale decision is dropped once one of its players leaves the queue
+ones_queue.dequeue_player(kraydle)
+assert ones_queue.apply_match_decision(inline_decision) is None
+assert len(ones_queue) == 2
+
+# applying a fresh decision pops the players from the queue
+ones_queue.enqueue_player(kraydle)
+test_match = asyncio.run(inline_pool.find_match(ones_queue))
+assert test_match.player_alpha is hooli and test_match.player_beta is kraydle
+assert list(ones_queue.queued_players) == ['Fish']
+
+# two searches racing on the same snapshot never double-book a player
+async def race_for_match():
+    queue = MatchQueue('1v1', player_registry, teams_registry)
+    await queue.enqueue_player_async(hooli)
+    await queue.enqueue_player_async(kraydle)
+    return await asyncio.gather(inline_pool.find_match(queue), process_pool.find_match(queue))
+process_pool = MatchmakingPool(max_workers=1)
+race_results = asyncio.run(race_for_match())
+process_pool.shutdown()
+assert sum(result is not None for result in race_results) == 1
+
+# repeated reports of the same match are applied exactly once
+async def report_twice(match_id):
+    matches_db = match_db()
+    await matches_db.add_match_async(test_match)
+    await matches_db.report_match_async(match_id, hooli, kraydle)
+    try:
+        await matches_db.report_match_async(match_id, hooli, kraydle)
+    except ValueError:
+        return True
+    return False
+test_match.setup_match_parameters()
+assert asyncio.run(report_twice(test_match.match_id))
+assert hooli.singles_wins == 1
@@ -0,0 +1,112 @@
+# test functions #
+import math
+import random
+from ravens_nest.elo_core import RANK_ORDINALS
+from ravens_nest.matchmaking import *
+from ravens_nest.matchmaking import _rank_buckets, _rank_window
+
+B, A, S, C = RANK_ORDINALS['B'], RANK_ORDINALS['A'], RANK_ORDINALS['S'], RANK_ORDINALS['C']
+rng = random.Random(3)
+
+def entry(name, ELO=1000, rank=C, restricted=False, party_id=None, enqueued_at=0.0, roles=()):
+    return QueueEntrySnapshot(name, ELO, rank, restricted, party_id, enqueued_at, tuple(roles))
+
+# a rank restricted entry only plays its own rank or higher
+restricted, lower, higher = entry('Restricted', 1249, B, True), entry('Lower', 1240), entry('Higher', 1300, A)
+assert find_head_to_head((restricted, lower, higher), 250) == (['Restricted'], ['Higher'])
+assert find_head_to_head((restricted, lower), 250) is None
+assert find_head_to_head((higher, entry('Restricted S', 1500, S, True)), 250) is None
+
+# a restricted entry only searches the buckets of its rank and above, the lower buckets are never read
+class CountingList(list):
+    reads = 0
+    def __getitem__(self, index):
+        CountingList.reads += 1
+        return super().__getitem__(index)
+ranked = [entry(f'r{i}', 1000 + i, i % 3) for i in range(30)]
+buckets = _rank_buckets([e.rank for e in ranked], [e.ELO for e in ranked])
+buckets[0] = (CountingList(buckets[0][0]), CountingList(buckets[0][1]))
+window = _rank_window(buckets, C, 1010, 250)
+assert CountingList.reads == 0 and window == [i for i in range(30) if i % 3 >= C]
+assert _rank_window(buckets, -1, 1010, 250) == list(range(30))
+
+# candidates are scored: the fairest pairing in the window wins, not the first one in queue order
+assert find_head_to_head((entry('First'), entry('Near', 1100), entry('Exact')), 250, now=0.0) == (['First'], ['Exact'])
+assert match_quality(win_probability(1000, 1000)) == 1.0 > match_quality(win_probability(1000, 1100)) > match_quality(win_probability(1000, 1100), 200)
+
+# a long wait outweighs a small ELO gap, so the queue does not starve its oldest entries
+entries = (entry('Waiting'), entry('Fresh', 1050, enqueued_at=600.0), entry('Twin', 1050, enqueued_at=600.0))
+assert find_head_to_head(entries, 250, now=600.0) == (['Waiting'], ['Fresh'])
+assert find_head_to_head(entries, 250, now=600.0, budget=0.0) == (['Waiting'], ['Fresh'])
+
+# scoring a column of candidates agrees with the quality and wait bonus of each one
+alphas, betas = [rng.randint(600, 1800) for _ in range(100)], [rng.randint(600, 1800) for _ in range(100)]
+spreads, waits = [rng.randint(0, 300) for _ in range(100)], [rng.uniform(0, 600) for _ in range(100)]
+for score, alpha, beta, spread, wait in zip(score_candidates(alphas, betas, spreads, waits), alphas, betas, spreads, waits):
+    assert math.isclose(score, match_quality(win_probability(alpha, beta), spread) + WAIT_WEIGHT * min(wait / WAIT_HORIZON, 1.0))
+
+# every decision stays inside the ELO window and respects rank restrictions, even with no budget
+for _ in range(200):
+    entries = tuple(entry(f'p{i}', rng.randint(600, 1800), rng.randint(0, 5), rng.random() < 0.3, enqueued_at=rng.uniform(0, 600))
+                    for i in range(rng.randint(2, 30)))
+    by_name = {e.name: e for e in entries}
+    decision = find_head_to_head(entries, 250, now=600.0, budget=rng.choice([0.0, MATCH_SEARCH_BUDGET]))
+    possible = any(abs(a.ELO - b.ELO) <= 250 and (not a.rank_restriction or b.rank >= a.rank) and (not b.rank_restriction or a.rank >= b.rank)
+                   for i, a in enumerate(entries) for b in entries[i+1:])
+    assert (decision is not None) == possible
+    if decision:
+        alpha, beta = by_name[decision[0][0]], by_name[decision[1][0]]
+        assert abs(alpha.ELO - beta.ELO) <= 250 and (not alpha.rank_restriction or beta.rank >= alpha.rank) and (not beta.rank_restriction or alpha.rank >= beta.rank)
+
+# the flex search scores team pairings too, keeping parties together and preferring even, tight teams
+party = [entry(name, party_id='party') for name in ('P1', 'P2', 'P3')]
+solos = [entry(name, ELO) for name, ELO in (('Wide', 750), ('S1', 1000), ('S2', 1000), ('S3', 1000), ('Top', 1250))]
+alpha, beta = find_3v3_flex(tuple(party + solos), 250, now=0.0)
+assert sorted(alpha) == ['P1', 'P2', 'P3'] and sorted(beta) == ['S1', 'S2', 'S3']
+
+# parties of every size are packed into teams whole: a duo takes a solo player, never half of another duo
+entries = (entry('D1a', party_id='duo1'), entry('D1b', party_id='duo1'), entry('D2a', party_id='duo2'), entry('D2b', party_id='duo2'),
+           entry('Solo1'), entry('Solo2'))
+alpha, beta = find_3v3_flex(entries, 250, now=0.0)
+assert sorted(sorted(alpha) + sorted(beta)) == sorted(e.name for e in entries)
+assert all(len({name[:2] for name in side if name.startswith('D')}) == 1 for side in (alpha, beta))
+assert find_3v3_flex(tuple(entry(f'D{i}{member}', party_id=f'duo{i}') for i in range(4) for member in 'ab'), 250, now=0.0) is None
+
+# a deep queue of mixed parties packs in linear time, and no decision ever splits a party
+for _ in range(50):
+    groups, size = [], rng.randint(6, 60)
+    while sum(len(members) for members in groups) < size:
+        party_size = rng.choice([1, 1, 2, 3])
+        party_id = None if party_size == 1 else len(groups)
+        groups.append([entry(f'p{len(groups)}_{i}', rng.randint(800, 1400), party_id=party_id) for i in range(party_size)])
+    entries = tuple(e for members in groups for e in members)
+    assert len(pack_flex_teams(entries)) <= len(groups) * (1 + FILL_CANDIDATES + FILL_CANDIDATES * (FILL_CANDIDATES - 1) // 2)
+    decision = find_3v3_flex(entries, 250, now=0.0)
+    if decision:
+        sides = [set(side) for side in decision]
+        assert all(len(side) == 3 for side in sides) and sides[0].isdisjoint(sides[1])
+        for members in groups:
+            names = {e.name for e in members}
+            assert any(names <= side for side in sides) or not any(names & side for side in sides)
+
+# flex teams must be able to field ROLE_COVERAGE roles; a pilot without roles fills any
+assert role_coverage((entry('a', roles=['artillery']), entry('b', roles=['artillery']), entry('c', roles=['artillery']))) == 1
+assert role_coverage((entry('a', roles=['artillery']), entry('b', roles=['artillery', 'tank']), entry('c'))) == 3
+snipers = tuple(entry(f'r{i}', 1000 + i, roles=['artillery']) for i in range(6))
+assert pack_flex_teams(snipers, now=0.0) == [] and find_3v3_flex(snipers, 250, now=0.0) is None
+mixed = tuple(entry(f'r{i}', 1000 + i, roles=roles) for i, roles in
+              enumerate([['artillery']] * 4 + [['brawler'], ['tank'], ['artillery', 'brawler']]))
+alpha, beta = find_3v3_flex(mixed, 250, now=0.0)
+by_name = {e.name: e for e in mixed}
+assert all(role_coverage(tuple(by_name[name] for name in side)) >= ROLE_COVERAGE for side in (alpha, beta))
+
+# full parties and entries that waited past ROLE_WAIT_LIMIT are teamed regardless of roles
+assert find_3v3_flex(snipers, 250, now=ROLE_WAIT_LIMIT) is not None
+party_of_snipers = tuple(e._replace(party_id='snipers') for e in snipers[:3])
+assert [team[0] for team in pack_flex_teams(party_of_snipers, now=0.0)] == [['r0', 'r1', 'r2']]
+
+# pruning and the scan cap bound the packing of a deep queue whose roles rarely cover, and the deadline stops it early
+deep = tuple(entry(f'd{i}', rng.randint(800, 1400), roles=['artillery'] if i % 50 else ['tank']) for i in range(2000))
+per_anchor = FILL_CANDIDATES + FILL_CANDIDATES * (FILL_CANDIDATES - 1) // 2
+assert len(pack_flex_teams(deep, now=0.0)) <= len(deep) * per_anchor
+assert 2 <= len(pack_flex_teams(deep, now=0.0, deadline=0.0)) <= 2 * per_anchor
@@ -0,0 +1,46 @@
+# test functions #
+import time
+import asyncio
+from ravens_nest.metrics import *
+
+registry = MetricsRegistry()
+
+# histograms count every observation into the right bucket
+histogram = registry.histogram('test_seconds', 'test latency', command='solo_queue')
+histogram.observe(0.0002)
+histogram.observe(0.003)
+histogram.observe(20.0)
+assert histogram.count == 3 and histogram.counts[-1] == 1
+assert histogram.quantile(0.5) == 0.005
+
+# the same name and labels always give back the same metric
+assert registry.histogram('test_seconds', command='solo_queue') is histogram
+
+# timed works on plain functions and coroutines
+@timed('test_sync_seconds', registry=registry)
+def sync_call():
+    return 1
+
+@timed('test_async_seconds', registry=registry)
+async def async_call():
+    return 2
+
+assert sync_call() == 1 and asyncio.run(async_call()) == 2
+assert registry.histogram('test_sync_seconds').count == 1
+assert registry.histogram('test_async_seconds').count == 1
+
+# collectors and histograms render in the Prometheus text format
+registry.add_collector(lambda: [('test_queue_depth', {'queue': '1v1'}, 4)])
+rendered = registry.render()
+assert 'test_seconds_bucket{command="solo_queue",le="+Inf"} 3' in rendered
+assert 'test_queue_depth{queue="1v1"} 4' in rendered
+
+# an observation stays in the low microseconds
+observations = 100000
+start = time.perf_counter()
+for _ in range(observations):
+    with histogram.time():
+        pass
+per_event = (time.perf_counter() - start) / observations
+print(f'{per_event * 1e6:.2f} us per timed block')
+assert per_event < 20e-6
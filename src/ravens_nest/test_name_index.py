@@ -0,0 +1,45 @@
+# test functions #
+import time
+import random
+import asyncio
+from ravens_nest.name_index import *
+from ravens_nest.elo_core import *
+
+# prefix queries are case-insensitive, sorted and capped
+index = PrefixIndex(['Raven', 'rusty', 'Rummy', 'Walter', 'V.IV Rusty'])
+assert index.complete('ru') == ['Rummy', 'rusty']
+assert index.complete('R', limit=2) == ['Raven', 'Rummy']
+assert index.complete('x') == [] and index.complete('') == ['Raven', 'Rummy', 'rusty', 'V.IV Rusty', 'Walter']
+index.remove('Rummy')
+index.add('Ayre')
+assert 'Ayre' in index and 'Rummy' not in index and index.complete('ru') == ['rusty']
+
+# the registries keep their indexes up to date as players, teams and matches come and go
+player_registry = players_db()
+teams_registry = teams_db(player_registry)
+matches = match_db()
+roster = [Player(f'pilot_{i}') for i in range(6)]
+player_registry.add_players(roster)
+assert player_registry.name_index.complete('pilot_') == [f'pilot_{i}' for i in range(6)]
+player_registry.remove_player('pilot_5')
+assert 'pilot_5' not in player_registry.name_index
+teams_registry.add_team(team('Redguns', roster[:3]))
+assert teams_registry.name_index.complete('red') == ['Redguns']
+
+new_match = match('1v1', player_alpha=roster[0], player_beta=roster[1])
+new_match.setup_match_parameters()
+matches.add_match(new_match)
+assert matches.pending_index.complete(str(new_match.match_id)[:3]) == [new_match.match_id]
+asyncio.run(matches.report_match_async(new_match.match_id, roster[0], roster[1]))
+assert new_match.match_id not in matches.pending_index
+
+# a query over 50k names answers far inside Discord's autocomplete deadline
+rng = random.Random(0)
+names = [''.join(rng.choices('abcdefghijklmnopqrstuvwxyz', k=10)) for _ in range(50000)]
+index = PrefixIndex(names)
+start = time.perf_counter()
+for name in names[:1000]:
+    assert name in index.complete(name[:4])
+per_query = (time.perf_counter() - start) / 1000
+print(f'{per_query * 1e6:.1f} us per prefix query over {len(index)} names')
+assert per_query < 1e-3
@@ -0,0 +1,80 @@
+# test functions #
+import time
+import asyncio
+from ravens_nest.metrics import *
+from ravens_nest.notifications import *
+
+class FakeHTTPError(Exception):
+    def __init__(self, status, retry_after=None):
+        super().__init__(f'status {status}')
+        self.status = status
+        self.retry_after = retry_after
+
+class FakeChannel:
+    def __init__(self, channel_id, failures=()):
+        self.id = channel_id
+        self.failures = list(failures) # exceptions raised by the first sends
+        self.messages = []
+        self.send_times = []
+
+    async def send(self, content):
+        self.send_times.append(time.monotonic())
+        if self.failures:
+            raise self.failures.pop(0)
+        self.messages.append(content)
+
+# long messages are split and short ones are joined up to the message limit
+assert batch_messages(['a' * 10, 'b' * 10, 'c' * 25], limit=25) == ['a' * 10 + '\n' + 'b' * 10, 'c' * 25]
+assert batch_messages(['x' * 30], limit=25) == ['x' * 25, 'x' * 5]
+
+async def burst():
+    notifier = NotificationQueue(batch_window=0.01, registry=MetricsRegistry())
+    channel = FakeChannel(1)
+    for i in range(20):
+        notifier.post(channel, f'Match {i} popped.')
+    await notifier.join()
+    return notifier, channel
+
+# a burst of pops to one channel goes out as a single message
+notifier, channel = asyncio.run(burst())
+assert len(channel.messages) == 1 and channel.messages[0].count('popped') == 20
+assert notifier.pending() == 0
+
+async def rate_limited():
+    notifier = NotificationQueue(batch_window=0.01, registry=MetricsRegistry())
+    channel = FakeChannel(2, failures=[FakeHTTPError(429, retry_after=0.2)])
+    notifier.post(channel, 'Announcement')
+    await notifier.join()
+    channel.failures.append(FakeHTTPError(403))
+    notifier.post(channel, 'Second announcement')
+    await notifier.join()
+    return notifier, channel
+
+# a 429 holds the destination for the retry-after and retries, a 403 is dropped
+notifier, channel = asyncio.run(rate_limited())
+assert channel.messages == ['Announcement']
+assert channel.send_times[1] - channel.send_times[0] >= 0.2
+assert notifier.rate_limited.value == 1 and notifier.failed.value == 1 and notifier.sent.value == 1
+
+async def direct_messages():
+    notifier = NotificationQueue(batch_window=0.01, registry=MetricsRegistry())
+    users = {7: FakeChannel(7), 8: FakeChannel(8)}
+    async def resolve_user(user_id):
+        return users[user_id]
+    for user_id in users:
+        notifier.post_dm(user_id, resolve_user, 'Your match is ready.')
+    await notifier.join()
+    return users
+
+# DMs resolve the user in the delivery task and reach every player
+users = asyncio.run(direct_messages())
+assert all(user.messages == ['Your match is ready.'] for user in users.values())
+
+# a destination is paced to its rate
+async def paced():
+    limiter = RateLimiter(rate=2, period=0.2)
+    start = time.monotonic()
+    for _ in range(3):
+        await limiter.acquire()
+    return time.monotonic() - start
+assert asyncio.run(paced()) >= 0.2
@@ -67,3 +67,34 @@ test_3s_flex_match = threes_flex_queue.get_valid_match_from_queue()
 test_3s_flex_match.setup_match_parameters()
 test_3s_flex_match.report_match_results(test_3s_flex_match.team_alpha, test_3s_flex_match.team_beta)
 matches_db.add_match(test_3s_flex_match)
+
+# parties leave the queue as a whole, and their bookkeeping goes with them
+party_queue = MatchQueue('3v3 flex', player_registry, teams_registry)
+party_queue.enqueue_party([hooli, kraydle])
+party_queue.enqueue_player(fish)
+party_id = party_queue.queued_players['Hooli'].party_id
+assert party_queue.parties[party_id].names == ['Hooli', 'Kraydle']
+party_queue.dequeue_party(party_id)
+assert list(party_queue.queued_players) == ['Fish'] and not party_queue.parties
+
+# leaving takes the whole party along
+party_queue.enqueue_party([hooli, kraydle])
+assert sorted(party_queue.leave('Kraydle')) == ['Hooli', 'Kraydle']
+assert list(party_queue.queued_players) == ['Fish']
+
+# parties are validated before anyone is queued, and a member leaving takes the party along
+for invalid in ([], [hooli, hooli], [hooli, kraydle, fish, Player('Fourth')]):
+    try:
+        party_queue.enqueue_party(invalid)
+        raise AssertionError(f'invalid party {invalid} was queued')
+    except ValueError:
+        pass
+try:
+    party_queue.enqueue_party([hooli, fish])
+    raise AssertionError('a party was queued with a member already in queue')
+except ValueError:
+    assert list(party_queue.queued_players) == ['Fish']
+duo = party_queue.enqueue_party(Party([hooli, kraydle]))
+assert duo.ELO == (hooli.player_teams_ELO + kraydle.player_teams_ELO) / 2
+party_queue.dequeue_player(kraydle)
+assert list(party_queue.queued_players) == ['Fish'] and not party_queue.parties
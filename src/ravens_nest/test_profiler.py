@@ -0,0 +1,67 @@
+# test functions #
+import os
+import signal
+import asyncio
+import threading
+import tempfile
+from ravens_nest.profiler import *
+
+def busy_matchmaking_scan():
+    total = 0
+    for i in range(20000):
+        total += i * i
+    return total
+
+async def busy_loop(seconds):
+    loop = asyncio.get_running_loop()
+    end = loop.time() + seconds
+    while loop.time() < end:
+        busy_matchmaking_scan()
+        await asyncio.sleep(0)
+
+async def profile_busy_loop(profile_dir):
+    profiling = asyncio.create_task(profile_event_loop(0.5, interval=0.002, profile_dir=profile_dir))
+    await asyncio.sleep(0)
+
+    # only one profile runs at a time
+    try:
+        await profile_event_loop(0.1, profile_dir=profile_dir)
+        assert False, 'second profile should have been refused'
+    except ValueError:
+        pass
+
+    # the profiled loop keeps running while the sampler collects
+    await busy_loop(0.6)
+    return await profiling
+
+profile_dir = tempfile.mkdtemp()
+sampler, file_path = asyncio.run(profile_busy_loop(profile_dir))
+
+# the busy function dominates the samples and the collapsed file is written
+assert sampler.samples > 10
+assert 'busy_matchmaking_scan' in sampler.top_functions(1)[0][0]
+with open(file_path, 'r') as file:
+    lines = file.read().splitlines()
+assert lines and all(line.rsplit(' ', 1)[1].isdigit() for line in lines)
+assert sum(int(line.rsplit(' ', 1)[1]) for line in lines) == sampler.samples
+print(sampler.summary(5))
+
+# the lock is released afterwards
+sampler, _ = asyncio.run(profile_event_loop(0.05, profile_dir=profile_dir))
+
+# a cancelled profile stops sampling and releases the lock
+async def cancel_profile():
+    profiling = asyncio.create_task(profile_event_loop(5, profile_dir=profile_dir))
+    await asyncio.sleep(0.05)
+    profiling.cancel()
+    try:
+        await profiling
+        raise AssertionError('the profile was not cancelled')
+    except asyncio.CancelledError:
+        pass
+
+threads, handler = threading.active_count(), signal.getsignal(signal.SIGPROF)
+asyncio.run(cancel_profile())
+assert signal.getitimer(signal.ITIMER_PROF) == (0.0, 0.0) and signal.getsignal(signal.SIGPROF) == handler
+assert threading.active_count() == threads
+sampler, _ = asyncio.run(profile_event_loop(0.05, profile_dir=profile_dir))
@@ -0,0 +1,90 @@
+# test functions #
+import os
+import asyncio
+import tempfile
+from ravens_nest.elo_core import *
+from ravens_nest.guild_state import *
+from ravens_nest.seasons import *
+
+# soft resets pull every rating halfway to the ladder mean by default
+assert soft_reset([1000, 1400, 1800]) == [1200, 1400, 1600]
+assert soft_reset([1000, 1400], compression=0) == [1000, 1400] and soft_reset([]) == []
+try:
+    soft_reset([1000], compression=1.5)
+    raise AssertionError('a compression above 1 was accepted')
+except ValueError:
+    pass
+
+# build a season with a 1v1 result, a 3v3 reg result and a pending match
+guild_states = GuildStateManager(tempfile.mkdtemp())
+state = guild_states.get(1)
+state.player_registry.add_players([Player(name, 'Koolish' if name in ('Hooli', 'Kraydle', 'Fish') else 'RnS')
+                                   for name in ('Hooli', 'Kraydle', 'Fish', 'RamenRook', 'Risa', 'Sabbath')])
+hooli, kraydle, fish, ramenrook, risa, sabbath = state.player_registry.players
+state.teams_registry.add_team(team('Koolish', [hooli, kraydle, fish]))
+state.teams_registry.add_team(team('RnS', [ramenrook, risa, sabbath]))
+for _ in range(PLACEMENT_MATCHES + 3):
+    singles = match('1v1', hooli, kraydle)
+    singles.setup_match_parameters()
+    state.matches_db.add_match(singles)
+    state.matches_db.update_match(singles.match_id, hooli, kraydle)
+    reg = match('3v3 reg', team_alpha=state.teams_registry.teams[0], team_beta=state.teams_registry.teams[1])
+    reg.setup_match_parameters()
+    state.matches_db.add_match(reg)
+    state.matches_db.update_match(reg.match_id, state.teams_registry.teams[1], state.teams_registry.teams[0])
+pending = match('1v1', fish, risa)
+pending.setup_match_parameters()
+state.matches_db.add_match(pending)
+disputed = match('1v1', kraydle, sabbath)
+disputed.setup_match_parameters()
+state.matches_db.add_match(disputed)
+asyncio.run(state.matches_db.submit_report(disputed.match_id, 'alpha', 'alpha', 'alpha claim'))
+asyncio.run(state.matches_db.submit_report(disputed.match_id, 'beta', 'beta', 'beta claim'))
+assert disputed.match_status == 'disputed'
+season_one_hooli = (hooli.player_singles_ELO, hooli.singles_wins, hooli.player_singles_rank)
+top_team_ELO = state.teams_registry.get_team('RnS').team_ELO
+
+# resetting archives season 1 and soft-resets the live ladder
+assert state.reset_season() == 1
+assert state.settings['season'] == 2 and state.archived_seasons() == [1]
+assert os.path.exists(state.season_archive_path(1))
+assert hooli.singles_wins == 0 and hooli.player_singles_ELO < season_one_hooli[0]
+assert state.teams_registry.get_team('RnS').team_ELO < top_team_ELO
+# unresolved matches carry over with their reports, and only they stay offered for reporting
+assert [m.match_id for m in state.matches_db.matches] == [pending.match_id, disputed.match_id]
+assert disputed.reports == {'alpha': 'alpha', 'beta': 'beta'}
+assert len(state.matches_db.pending_index) == 2 and pending.match_id in state.matches_db.pending_index and disputed.match_id in state.matches_db.pending_index
+assert hooli.player_singles_rank == get_rank_from_ELO(hooli.player_singles_ELO)
+
+# past seasons are queried from the archive with the same objects the live registries return
+players, teams = state.season_registries(1)
+archived_hooli = players.get_player('Hooli')
+assert (archived_hooli.player_singles_ELO, archived_hooli.singles_wins, archived_hooli.player_singles_rank) == season_one_hooli
+assert 'Stats for Hooli' in str(archived_hooli) and players.get_player('Nobody') is None
+assert players.get_top_singles_players(1)[0].player_name == 'Hooli'
+assert teams.get_top_teams(1)[0].team_name == 'RnS' and teams.get_top_teams(1)[0].team_ELO == top_team_ELO
+assert [p.player_name for p in teams.get_team('Koolish').roster] == ['Hooli', 'Kraydle', 'Fish']
+assert players.count_matches() == 2 * (PLACEMENT_MATCHES + 3)
+assert state.season_registries(2) == (state.player_registry, state.teams_registry)
+try:
+    state.season_registries(7)
+    raise AssertionError('an unarchived season was returned')
+except ValueError:
+    pass
+
+# the season number and archive survive an eviction
+guild_states.evict(1)
+state = guild_states.get(1)
+assert state.settings['season'] == 2 and state.season_registries(1)[0].get_player('Hooli').singles_wins == season_one_hooli[1]
+assert state.player_registry.get_player('Hooli').singles_wins == 0
+
+# teams with empty roster slots are archived with the slots kept
+shorthanded = GuildStateManager(tempfile.mkdtemp()).get(2)
+lone = Player('Lone')
+shorthanded.player_registry.add_player(lone)
+shorthanded.teams_registry.add_team(team('Shorthanded', [lone, None, None]))
+assert shorthanded.reset_season() == 1
+archived_team = shorthanded.season_registries(1)[1].get_team('Shorthanded')
+assert archived_team.roster[0].player_name == 'Lone' and archived_team.roster[1:] == [None, None]
+reloaded = GuildStateManager(os.path.dirname(shorthanded.data_path)).get(2)
+assert reloaded.teams_registry.get_team('Shorthanded').roster == [reloaded.player_registry.get_player('Lone'), None, None]